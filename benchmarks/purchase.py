@@ -0,0 +1,109 @@
+"""
+End-to-end cost of the purchases of the bot on a SimulatedExchange (no network needed).
+The overhead is the time spent by the bot for a purchase (order, fill confirmation, ledger, stats, charts
+submission...), excluding the latency injected in the exchange calls. The first purchase (imports, workers startup)
+is not measured. Run from the root folder:
+    python -m benchmarks.purchase --purchases 200 --latency 0.01
+"""
+import argparse
+import datetime
+import logging
+from pathlib import Path
+import statistics
+import tempfile
+import time
+import yaml
+from dca_bot import Dca
+from utils.async_engine import AsyncExecutionEngine
+from utils.fill_tracker import FillTracker, LatencyProfiles
+from utils.misc import format_table
+from utils.simulated_exchange import SimulatedExchange, AsyncSimulatedExchange
+
+coins = {'BTC': {'PAIRING': 'USDT', 'AMOUNT': 20, 'CYCLE': 'minutely'},
+         'ETH': {'PAIRING': 'USDT', 'AMOUNT': 15, 'CYCLE': 'minutely'},
+         'XRP': {'PAIRING': 'USDT', 'AMOUNT': 10, 'CYCLE': 'minutely'}}
+
+variable_amount = {'RANGE': [10, 50], 'PRICE_RANGE': [20000, 40000], 'MAPPING': 'linear'}
+
+# name -> (coins to buy, coin configuration updates, SimulatedExchange arguments)
+scenarios = {
+    'classic (quoteOrderQty)': (['BTC'], {}, {}),
+    'classic (fill polling)': (['BTC'], {}, {'exchange_id': 'kraken', 'fill_delay': 0.05}),
+    'fees from trades': (['BTC'], {}, {'exchange_id': 'kraken', 'report_fees': False}),
+    'variable amount': (['BTC'], {'AMOUNT': variable_amount}, {}),
+    'network errors (20%)': (['BTC'], {}, {'errors': {'create_order': 0.2}}),
+    'batch of 3 coins': (['BTC', 'ETH', 'XRP'], {}, {}),
+}
+
+
+def price_path(n, start, step):
+    return [start + step * ((i % 20) - 10) for i in range(n)]
+
+
+def run_scenario(name, purchases, latency, seed=0):
+    """
+    Buy "purchases" times and return the overhead (in seconds) of each purchase
+    """
+    coin_list, updates, arguments = scenarios[name]
+    paths = {'BTC/USDT': price_path(purchases + 10, 30000, 200),
+             'ETH/USDT': price_path(purchases + 10, 2000, 20),
+             'XRP/USDT': price_path(purchases + 10, 0.5, 0.01)}
+    exchange = SimulatedExchange(paths, balance={'USDT': 1e9}, latency=latency, seed=seed, **arguments)
+
+    with tempfile.TemporaryDirectory() as folder:
+        folder = Path(folder)
+        cfg = {'COINS': {coin: dict(coins[coin], **updates) for coin in coin_list},
+               'EXCHANGE': exchange.id, 'TEST': True, 'SEND_NOTIFICATIONS': False, 'BATCH_WINDOW': 60}
+        with open(folder / 'config.yml', 'w') as file:
+            yaml.dump(cfg, file)
+        with open(folder / 'api.yml', 'w') as file:
+            yaml.dump({exchange.id.upper(): {'TEST': {'APIKEY': 'simulated', 'SECRET': 'simulated'}}}, file)
+
+        bot = Dca(folder / 'config.yml', folder / 'api.yml', trades_dir=folder / 'trades', exchange=exchange)
+        if len(coin_list) > 1:
+            async_exchange = AsyncSimulatedExchange(exchange)
+            bot.engine = AsyncExecutionEngine(async_exchange,
+                                              fill_tracker=FillTracker(async_exchange, profiles=LatencyProfiles()))
+
+        overhead = []
+        for _ in range(purchases + 1):
+            for coin in coin_list:
+                # every coin is due now
+                bot.order_book[coin] = datetime.datetime.now()
+            bot.update_order_book()
+            start = time.perf_counter()
+            in_latency = exchange.time_in_latency
+            bot.check_next_funds()
+            bot.buy_due()
+            overhead.append(time.perf_counter() - start - (exchange.time_in_latency - in_latency))
+        calls = dict(exchange.calls)
+
+        bot.renderer.shutdown()
+        bot.fee_reconciler.close()
+        if bot.engine is not None:
+            bot.engine.close()
+    return overhead[1:], calls
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark the purchases on a simulated exchange')
+    parser.add_argument('--purchases', type=int, default=100, help='purchases per scenario')
+    parser.add_argument('--latency', type=float, default=0.0, help='latency of each exchange call (s)')
+    parser.add_argument('--scenario', nargs='*', default=list(scenarios), help='scenarios to run')
+    parser.add_argument('--verbose', action='store_true', help='show the log of the bot')
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+
+    rows = []
+    for name in args.scenario:
+        overhead, calls = run_scenario(name, args.purchases, args.latency)
+        overhead_ms = sorted(1000 * x for x in overhead)
+        rows.append((name, [f"{statistics.mean(overhead_ms):.2f}",
+                            f"{statistics.median(overhead_ms):.2f}",
+                            f"{overhead_ms[int(0.95 * (len(overhead_ms) - 1))]:.2f}",
+                            f"{sum(calls.values()) / args.purchases:.1f}"]))
+    print(f"{args.purchases} purchases per scenario, {args.latency} s latency per call")
+    print(format_table(rows, ['mean ms', 'p50 ms', 'p95 ms', 'calls/purchase'], index_name='scenario'))
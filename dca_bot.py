@@ -1,183 +1,414 @@
-from utils.timing import *
-from utils.exchange import *
-from utils.stats_and_plots import *
+import time
+_startup = time.perf_counter()  # used to profile the startup (imports included)
+
+from utils.timing import (get_hour_minute, get_on_day, get_on_weekday, next_purchase_time, sleep_until,
+                          StartupProfiler)
+from utils.exchange import (check_cost_limits, connect_to_exchange, get_non_zero_balance, get_price,
+                            get_quantity_to_buy, has_fee, order_to_dataframe)
+from utils.misc import format_table, lazy_import, load_config, read_csv_custom, register_logger
+from utils.stats_and_plots import CoinStats
 from utils.mail_notifier import Notifier
-from utils.trade_strategies import PriceMapper
-
-import ccxt
+from utils.trade_strategies import get_strategy
+from utils.storage import open_storage
+from utils.fee_reconciler import FeeReconciler
+from utils.balance import BalanceCache, funding_forecast
+from utils.chart_renderer import ChartRenderer
+from utils.scheduler import Scheduler
+from utils.async_engine import AsyncExecutionEngine
+from utils.market_cache import MarketCache
+from utils.quotes import QuoteSnapshot
+from utils.fill_tracker import FillTimeout, FillTracker, LatencyProfiles, open_order_stream, PendingFills
+from utils.metrics import Metrics
+from utils.http_pool import HttpPool
+from utils.log_handlers import LazyFormat
+from utils.retry_policy import CircuitBreaker, retry_policies
+from utils.checkpoint import Checkpoint
+
+import argparse
+import csv
+import datetime
 import logging
-import time
+import math
 from dateutil.relativedelta import relativedelta
-import pandas as pd
 from pathlib import Path
 import os
+import threading
+
+ccxt = lazy_import('ccxt')
 
 
 class Dca(object):
-    def __init__(self, cfg_path, api_path):
-        # create logger
-        log_file = Path('trades/log.txt')
-        log_file.parent.mkdir(parents=True, exist_ok=True)
-        register_logger(log_file=log_file)
-        logging.info('Program started. Initializing variables...')
+    def __init__(self, cfg_path, api_path, profile_startup=False, trades_dir='trades', resources=None, exchange=None,
+                 name=''):
+        """
+        Args:
+            cfg_path: configuration file
+            api_path: API keys file
+            profile_startup: if True, log the duration of each startup phase
+            trades_dir: folder where orders, stats, charts and logs are stored
+            resources: ExchangePool shared with other portfolios (clients, market metadata, prices, charts).
+                In this case, the logger is set up by the owner of the pool
+            exchange: exchange to use instead of connecting to the one in the configuration
+                (e.g., a SimulatedExchange)
+            name: name of the portfolio (label of its metrics, with resources)
+        """
+        profiler = StartupProfiler(_startup)
+        profiler.mark('imports')
+
+        self.trades_dir = Path(trades_dir)
+        self.resources = resources
 
         # loads local configuration
         cfg = load_config(cfg_path)
         api = load_config(api_path)
 
+        # create logger
+        self.trades_dir.mkdir(parents=True, exist_ok=True)
+        if resources is None:
+            register_logger(log_file=self.trades_dir / 'log.txt', cfg=cfg)
+        logging.info('Program started. Initializing variables...')
+
         # Store cfg
         self.cfg = cfg
+        self.api = api
+        profiler.mark('logger and configuration')
+
+        # duration of the purchase phases (exported in the Prometheus text format)
+        # (with resources, they are served by the endpoint of the pool)
+        if resources is None:
+            self.metrics = Metrics(self.cfg['EXCHANGE'].lower(), enabled=self.cfg.get('METRICS', False))
+            if self.cfg.get('METRICS_PORT'):
+                self.metrics.serve(self.cfg['METRICS_PORT'])
+        else:
+            self.metrics = resources.metrics_of(self.cfg, name)
+        self.metrics_path = Path(self.cfg.get('METRICS_FILE') or self.trades_dir / 'metrics.prom')
 
         # initialize notifier
         if self.cfg['SEND_NOTIFICATIONS']:
-            self.notify = Notifier(self.cfg)
+            if resources is None:
+                self.notify = Notifier(self.cfg, trades_dir=self.trades_dir, metrics=self.metrics)
+            else:
+                self.notify = resources.notifier(self.cfg, self.trades_dir)
+
+        # keep-alive sessions of the exchange clients
+        if resources is None:
+            self.http = HttpPool.from_config(self.cfg, metrics=self.metrics)
+        else:
+            self.http = resources.http
 
         try:
-            self.exchange = connect_to_exchange(self.cfg, api)
+            if exchange is not None:
+                self.exchange = exchange
+            elif resources is None:
+                self.exchange = connect_to_exchange(self.cfg, api, http=self.http)
+            else:
+                self.exchange = resources.client(self.cfg, api)
         except Exception as e:
             if self.cfg['SEND_NOTIFICATIONS']:
                 self.notify.critical(e, "lunching the both running")
             raise e
+        profiler.mark('connection to the exchange')
+
+        # pauses all the purchases on the exchange after repeated network errors (shared by the portfolios, which
+        # do not checkpoint it: the pool does)
+        if resources is None:
+            self.breaker = CircuitBreaker.from_config(self.cfg, metrics=self.metrics)
+        else:
+            self.breaker = resources.breaker(self.cfg)
+
+        # balance of the account (shared by the funds checks, invalidated at every fill)
+        if resources is None:
+            self.balances = BalanceCache(self.exchange, ttl=self.cfg.get('BALANCE_TTL', 60))
+        else:
+            self.balances = resources.balances(self.cfg, api)
+        self.funding_horizon = self.cfg.get('FUNDING_HORIZON', 7) * 24 * 60 * 60
+        self.funding_warnings = {}  # pairing -> time of the first purchase that cannot be funded (last warning)
 
         # Show balance
         try:
-            balance = get_non_zero_balance(self.exchange, sort_by='total')
-            if balance.shape[0] == 0:
+            balance = get_non_zero_balance(self.exchange, sort_by='total', balance=self.balances.get())
+            if len(balance) == 0:
                 balance_str = 'No coin found in your wallet!'  # is it worth going on?
             else:
-                balance_str = balance.to_string()
-            logging.info("Your balance from the exchange:\n" + balance_str + "\n")
+                # the table is formatted by the logging thread
+                balance_str = LazyFormat(format_table,
+                                         [(coin, [b['free'], b['used'], b['total']]) for coin, b in balance],
+                                         ['free', 'used', 'total'])
+            logging.info("Your balance from the exchange:\n%s\n", balance_str)
         except Exception as e:
             logging.warning("Balance checking failed: " + type(e).__name__ + " " + str(e))
+        profiler.mark('balance')
+
+        # charts are rendered in background processes
+        if resources is None:
+            self.renderer = ChartRenderer(workers=self.cfg.get('CHART_WORKERS', 1))
+        else:
+            self.renderer = resources.renderer
 
         # Store coin info into a local variable
         self.coin = {}
         for coin in cfg['COINS']:
             self.coin[coin.upper()] = cfg['COINS'][coin]
 
-        self.order_book = {}
-        self.coin_to_buy = []
-        self.next_order = []
-
-        # create trade folder and define csv filepath (for orders)
-        self.csv_path = Path('trades/orders.csv')
-        if Path(self.csv_path).is_file():
-            self.df_orders = read_csv_custom(self.csv_path)
+        # market metadata (precision and limits) of the configured symbols are cached on disk
+        symbols = [coin + '/' + self.coin[coin]['PAIRING'] for coin in self.coin]
+        if resources is None:
+            self.market_cache = MarketCache(self.exchange, symbols, self.trades_dir / 'markets.json',
+                                            ttl=self.cfg.get('MARKETS_TTL', 24*60*60), sandbox=self.cfg['TEST'])
+            self.market_cache.load()
         else:
-            self.df_orders = pd.DataFrame()
+            self.market_cache = resources.market_cache(self.cfg)  # already loaded with the client
+        profiler.mark('market metadata')
 
-        # define csv filepath for stats
-        self.stats_path = Path('trades/stats.csv')
-        if Path(self.stats_path).is_file():
-            self.df_stats = read_csv_custom(self.stats_path)
+        # last prices of all the configured symbols (shared by the buy decision and the order sizing)
+        if resources is None:
+            self.quotes = QuoteSnapshot(self.exchange, symbols, max_age=self.cfg.get('QUOTE_MAX_AGE', 5))
         else:
-            self.df_stats = pd.DataFrame([], columns=['Coin', 'N', 'Quantity', 'AvgPrice', 'TotalCost', 'ROI', 'ROI%'])
-            self.df_stats.set_index(['Coin'], inplace=True)
+            self.quotes = resources.quotes(self.cfg)
 
-        # define json filepath (for orders)
-        self.json_path = Path('trades/orders.json')
+        self.order_book = Scheduler()
+        self.coin_to_buy = []
+        self.next_order = []
 
-        # define path for order_book (next_purchases)
-        self.order_book_path = Path('trades/next_purchases.csv')
+        # orders, stats and schedule (files or sqlite, see STORAGE)
+        # stats are derived from the running aggregates, which are loaded from the storage (on first use)
+        self.storage = open_storage(self.cfg, self.trades_dir, metrics=self.metrics)
+        self.coin_stats = None
+
+        # fees missing from the orders are resolved later (from the trades history), while waiting for the next
+        # purchase
+        if resources is None or exchange is not None:
+            self.fee_reconciler = FeeReconciler(self.exchange, self.storage, self.trades_dir / 'fees.db',
+                                                interval=self.cfg.get('FEE_RECONCILE_INTERVAL', 60))
+            self.fee_source = None
+        else:
+            # one reconciler per account for all the portfolios
+            self.fee_reconciler, self.fee_source = resources.fee_reconciler(self.cfg, api, self.storage,
+                                                                            self.trades_dir / 'fees.db')
+
+        # define path for order_book (next_purchases). The csv is a readable summary written at startup, while
+        # the schedule of the storage is updated (only for the changed coins) at every iteration
+        self.order_book_path = self.trades_dir / 'next_purchases.csv'
+        # schedule and error state of the coins, saved after every change to restart exactly where the bot stopped
+        self.checkpoint = Checkpoint(self.trades_dir / 'checkpoint.json')
 
         # check if the amount is fixed or is variable depending on the price range
         self.get_dca_strategy()
 
         # Get the 'SCHEDULE' time for each coin and initialize order_book
         self.initialize_order_book()
-        df = self.update_order_book()  # ensure the order book is written to disk and the set the next coin to buy
-        logging.info("Summary of the investment plans:\n" + df.to_string() + "\n")
+        self.update_order_book()  # ensure the order book is written to disk and the set the next coin to buy
+        summary = self.write_order_book_summary()
+        logging.info("Summary of the investment plans:\n%s\n", summary)
+        profiler.mark('strategies and order book')
 
-        # get retry times for errors
-        self.retry_for_funds, self.retry_for_network = retry_info()
+        # retry policies (cycle -> RetryPolicy) for errors
+        self.retry_for_funds, self.retry_for_network = retry_policies(self.cfg)
 
         # Check coin limits
         check_cost_limits(self.exchange, self.coin)
+        profiler.mark('cost limits')
+
+        # fill confirmation (adaptive polling based on the latency of the previous fills), ended earlier by the
+        # updates pushed by the exchange if it offers an order stream (opened on the first order not filled at once)
+        self.order_stream = None
+        self.stream_lock = threading.Lock()  # the engine's tracker may open it from its own thread
+        self.stream_enabled = self.cfg.get('ORDER_STREAM', True) and exchange is None
+        self.fill_latency = LatencyProfiles(self.trades_dir / 'fill_latency.json')
+        self.fill_tracker = FillTracker(self.exchange, deadline=self.cfg.get('FILL_DEADLINE', 30),
+                                        profiles=self.fill_latency,
+                                        open_stream=self.get_order_stream if self.stream_enabled else None)
+        # orders not confirmed as filled within the deadline, recorded once filled
+        self.pending_fills = PendingFills(self.exchange, self.trades_dir / 'fills.db')
+
+        # engine used to buy concurrently the coins scheduled at the same time (created on first use)
+        self.batch_window = self.cfg.get('BATCH_WINDOW', 0)
+        # seconds before each purchase in which the connection, the metadata and the prices are made ready
+        self.prewarm = self.cfg.get('PREWARM', 2)
+        self.engine = None
+        # an injected exchange has no async counterpart: its engine, if any, is set by the caller
+        self.concurrent_orders = self.cfg.get('CONCURRENT_ORDERS', True) and len(self.coin) > 1 and exchange is None
 
         if self.cfg['SEND_NOTIFICATIONS']:
             info = 'DCA bot has just been started'
             self.notify.info(info)
 
         logging.info('Everything up and running!')
+        profiler.mark('notification')
 
-        while True:
-
-            #logging.info('Initializing next order...')
-            #self.find_next_order()
-
-            # do not check funds if last attempt failed due to insufficient Funds
-            if not isinstance(self.coin[self.coin_to_buy]['LASTERROR'], ccxt.InsufficientFunds):
-                self.check_funds()
+        if profile_startup:
+            logging.info(profiler.report())
 
+    def run(self):
+        """
+        Buy the coins according to their schedule (forever)
+        """
+        while True:
+            self.check_next_funds()
             self.wait()
+            self.buy_due()
+
+    def check_next_funds(self):
+        # do not check funds if last attempt failed due to insufficient Funds
+        if not isinstance(self.coin[self.coin_to_buy]['LASTERROR'], ccxt.InsufficientFunds):
+            self.check_funds()
 
+    def buy_due(self):
+        """
+        Buy the next coin (and, concurrently, the coins due within the batch window). Then update the order book
+        """
+        if len(self.pending_fills) > 0:
+            self.record_pending_fills()
+        resume_time = self.breaker.resume_time()
+        if self.breaker.is_open() and resume_time is not None:
+            # the exchange is unreachable (according to this or another portfolio)
+            self.pause_purchases(resume_time)
+        elif self.breaker.is_half_open():
+            # a single purchase probes the exchange, the others follow (together) if it succeeds
             self.buy()
+        else:
+            coins = self.order_book.due(self.next_order[1] + datetime.timedelta(seconds=self.batch_window))
+            if len(coins) > 1 and self.get_engine() is not None:
+                self.buy_batch(coins)
+            else:
+                self.buy()
+
+        self.update_order_book()
+        self.metrics.write(self.metrics_path)
 
-            self.update_order_book()
+    def record_pending_fills(self):
+        """
+        Record the orders filled after the deadline of a previous purchase (see PendingFills)
+        """
+        try:
+            filled = self.pending_fills.check()
+        except Exception as e:
+            logging.warning(f"Couldn't check the pending orders: {type(e).__name__} {str(e)}")
+            return
+        for coin, order in filled:
+            logging.info(f"Order {order['id']} ({coin}) filled after the deadline")
+            self.record_order(coin, order)
 
     def update_order_book(self):
         """
-        Write to disk the order_book. The order_book is required to identify the correct bi-weekly purchase time
-        in case the bot is restarted.
+        Write to disk the order_book (only the coins that were rescheduled). The order_book is required to
+        identify the correct bi-weekly purchase time in case the bot is restarted.
         Also, Find (and set) the closest coin to buy.
         """
 
         # first element is the coin, second element the time
-        self.next_order = min(self.order_book.items(), key=lambda x: x[1])
+        self.next_order = self.order_book.peek()
         self.coin_to_buy = self.next_order[0]
 
-        # Save the order book to disk
-        ordered_order_book = dict(sorted(self.order_book.items(), key=lambda item: item[1]))
-        df = pd.DataFrame([ordered_order_book]).T.rename_axis('Coin').rename(columns={0: 'Purchase Time'})
-        cycle = []
-        strategy = []
-        for coin in df.index:
-            cycle.append(self.coin[coin]['CYCLE'].lower())
-            strategy.append(self.coin[coin]['STRATEGY_STRING'])
-        df['Cycle'] = cycle
-        df['Strategy'] = strategy
-        df.to_csv(self.order_book_path)
-        return df
+        # Save the changed entries of the order book to disk
+        changed = {}
+        for coin in self.order_book.pop_changed():
+            changed[coin] = {'Purchase Time': str(self.order_book[coin]),
+                             'Cycle': self.coin[coin]['CYCLE'].lower(),
+                             'Strategy': self.coin[coin]['STRATEGY_STRING']}
+        if changed:
+            self.storage.schedule.update(changed)
+        self.save_checkpoint()
+
+    def schedule_settings(self, coin):
+        """
+        Settings defining the schedule of a coin (a checkpoint is used only if they did not change)
+        """
+        return {key: str(self.coin[coin].get(key)) for key in ['CYCLE', 'AT_TIME', 'ON_WEEKDAY', 'ON_DAY']}
+
+    def save_checkpoint(self):
+        """
+        Checkpoint the state of the scheduler (and of the circuit breakers of the pool, if shared)
+        """
+        self.checkpoint.save(self.checkpoint_state())
+        if self.resources is not None:
+            self.resources.save_breakers()
+
+    def checkpoint_state(self):
+        """
+        Return the state of the scheduler (purchase times, attempts and last errors of the coins, circuit breaker
+        unless it is shared by a pool)
+        """
+        coins = {}
+        for coin in self.coin:
+            error = self.coin[coin]['LASTERROR']
+            coins[coin] = {'settings': self.schedule_settings(coin),
+                           'schedule': self.coin[coin]['SCHEDULE'].isoformat(),
+                           'next': self.order_book[coin].isoformat(),
+                           'error_attempt': self.coin[coin]['ERROR_ATTEMPT'],
+                           'last_error': {'type': type(error).__name__, 'message': str(error)}
+                           if isinstance(error, Exception) else None}
+        if self.resources is not None:
+            return {'coins': coins}
+        return {'coins': coins, 'breaker': self.breaker.state()}
+
+    def restore_checkpoint(self, state):
+        """
+        Restore the schedule and the error state of the coins saved by the previous run. The coins whose schedule
+        settings changed since then keep the schedule computed from scratch.
+        A purchase due while the bot was stopped is done at once (only one, even if several were missed), unless
+        the stored orders show that it was done (the bot stopped before the checkpoint was saved)
+        """
+        now = datetime.datetime.today()
+        for coin, entry in state['coins'].items():
+            if coin not in self.coin or entry['settings'] != self.schedule_settings(coin):
+                continue
+            cycle = self.coin[coin]['CYCLE']
+            schedule = datetime.datetime.fromisoformat(entry['schedule'])
+            next_time = datetime.datetime.fromisoformat(entry['next'])
+            if next_time <= now:
+                last_order = self.storage.last_order_time(coin)
+                # the local time of the orders is stored without the fractions of second
+                if last_order is not None and last_order >= next_time.replace(microsecond=0):
+                    logging.info(f"The {coin} purchase of {next_time:%d %b %Y at %H:%M} was already done")
+                    schedule = next_time = next_purchase_time(schedule, cycle)
+                    entry = dict(entry, error_attempt=0, last_error=None)
+            if next_time <= now:
+                missed = 0
+                while next_purchase_time(schedule, cycle) <= now:
+                    schedule = next_purchase_time(schedule, cycle)
+                    missed += 1
+                if missed:
+                    logging.warning(f"{missed} {coin} purchase(s) missed while the bot was stopped")
+                next_time = now
+            self.coin[coin]['SCHEDULE'] = schedule
+            self.order_book[coin] = next_time
+            self.coin[coin]['ERROR_ATTEMPT'] = entry['error_attempt']
+            if entry['last_error'] is not None:
+                error_type = getattr(ccxt, entry['last_error']['type'], None)
+                if not (isinstance(error_type, type) and issubclass(error_type, Exception)):
+                    error_type = Exception
+                self.coin[coin]['LASTERROR'] = error_type(entry['last_error']['message'])
+        if self.resources is None and state.get('breaker') is not None:
+            self.breaker.restore(state['breaker'])
+
+    def write_order_book_summary(self):
+        """
+        Write to disk (csv) a readable summary of the order book. Return the summary as text (formatted lazily)
+        """
+        rows = []
+        for coin, purchase_time in self.order_book.items():
+            rows.append((coin, [purchase_time, self.coin[coin]['CYCLE'].lower(), self.coin[coin]['STRATEGY_STRING']]))
+        columns = ['Purchase Time', 'Cycle', 'Strategy']
+        with open(self.order_book_path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['Coin'] + columns)
+            for coin, values in rows:
+                writer.writerow([coin] + values)
+        return LazyFormat(format_table, rows, columns, index_name='Coin')
 
     def get_dca_strategy(self):
         for coin in self.coin:
             # to avoid confusion, remove any buy condition plot
-            if os.path.exists(f"trades/graph_{coin}_buy_conditions.png"):
-                os.remove(f"trades/graph_{coin}_buy_conditions.png")
-            if type(self.coin[coin]['AMOUNT']) is dict:
-
-                if 'RANGE' not in self.coin[coin]['AMOUNT'] or 'PRICE_RANGE' not in self.coin[coin]['AMOUNT'] or 'MAPPING' not in self.coin[coin]['AMOUNT']:
-                    raise Exception('If AMOUNT is a dictionary the following keys are required: '
-                                    '"AMOUNT", "PRICE_RANGE", "MAPPING".')
-                self.coin[coin]['MAPPER'] = PriceMapper(self.coin[coin]['AMOUNT']['RANGE'],
-                                                        self.coin[coin]['AMOUNT']['PRICE_RANGE'],
-                                                        self.coin[coin]['AMOUNT']['MAPPING'],
-                                                        coin,
-                                                        self.coin[coin]['PAIRING'])
-                self.coin[coin]['MAPPER'].plot()
-                self.coin[coin]['STRATEGY'] = 'VariableAmount'
-                cost = f"{self.coin[coin]['AMOUNT']['RANGE'][0]}-" \
-                       f"{self.coin[coin]['AMOUNT']['RANGE'][1]}"
-                price_range = f"{self.coin[coin]['AMOUNT']['PRICE_RANGE'][0]}-" \
-                       f"{self.coin[coin]['AMOUNT']['PRICE_RANGE'][1]}"
-                self.coin[coin]['STRATEGY_STRING'] = f"{cost} {self.coin[coin]['PAIRING']} to {price_range} {coin} {self.coin[coin]['AMOUNT']['MAPPING'][0:3]}."
-                if 'BUYBELOW' in self.coin[coin] and self.coin[coin]['BUYBELOW'] is not None:
-                    logging.warning('Option "BUYBELOW" is not compatible with a range of AMOUNT values. '
-                                    'Disabling it')
-                    self.coin[coin]['BUYBELOW'] = None
-            elif 'BUYBELOW' in self.coin[coin] and self.coin[coin]['BUYBELOW'] is not None:
-                # in this case the mapper is only used for plotting
-                self.coin[coin]['MAPPER'] = PriceMapper([0, self.coin[coin]['AMOUNT']],
-                                                        [0, self.coin[coin]['BUYBELOW']],
-                                                        'constant',
-                                                        coin,
-                                                        self.coin[coin]['PAIRING'])
-                self.coin[coin]['MAPPER'].plot()
-                self.coin[coin]['STRATEGY'] = 'BuyBelow'
-                self.coin[coin]['STRATEGY_STRING'] = f"BuyBelow {self.coin[coin]['BUYBELOW']} {self.coin[coin]['PAIRING']}"
-            else:
-                self.coin[coin]['STRATEGY'] = 'Classic'
-                self.coin[coin]['STRATEGY_STRING'] = f"Classic"
+            buy_conditions_path = self.trades_dir / f'graph_{coin}_buy_conditions.png'
+            if os.path.exists(buy_conditions_path):
+                os.remove(buy_conditions_path)
+            strategy, mapper, strategy_string = get_strategy(coin, self.coin[coin])
+            if mapper is not None:
+                self.coin[coin]['MAPPER'] = mapper
+                self.renderer.plot_buy_conditions(mapper, path=buy_conditions_path)
+            self.coin[coin]['STRATEGY'] = strategy
+            self.coin[coin]['STRATEGY_STRING'] = strategy_string
 
     # def find_next_order(self):
     #
@@ -199,34 +430,50 @@ class Dca(object):
 
     def check_funds(self):
         """
-        Check if there is sufficient money for the next purchase
+        Check if there is sufficient money for the next purchase and for all the purchases of the funding horizon
+        (FUNDING_HORIZON days), per pairing currency. A single balance is used for all the checks.
         """
         cost = self.coin[self.coin_to_buy]['AMOUNT']
         if type(cost) is dict:
             cost = cost['RANGE'][1]  # In this case we check for the maximum possible amount
         pairing = self.coin[self.coin_to_buy]['PAIRING']
         try:
-            balance = self.exchange.fetch_balance()
+            coin_balance = self.balances.available(pairing)
+            forecast = funding_forecast(self.coin, self.order_book.times(), self.balances,
+                                        self.funding_horizon)
         except:
-            balance = []
             logging.warning("Balance checking failed.")
+            return
 
-        if balance:
-            # the Kraken API returns total only
-            balance_type = 'total' if self.exchange.id == 'kraken' else 'free'
-            if pairing in balance[balance_type]:
-                coin_balance = balance[balance_type][pairing]
-            else:
-                coin_balance = 0
-            if cost > coin_balance:
-                logging.warning(f"Insufficient funds for the next {self.coin_to_buy} purchase. Top up your account!")
-                if self.cfg['SEND_NOTIFICATIONS']:
-                    next_purchase = self.next_order[1].strftime('%d %b %Y at %H:%M')
-                    self.notify.warning_funds(self.coin_to_buy,
-                                              next_purchase,
-                                              pairing,
-                                              cost,
-                                              coin_balance)
+        if cost > coin_balance:
+            logging.warning(f"Insufficient funds for the next {self.coin_to_buy} purchase. Top up your account!")
+            if self.cfg['SEND_NOTIFICATIONS']:
+                next_purchase = self.next_order[1].strftime('%d %b %Y at %H:%M')
+                self.notify.warning_funds(self.coin_to_buy,
+                                          next_purchase,
+                                          pairing,
+                                          cost,
+                                          coin_balance)
+
+        for currency, entry in forecast.items():
+            short_from = entry['short_from']
+            if short_from is None:
+                self.funding_warnings.pop(currency, None)
+                continue
+            # warn once for each shortage (again if it gets closer)
+            if currency in self.funding_warnings and self.funding_warnings[currency] <= short_from:
+                continue
+            self.funding_warnings[currency] = short_from
+            if short_from <= self.next_order[1]:
+                continue  # already reported for the next purchase
+            days = self.funding_horizon // (24 * 60 * 60)
+            warning = f"{entry['orders']} purchases of the next {days} days need up to {entry['needed']} " \
+                      f"{currency}, but the balance is {entry['available']} {currency}: funds will run out with " \
+                      f"the {entry['short_coin']} purchase on {short_from.strftime('%d %b %Y at %H:%M')}. " \
+                      f"Top up your account!"
+            logging.warning(warning)
+            if self.cfg['SEND_NOTIFICATIONS']:
+                self.notify.info(warning)
 
     def wait(self):
         """
@@ -244,31 +491,186 @@ class Dca(object):
                      f"{self.coin[self.next_order[0]]['PAIRING']}) on {self.next_order[1].strftime('%Y-%m-%d %H:%M')}."
                      f"\nTime remaining: {int(time_remaining)} s")
 
-        time.sleep(time_remaining)
+        # the market metadata are made ready PREWARM seconds before the purchase, the prices (only if the
+        # purchase needs them) once, late enough to be still fresh at the purchase time
+        purchase_time = self.next_order[1]
+        self.idle_until(purchase_time - datetime.timedelta(seconds=self.prewarm))
+        self.prewarm_purchase()
+        symbols = self.quote_symbols(self.order_book.due(purchase_time + datetime.timedelta(seconds=self.batch_window)))
+        if symbols:
+            sleep_until(purchase_time - datetime.timedelta(seconds=min(self.prewarm, self.quotes.max_age / 2)))
+            self.prefetch_prices(symbols)
+        sleep_until(purchase_time)
+
+    def idle_until(self, deadline):
+        """
+        Sleep until deadline, resolving the missing fees in the meantime (on this thread: the client is not used
+        concurrently)
+        """
+        # in a pool, the reconcilers of the other accounts too: their portfolios are not running meanwhile
+        reconcilers = [self.fee_reconciler]
+        if self.resources is not None:
+            reconcilers += [reconciler for reconciler in self.resources.reconcilers.values()
+                            if reconciler is not self.fee_reconciler]
+        while True:
+            due = [reconciler.due_time() for reconciler in reconcilers if reconciler.due_time() is not None]
+            if not due or min(due) >= deadline:
+                break
+            sleep_until(min(due))
+            for reconciler in reconcilers:
+                reconciler.reconcile_if_due()
+        sleep_until(deadline)
+
+    def prewarm_purchase(self):
+        """
+        Get ready for the next purchase: refresh the market metadata if stale (of all the clients sharing them),
+        so that the order is not delayed by them
+        """
+        with self.metrics.timer('prewarm', self.coin_to_buy):
+            self.market_cache.refresh_if_stale()
+
+    def quote_symbols(self, coins):
+        """
+        Return the symbols of the coins whose purchase needs the price: buy conditions (BuyBelow, VariableAmount)
+        and order sizing, except on binance where the amount is given in the pairing currency (quoteOrderQty)
+        """
+        return [self.coin[coin]['SYMBOL'] for coin in coins
+                if self.coin[coin]['STRATEGY'] in ['BuyBelow', 'VariableAmount'] or 'binance' not in self.exchange.id]
+
+    def prefetch_prices(self, symbols=None):
+        try:
+            with self.metrics.timer('prewarm', self.coin_to_buy):
+                self.quotes.refresh(symbols)
+        except Exception as e:
+            # the prices are fetched again by the purchase
+            logging.warning(f"Prices prefetch failed: {type(e).__name__} {str(e)}")
 
     def buy(self):
 
-        order = self.execute_order(self.coin_to_buy)
-        # print and save order info:
-        if order:
-            store_json_order(self.json_path, order)
-            df = order_to_dataframe(self.exchange, order, self.coin_to_buy)
-            string_order = f"Bought {df['filled'][0]} {self.coin_to_buy} at price {df['price'][0]} {self.coin[self.coin_to_buy]['PAIRING']} (Cost = {df['cost'][0]} {self.coin[self.coin_to_buy]['PAIRING']})"
-            logging.info("-> " + string_order)
-            self.df_orders = pd.concat([self.df_orders, df]).reset_index(drop=True)
-            self.df_orders.index.names = ['N']
-            self.df_orders.to_csv(self.csv_path)
-            plot_purchases(self.coin_to_buy, self.df_orders, self.coin[self.coin_to_buy]['PAIRING'])
-            self.df_stats = calculate_stats(self.coin_to_buy, self.df_orders, self.df_stats, self.stats_path)
-            if self.cfg['SEND_NOTIFICATIONS']:
-                next_purchase = self.coin[self.coin_to_buy]['SCHEDULE'].strftime('%d %b %Y at %H:%M')
-                self.notify.success(df,
-                                    self.coin[self.coin_to_buy]['CYCLE'],
-                                    next_purchase,
-                                    datetime.datetime.now().strftime('%d %b %Y at %H:%M'),
-                                    self.coin[self.coin_to_buy]['PAIRING'],
-                                    self.df_stats.loc[self.coin_to_buy],
-                                    f"Mode: {self.coin[self.coin_to_buy]['STRATEGY_STRING']}")
+        with self.metrics.timer('buy', self.coin_to_buy):
+            with self.metrics.timer('execute_order', self.coin_to_buy):
+                order = self.execute_order(self.coin_to_buy)
+            # print and save order info:
+            if order:
+                self.record_order(self.coin_to_buy, order)
+
+    def get_engine(self):
+        """
+        Return the engine for concurrent orders (None if disabled or not available)
+        """
+        if self.engine is None and self.concurrent_orders:
+            open_stream = self.get_order_stream if self.stream_enabled else None
+            try:
+                if self.resources is not None:
+                    self.engine = self.resources.engine(self.cfg, self.api,
+                                                        max_concurrency=self.cfg.get('MAX_CONCURRENT_ORDERS', 5),
+                                                        deadline=self.fill_tracker.deadline,
+                                                        profiles=self.fill_latency,
+                                                        open_stream=open_stream)
+                    return self.engine
+                async_exchange = connect_to_exchange(self.cfg, self.api, async_support=True)
+                self.engine = AsyncExecutionEngine(async_exchange,
+                                                   max_concurrency=self.cfg.get('MAX_CONCURRENT_ORDERS', 5),
+                                                   fill_tracker=FillTracker(async_exchange,
+                                                                            deadline=self.fill_tracker.deadline,
+                                                                            profiles=self.fill_latency,
+                                                                            stream=self.order_stream,
+                                                                            open_stream=open_stream),
+                                                   http=self.http)
+                # the markets of the async client are updated with the ones of the sync client
+                self.market_cache.share(async_exchange)
+            except Exception as e:
+                logging.warning("Concurrent orders disabled: " + type(e).__name__ + " " + str(e))
+                self.concurrent_orders = False
+        return self.engine
+
+    def get_order_stream(self):
+        """
+        Return the order stream of the account (opened on first use, None if the exchange does not offer one)
+        """
+        with self.stream_lock:
+            if self.order_stream is None:
+                if self.resources is None:
+                    self.order_stream = open_order_stream(self.cfg, self.api)
+                else:
+                    self.order_stream = self.resources.order_stream(self.cfg, self.api)
+            return self.order_stream
+
+    def buy_batch(self, coins):
+        """
+        Buy several coins (due at the same time) concurrently
+        """
+        # one snapshot of the prices for the whole batch (usually prefetched by the pre-warm phase)
+        symbols = [self.coin[coin]['SYMBOL'] for coin in coins]
+        try:
+            if any(self.quotes.cached_price(symbol) is None for symbol in symbols):
+                self.quotes.refresh(symbols)
+        except Exception as e:
+            logging.warning("Price snapshot failed: " + type(e).__name__ + " " + str(e))
+            self.quotes.invalidate()
+
+        requests = {}
+        for coin in coins:
+            mapper = None
+            if self.coin[coin]['STRATEGY'] == 'BuyBelow' or self.coin[coin]['STRATEGY'] == 'VariableAmount':
+                mapper = self.coin[coin]['MAPPER']
+            requests[coin] = {'symbol': self.coin[coin]['SYMBOL'],
+                              'amount': self.coin[coin]['AMOUNT'],
+                              'mapper': mapper,
+                              'price': self.quotes.cached_price(self.coin[coin]['SYMBOL']),
+                              'quote_order_qty': 'binance' in self.exchange.id}
+        logging.info(f"Buying {', '.join(coins)} concurrently...")
+        with self.metrics.timer('execute_batch'):
+            results = self.engine.execute(requests)
+
+        # first store the filled orders, then deal with the errors (that may stop the bot)
+        errors = {}
+        for coin in coins:
+            if isinstance(results[coin], BaseException):
+                errors[coin] = results[coin]
+                continue
+            order, price = results[coin]
+            if order is None:
+                string_order = f"{coin} price above buy condition ({price} {self.coin[coin]['PAIRING']})." \
+                               f" This iteration will be skipped."
+                self.handle_successful_trade(coin, string_order)
+            else:
+                self.handle_successful_trade(coin)
+                self.record_order(coin, order)
+        for coin, e in errors.items():
+            self.handle_order_error(coin, e)
+
+    def record_order(self, coin, order):
+        """
+        Store the filled order, update charts and stats and send the notification
+        """
+        if self.coin_stats is None:
+            # load the aggregates from the storage (before the new order is added)
+            self.coin_stats = self.storage.coin_stats()
+        df = order_to_dataframe(order, coin)
+        string_order = f"Bought {df['filled'][0]} {coin} at price {df['price'][0]} {self.coin[coin]['PAIRING']} (Cost = {df['cost'][0]} {self.coin[coin]['PAIRING']})"
+        logging.info("-> " + string_order)
+        self.coin_stats.update(coin, df['price'][0], df['cost'][0], df['filled'][0])
+        self.balances.invalidate()
+        n = self.storage.record_purchase(coin, order, df, self.coin_stats)
+        if not has_fee(order):
+            self.fee_reconciler.add(order, n, coin, self.fee_source)
+        with self.metrics.timer('plot', coin):
+            graph = self.renderer.plot_purchases(coin,
+                                                 self.storage.coin_values(coin, 'price'),
+                                                 self.storage.coin_values(coin, 'cost'),
+                                                 self.coin[coin]['PAIRING'],
+                                                 path=self.trades_dir / f'graph_{coin}.png')
+        if self.cfg['SEND_NOTIFICATIONS']:
+            next_purchase = self.coin[coin]['SCHEDULE'].strftime('%d %b %Y at %H:%M')
+            self.notify.success(df,
+                                self.coin[coin]['CYCLE'],
+                                next_purchase,
+                                datetime.datetime.now().strftime('%d %b %Y at %H:%M'),
+                                self.coin[coin]['PAIRING'],
+                                dict(zip(CoinStats.columns, self.coin_stats.row(coin))),
+                                f"Mode: {self.coin[coin]['STRATEGY_STRING']}",
+                                graph)
 
     def execute_order(self, coin):
         type_order = 'market'
@@ -279,7 +681,8 @@ class Dca(object):
         try:
             if self.coin[coin]['STRATEGY'] == 'BuyBelow' or self.coin[coin]['STRATEGY'] == 'VariableAmount':
                 # check if the condition is met
-                price = get_price(self.exchange, self.coin[coin]['SYMBOL'])
+                with self.metrics.timer('ticker', coin):
+                    price = get_price(self.exchange, self.coin[coin]['SYMBOL'], self.quotes)
                 amount = self.coin[coin]['MAPPER'].get_amount(price)
                 if amount == 0:
                     string_order = f"{coin} price above buy condition ({price} {self.coin[coin]['PAIRING']})." \
@@ -294,62 +697,92 @@ class Dca(object):
                 params = {
                     'quoteOrderQty': amount,
                     }
-                order = self.exchange.create_order(symbol, type_order, side, amount, price, params)
+                with self.metrics.timer('create_order', coin):
+                    order = self.exchange.create_order(symbol, type_order, side, amount, price, params)
             else:
                 # In case the above is not available on the exchange use the following
-                amount = get_quantity_to_buy(self.exchange, amount, symbol)
-                order = self.exchange.create_order(symbol, type_order, side, amount, price)
+                with self.metrics.timer('ticker', coin):
+                    last_price = get_price(self.exchange, symbol, self.quotes)
+                amount = get_quantity_to_buy(self.exchange, amount, symbol, last_price)
+                with self.metrics.timer('create_order', coin):
+                    order = self.exchange.create_order(symbol, type_order, side, amount, price)
                 # for some exchanges (as FTX) the order must be retrieved to be updated
-                waiting_time = 0.25; total_time = 0
-                while order['status'] != 'closed':
-                    if total_time > 1:
-                        raise Exception("The exchange did not return a closed order")
-                    time.sleep(waiting_time)  # let's give the exchange some time to fill the order
-                    order = self.exchange.fetch_order(order['id'], symbol)
-                    total_time += waiting_time
+                with self.metrics.timer('fill', coin):
+                    order = self.fill_tracker.wait_for_fill(order, symbol)
             self.handle_successful_trade(coin)
             return order
+        except Exception as e:
+            self.handle_order_error(coin, e)
+        return False
+
+    def handle_order_error(self, coin, e):
+        """
+        Recoverable errors schedule a new attempt, all the other errors are raised
+        """
+        self.metrics.count('errors', coin, type(e).__name__)
+        # The order was placed, but its fill is not confirmed yet: it is recorded later (see PendingFills)
+        if isinstance(e, FillTimeout):
+            logging.warning(f"{e.message}. The order will be recorded once filled")
+            self.pending_fills.add(e.order, coin)
+            self.handle_successful_trade(coin, outcome='unconfirmed')
         # Network errors: these are non-critical errors (recoverable)
-        except (ccxt.DDoSProtection, ccxt.ExchangeNotAvailable,
-                ccxt.InvalidNonce, ccxt.RequestTimeout, ccxt.NetworkError) as e:
-            self.handle_recoverable_errors(coin, e)
+        elif isinstance(e, (ccxt.DDoSProtection, ccxt.ExchangeNotAvailable,
+                          ccxt.InvalidNonce, ccxt.RequestTimeout, ccxt.NetworkError)):
+            retry_after = self.handle_recoverable_errors(coin, e)
             # send only on first occurrence
             if self.cfg['SEND_NOTIFICATIONS'] and self.coin[coin]['ERROR_ATTEMPT'] == 1:
                 # if there is a network error, it is likely that this message will not be transmitted
-                self.notify.error(coin, self.retry_for_network[self.coin[coin]['CYCLE']], e)
-        except ccxt.InsufficientFunds as e:  # This is an ExchangeError but we will treat it as recoverable
-            self.handle_recoverable_errors(coin, e)
+                self.notify.error(coin, [self.retry_for_network[self.coin[coin]['CYCLE']].attempts, retry_after], e)
+        elif isinstance(e, ccxt.InsufficientFunds):  # This is an ExchangeError but we will treat it as recoverable
+            retry_after = self.handle_recoverable_errors(coin, e)
             # send only on first occurrence
             if self.cfg['SEND_NOTIFICATIONS'] and self.coin[coin]['ERROR_ATTEMPT'] == 1:
-                self.notify.error(coin, self.retry_for_funds[self.coin[coin]['CYCLE']], e)
+                self.notify.error(coin, [self.retry_for_funds[self.coin[coin]['CYCLE']].attempts, retry_after], e)
         # Not recoverable errors (Exchange errors):
-        except ccxt.ExchangeError as e:
+        elif isinstance(e, ccxt.ExchangeError):
             logging.error(type(e).__name__ + ' ' + str(e))
             if self.cfg['SEND_NOTIFICATIONS']:
                 when = f"attempting to purchase <strong>{coin}</strong>"
                 self.notify.critical(e, when)
             raise e
-        except Exception as e:  # raise all other exceptions
+        else:  # raise all other exceptions
             logging.error(type(e).__name__ + ' ' + str(e))
             when = f"attempting to purchase <strong>{coin}</strong>"
             if self.cfg['SEND_NOTIFICATIONS']:
                 self.notify.critical(e, when)
             raise e
-        return False
 
-    def handle_successful_trade(self, coin, string=None):
+    def handle_successful_trade(self, coin, string=None, outcome=None):
         # This steps are common to all dca strategy
+        self.metrics.count('purchases', coin, outcome or ('skipped' if string else 'filled'))
         self.update_next_datetime(coin)
+        self.breaker.record_success()
         # reset error variable
         self.coin[coin]['LASTERROR'] = []
         self.coin[coin]['ERROR_ATTEMPT'] = 0
         if string:
             logging.info("" + string)
+        # saved before the order is recorded: a failure while recording must not repeat the purchase at restart
+        self.save_checkpoint()
 
     def handle_recoverable_errors(self, coin, e):
+        """
+        Schedule a new attempt (with backoff) and return its delay in seconds (False if the iteration is skipped).
+        Network errors are counted by the circuit breaker of the exchange, which can pause all the purchases
+        """
         # wait (variable on cycle frequency) and retry
         retry_after = self.get_retry_time(coin, e)
+        if isinstance(e, ccxt.InsufficientFunds):
+            self.breaker.record_success()  # the exchange is reachable
+        else:
+            self.breaker.record_failure(immediate=isinstance(e, ccxt.DDoSProtection))
         self.update_next_datetime(coin, retry_after=retry_after)
+        resume_time = self.breaker.resume_time() if self.breaker.is_open() else None
+        if resume_time is not None:
+            # no attempt before the breaker reopens
+            self.pause_purchases(resume_time)
+            if retry_after:
+                retry_after = max(retry_after, math.ceil((resume_time - datetime.datetime.today()).total_seconds()))
         if retry_after:
             error_msg = f"{type(e).__name__} {str(e)}\nNext attempt will be in {retry_after} s"
             logging.warning(error_msg)
@@ -357,10 +790,22 @@ class Dca(object):
             error_msg = f"{type(e).__name__} {str(e)}\nToo many attempts. Skipping this iteration."
             logging.error(error_msg)
         self.coin[coin]['LASTERROR'] = e
+        self.save_checkpoint()
+        return retry_after
+
+    def pause_purchases(self, until):
+        """
+        Postpone to "until" the purchases due before (circuit breaker open). Their schedule is not changed, and
+        they all go on together at "until"
+        """
+        for coin in self.order_book.due(until):
+            if self.order_book[coin] < until:
+                self.order_book[coin] = until
 
     def get_retry_time(self, coin, error):
         """
-        For a given error get the appropriate retry time for the next buy attempt.
+        For a given error get the appropriate retry time for the next buy attempt (False if there are no attempts
+        left).
         Args:
             coin: coin to update (str)
             error: error returned during buy time
@@ -368,23 +813,14 @@ class Dca(object):
         self.coin[coin]['ERROR_ATTEMPT'] += 1
 
         if isinstance(error, ccxt.InsufficientFunds):
-            max_attempt = self.retry_for_funds[self.coin[coin]['CYCLE']][0]
-            if self.coin[coin]['ERROR_ATTEMPT'] <= max_attempt:
-                retry_time = self.retry_for_funds[self.coin[coin]['CYCLE']][1]
-                return retry_time
-            else:
-                # too many attempts, skip this buying iteration
-                self.coin[coin]['ERROR_ATTEMPT'] = 0
-                return False
-        elif isinstance(error, (ccxt.DDoSProtection, ccxt.ExchangeNotAvailable, ccxt.InvalidNonce, ccxt.RequestTimeout, ccxt.NetworkError)):
-            max_attempt = self.retry_for_network[self.coin[coin]['CYCLE']][0]
-            if self.coin[coin]['ERROR_ATTEMPT'] <= max_attempt:
-                retry_time = self.retry_for_network[self.coin[coin]['CYCLE']][1]
-                return retry_time
-            else:
-                # too many attempts, skip this buying iteration
-                self.coin[coin]['ERROR_ATTEMPT'] = 0
-                return False
+            policy = self.retry_for_funds[self.coin[coin]['CYCLE']]
+        else:
+            policy = self.retry_for_network[self.coin[coin]['CYCLE']]
+        retry_time = policy.delay(self.coin[coin]['ERROR_ATTEMPT'])
+        if not retry_time:
+            # too many attempts, skip this buying iteration
+            self.coin[coin]['ERROR_ATTEMPT'] = 0
+        return retry_time
 
     def update_next_datetime(self,coin,retry_after=False):
         """
@@ -396,24 +832,25 @@ class Dca(object):
         if retry_after:  # this means that an error occurred
             self.order_book[coin] = datetime.datetime.today() + datetime.timedelta(seconds=retry_after)
         else:
-            if self.coin[coin]['CYCLE'].lower() == 'minutely':  # only for testing purpose
-                self.coin[coin]['SCHEDULE'] = self.coin[coin]['SCHEDULE'] + datetime.timedelta(minutes=1)
-            elif self.coin[coin]['CYCLE'].lower() == 'daily':
-                self.coin[coin]['SCHEDULE'] = self.coin[coin]['SCHEDULE'] + datetime.timedelta(days=1)
-            elif self.coin[coin]['CYCLE'].lower() == 'bi-weekly':
-                self.coin[coin]['SCHEDULE'] = self.coin[coin]['SCHEDULE'] + datetime.timedelta(days=14)
-            elif self.coin[coin]['CYCLE'].lower() == 'weekly':
-                self.coin[coin]['SCHEDULE'] = self.coin[coin]['SCHEDULE'] + datetime.timedelta(days=7)
-            elif self.coin[coin]['CYCLE'].lower() == 'monthly':
-                self.coin[coin]['SCHEDULE'] = self.coin[coin]['SCHEDULE'] + relativedelta(months=1)
+            self.coin[coin]['SCHEDULE'] = next_purchase_time(self.coin[coin]['SCHEDULE'], self.coin[coin]['CYCLE'])
             # update the order book:
             self.order_book[coin] = self.coin[coin]['SCHEDULE']
 
     def initialize_order_book(self):
         """
-        Initialize the schedule time for each coin depending on current time and config settings.
-        Also, initialize the order_book
+        Initialize the schedule time for each coin depending on current time and config settings (or on the
+        checkpoint of the previous run). Also, initialize the order_book
         """
+        # state saved by the previous run (if any), restored after the schedule is computed from the settings
+        checkpoint = self.checkpoint.load()
+        # previous order book (if any), used to recover the bi-weekly cycle
+        previous_order_book = dict(self.storage.schedule.items())
+        if not previous_order_book and self.order_book_path.exists():
+            # order book written by older versions
+            df = read_csv_custom(self.order_book_path)
+            previous_order_book = {cn: {'Purchase Time': str(df.loc[cn]['Purchase Time']),
+                                        'Cycle': df.loc[cn]['Cycle']} for cn in df.index}
+
         for coin in self.coin:
             if self.coin[coin]['CYCLE'].lower() == 'minutely':
 
@@ -452,14 +889,12 @@ class Dca(object):
 
                 # we have a little complication with the bi-weekly cycle. We have to consult the order_book (if exists)
                 # to decide which week to use (in case the bot was restarted)
-                if 'bi-weekly' in self.coin[coin]['CYCLE'].lower() and self.order_book_path.exists():
-                    df = read_csv_custom(self.order_book_path)
+                if 'bi-weekly' in self.coin[coin]['CYCLE'].lower():
                     previously = None
-                    for cn in df.index:
-                        if cn == coin and df.loc[cn]['Cycle'] == 'bi-weekly':
-                            previously = df.loc[cn]['Purchase Time']
+                    if coin in previous_order_book and previous_order_book[coin]['Cycle'] == 'bi-weekly':
+                        previously = previous_order_book[coin]['Purchase Time']
                     if previously:
-                        previously = datetime.datetime.strptime(previously, '%Y-%m-%d %H:%M:%S')
+                        previously = datetime.datetime.fromisoformat(previously)
                         if previously == scheduled_datetime + datetime.timedelta(days=7):
                             scheduled_datetime = previously
                 self.coin[coin]['SCHEDULE'] = scheduled_datetime
@@ -491,11 +926,22 @@ class Dca(object):
             self.coin[coin]['LASTERROR'] = []
             self.coin[coin]['ERROR_ATTEMPT'] = 0
 
+        if checkpoint is not None:
+            self.restore_checkpoint(checkpoint)
+            logging.info(f"Schedule restored from {self.checkpoint.filename}")
+
 
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description='DCA bot')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='report the duration of each startup phase and exit')
+    args = parser.parse_args()
+
     cfg_path = 'config/config.yml'
     api_path = 'auth/API_keys.yml'
 
     # Run the bot
-    Dca(cfg_path, api_path)
+    bot = Dca(cfg_path, api_path, profile_startup=args.profile_startup)
+    if not args.profile_startup:
+        bot.run()
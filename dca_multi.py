@@ -0,0 +1,137 @@
+import time
+_startup = time.perf_counter()  # used to profile the startup (imports included)
+
+from dca_bot import Dca
+from utils.exchange_pool import ExchangePool
+from utils.http_pool import HttpPool
+from utils.metrics import Metrics
+from utils.misc import add_log_file, load_config, register_logger
+from utils.scheduler import Scheduler
+from utils.timing import StartupProfiler
+
+import argparse
+import logging
+from pathlib import Path
+import threading
+
+
+class PortfolioFilter(logging.Filter):
+    """
+    Pass only the records logged while the bot is working on the given portfolio
+    (records of the background threads go to the main log only).
+    Records are written by the logging thread, so the portfolio is stamped on them when they are logged (stamp)
+    """
+    current = threading.local()
+
+    def __init__(self, name):
+        super().__init__()
+        self.portfolio = name
+
+    @classmethod
+    def stamp(cls, record):
+        record.portfolio = getattr(cls.current, 'name', None)
+        return True
+
+    def filter(self, record):
+        return getattr(record, 'portfolio', None) == self.portfolio
+
+
+class MultiDca(object):
+    """
+    Run several portfolios (each with its own configuration, API keys and trades folder) in a single process.
+    Exchange clients, market metadata, prices and chart rendering are shared (see ExchangePool), and a single
+    scheduler drives the purchases of all the portfolios.
+    """
+    def __init__(self, portfolios_path, profile_startup=False):
+        profiler = StartupProfiler(_startup)
+        profiler.mark('imports')
+
+        cfg = load_config(portfolios_path)
+        self.cfg = cfg
+        self.base_dir = Path(cfg.get('TRADES_DIR', 'portfolios'))
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        log_queue = register_logger(log_file=self.base_dir / 'log.txt', cfg=cfg)
+        log_queue.handler.addFilter(PortfolioFilter.stamp)
+        logging.info(f"Program started. Loading {len(cfg['PORTFOLIOS'])} portfolios...")
+
+        self.resources = ExchangePool(self.base_dir,
+                                      chart_workers=cfg.get('CHART_WORKERS', 1),
+                                      markets_ttl=cfg.get('MARKETS_TTL', 24*60*60),
+                                      quote_max_age=cfg.get('QUOTE_MAX_AGE', 5),
+                                      http=HttpPool.from_config(cfg),
+                                      metrics=Metrics('', enabled=cfg.get('METRICS', False)))
+        # a single endpoint for the metrics of all the portfolios
+        if cfg.get('METRICS_PORT'):
+            self.resources.metrics.serve(cfg['METRICS_PORT'])
+
+        # the symbols of every portfolio must be known before the markets are loaded
+        for name, portfolio in cfg['PORTFOLIOS'].items():
+            self.resources.register(load_config(portfolio['CONFIG']))
+        profiler.mark('configuration')
+
+        self.portfolios = {}
+        self.order_book = Scheduler()  # portfolio -> time of its next purchase
+        for name, portfolio in cfg['PORTFOLIOS'].items():
+            trades_dir = Path(portfolio.get('TRADES', self.base_dir / name))
+            trades_dir.mkdir(parents=True, exist_ok=True)
+            add_log_file(trades_dir / 'log.txt', PortfolioFilter(name))
+
+            PortfolioFilter.current.name = name
+            try:
+                self.portfolios[name] = Dca(portfolio['CONFIG'], portfolio['API'],
+                                            trades_dir=trades_dir, resources=self.resources, name=name)
+                self.order_book[name] = self.portfolios[name].next_order[1]
+            except Exception as e:
+                logging.error(f"Portfolio {name} not started: {type(e).__name__} {str(e)}")
+            finally:
+                PortfolioFilter.current.name = None
+            profiler.mark(f'portfolio {name}')
+
+        if len(self.portfolios) == 0:
+            raise Exception('No portfolio could be started.')
+        logging.info(f"{len(self.portfolios)} portfolios up and running!")
+
+        if profile_startup:
+            logging.info(profiler.report())
+
+    def run(self):
+        """
+        Buy the coins of all the portfolios according to their schedule (forever)
+        """
+        for name in self.portfolios:
+            self.call(name, 'check_next_funds')
+
+        while len(self.order_book) > 0:
+            name, _ = self.order_book.peek()
+            if self.call(name, 'wait') and self.call(name, 'buy_due') and self.call(name, 'check_next_funds'):
+                self.order_book[name] = self.portfolios[name].next_order[1]
+        logging.error('All the portfolios stopped.')
+
+    def call(self, name, method):
+        """
+        Call a method of a portfolio. A portfolio that raises an error is stopped, the others go on
+        """
+        PortfolioFilter.current.name = name
+        try:
+            getattr(self.portfolios[name], method)()
+            return True
+        except Exception as e:
+            logging.error(f"Portfolio {name} stopped: {type(e).__name__} {str(e)}")
+            self.order_book.remove(name)
+            return False
+        finally:
+            PortfolioFilter.current.name = None
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='DCA bot (several portfolios)')
+    parser.add_argument('--portfolios', default='config/portfolios.yml', help='portfolios file')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='report the duration of each startup phase and exit')
+    args = parser.parse_args()
+
+    # Run the bots
+    bots = MultiDca(args.portfolios, profile_startup=args.profile_startup)
+    if not args.profile_startup:
+        bots.run()
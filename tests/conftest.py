@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of the bot are imported from the root of the repository (as when running dca_bot.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,89 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+import yaml
+
+from utils.backtest import backtest, load_candles, parameter_grid, parse_grid, purchase_times, sweep
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+@pytest.fixture
+def candles(tmp_path):
+    """Hourly candles of January 2024: the price rises by 1 every hour from 100"""
+    times = pd.date_range('2024-01-01', '2024-01-31 23:00', freq='h')
+    prices = [100.0 + n for n in range(len(times))]
+    df = pd.DataFrame({'timestamp': times.as_unit('ms').asi8, 'open': prices, 'high': prices, 'low': prices,
+                       'close': [price + 0.5 for price in prices], 'volume': 1.0})
+    df.to_csv(tmp_path / 'btc.csv', index=False)
+    return tmp_path / 'btc.csv'
+
+
+def coin_cfg(**kwargs):
+    cfg = {'PAIRING': 'USDT', 'AMOUNT': 10, 'CYCLE': 'daily', 'AT_TIME': '08:00', 'ON_WEEKDAY': 0, 'ON_DAY': 1}
+    cfg.update(kwargs)
+    return cfg
+
+
+def test_purchase_times_follow_the_cycle():
+    assert list(purchase_times(coin_cfg(), '2024-01-01 09:00', '2024-01-03 12:00')) == \
+        [pd.Timestamp('2024-01-02 08:00'), pd.Timestamp('2024-01-03 08:00')]
+    # 2024-01-01 is a Monday
+    assert list(purchase_times(coin_cfg(CYCLE='weekly', ON_WEEKDAY=2), '2024-01-01', '2024-01-31'))[0] == \
+        pd.Timestamp('2024-01-03 08:00')
+    assert len(purchase_times(coin_cfg(CYCLE='bi-weekly'), '2024-01-01', '2024-01-31')) == 3
+    assert list(purchase_times(coin_cfg(CYCLE='monthly', ON_DAY=15), '2024-01-01', '2024-03-01')) == \
+        [pd.Timestamp('2024-01-15 08:00'), pd.Timestamp('2024-02-15 08:00')]
+
+
+def test_backtest_buys_at_the_open_price(candles):
+    result = backtest('BTC', coin_cfg(AT_TIME='08:30'), load_candles(candles), start='2024-01-01',
+                      end='2024-01-03 00:00', fee_rate=0.01)
+
+    # purchases on Jan 1 and 2 at 08:30, in the candles opened at 08:00 (prices 108 and 132)
+    assert result['N'] == 2 and result['TotalCost'] == 20
+    assert result['Quantity'] == pytest.approx(10 * 0.99 / 108 + 10 * 0.99 / 132)
+    assert result['ROI_end'] == pytest.approx(result['Quantity'] * 148.5 - 20)
+
+
+def test_buy_below_skips_the_purchases(candles):
+    result = backtest('BTC', coin_cfg(BUYBELOW=150), load_candles(candles), start='2024-01-01', end='2024-01-10')
+    assert result['N'] == 2  # 108 and 132
+
+
+def test_grid_and_sweep(candles):
+    configs = parameter_grid('BTC', coin_cfg(), CYCLE=['daily', 'weekly'], AMOUNT=[10, 20])
+    assert [(cfg['CYCLE'], cfg['AMOUNT']) for _, cfg in configs] == \
+        [('daily', 10), ('daily', 20), ('weekly', 10), ('weekly', 20)]
+
+    serial = sweep(configs, {'BTC': candles}, workers=1)
+    parallel = sweep(configs, {'BTC': candles}, workers=2, chunksize=1)
+    pd.testing.assert_frame_equal(serial, parallel)
+    assert serial['N'].tolist() == [31, 31, 5, 5] and serial['TotalCost'].tolist() == [310, 620, 50, 100]
+
+
+def test_failed_configurations_are_reported(candles):
+    df = sweep([('BTC', coin_cfg(CYCLE='yearly'))], {'BTC': candles}, workers=1)
+    assert 'Cycle not recognized' in df['Error'][0]
+
+
+def test_parse_grid():
+    assert parse_grid(['cycle=daily,weekly', 'AMOUNT=10,12.5', 'AT_TIME=08:00']) == \
+        {'CYCLE': ['daily', 'weekly'], 'AMOUNT': [10, 12.5], 'AT_TIME': ['08:00']}
+    with pytest.raises(ValueError):
+        parse_grid(['CYCLE'])
+
+
+def test_command_line(candles, tmp_path):
+    (tmp_path / 'config.yml').write_text(yaml.dump({'COINS': {'BTC': coin_cfg()}}))
+    result = subprocess.run([sys.executable, '-m', 'utils.backtest', '--config', str(tmp_path / 'config.yml'),
+                             '--candles', f'btc={candles}', '--grid', 'CYCLE=daily,weekly', '--workers', '2'],
+                            cwd=ROOT, capture_output=True, text=True, timeout=120)
+
+    assert result.returncode == 0, result.stderr
+    lines = result.stdout.splitlines()
+    assert lines[0].split()[:3] == ['Coin', 'CYCLE', 'Strategy']
+    assert [line.split()[:2] for line in lines[1:]] == [['BTC', 'daily'], ['BTC', 'weekly']]
@@ -0,0 +1,117 @@
+import datetime
+import json
+
+import pytest
+import yaml
+
+from dca_bot import Dca
+from utils.checkpoint import Checkpoint
+from utils.simulated_exchange import SimulatedExchange
+
+
+def test_save_and_load(tmp_path):
+    checkpoint = Checkpoint(tmp_path / 'checkpoint.json')
+    assert checkpoint.load() is None
+    assert checkpoint.save({'coins': {'BTC': 1}})
+
+    loaded = Checkpoint(tmp_path / 'checkpoint.json')
+    assert loaded.load() == {'coins': {'BTC': 1}}
+    assert loaded.sequence == 1
+    assert not (tmp_path / 'checkpoint.json.tmp').exists()
+
+
+def test_unchanged_state_is_not_written(tmp_path):
+    checkpoint = Checkpoint(tmp_path / 'checkpoint.json')
+    assert checkpoint.save({'a': 1, 'b': 2})
+    assert not checkpoint.save({'b': 2, 'a': 1})
+    assert checkpoint.save({'a': 2})
+    assert json.loads((tmp_path / 'checkpoint.json').read_text())['sequence'] == 2
+
+    # nor after a restart
+    restarted = Checkpoint(tmp_path / 'checkpoint.json')
+    restarted.load()
+    assert not restarted.save({'a': 2})
+
+
+@pytest.mark.parametrize('content', ['{"version": 1, "seq', json.dumps({'version': 0, 'sequence': 1, 'state': {}})])
+def test_unreadable_checkpoints_are_ignored(tmp_path, content):
+    (tmp_path / 'checkpoint.json').write_text(content)
+    assert Checkpoint(tmp_path / 'checkpoint.json').load() is None
+
+
+@pytest.fixture
+def folder(tmp_path):
+    cfg = {'COINS': {'BTC': {'PAIRING': 'USDT', 'AMOUNT': 20, 'CYCLE': 'daily', 'AT_TIME': '10:00'}},
+           'EXCHANGE': 'binance', 'TEST': True, 'SEND_NOTIFICATIONS': False}
+    (tmp_path / 'config.yml').write_text(yaml.dump(cfg))
+    (tmp_path / 'api.yml').write_text(yaml.dump({'BINANCE': {'TEST': {'APIKEY': 'x', 'SECRET': 'x'}}}))
+    return tmp_path
+
+
+def start(folder):
+    ex = SimulatedExchange({'BTC/USDT': [30000, 31000]}, balance={'USDT': 1000})
+    return Dca(folder / 'config.yml', folder / 'api.yml', trades_dir=folder / 'trades', exchange=ex)
+
+
+def stop(bot):
+    bot.renderer.shutdown()
+    bot.fee_reconciler.close()
+
+
+def test_bot_restores_its_schedule(folder):
+    bot = start(folder)
+    later = (bot.order_book['BTC'] + datetime.timedelta(hours=3)).replace(microsecond=0)
+    bot.order_book['BTC'] = later
+    bot.coin['BTC']['ERROR_ATTEMPT'] = 2
+    bot.breaker.record_failure(immediate=True)
+    bot.save_checkpoint()
+    stop(bot)
+
+    bot = start(folder)
+    assert bot.order_book['BTC'] == later
+    assert bot.coin['BTC']['ERROR_ATTEMPT'] == 2
+    assert bot.breaker.is_open()
+    stop(bot)
+
+
+def test_missed_purchase_is_done_at_once(folder):
+    bot = start(folder)
+    bot.order_book['BTC'] = bot.coin['BTC']['SCHEDULE'] = datetime.datetime.today() - datetime.timedelta(days=2)
+    bot.save_checkpoint()
+    stop(bot)
+
+    before = datetime.datetime.today()
+    bot = start(folder)
+    assert before <= bot.order_book['BTC'] <= datetime.datetime.today()
+    assert bot.coin['BTC']['SCHEDULE'] > before - datetime.timedelta(days=1)  # one purchase, not two
+    stop(bot)
+
+
+def test_changed_settings_discard_the_checkpoint(folder):
+    bot = start(folder)
+    bot.order_book['BTC'] = bot.order_book['BTC'] + datetime.timedelta(hours=3)
+    bot.save_checkpoint()
+    stop(bot)
+
+    cfg = yaml.safe_load((folder / 'config.yml').read_text())
+    cfg['COINS']['BTC']['AT_TIME'] = '11:00'
+    (folder / 'config.yml').write_text(yaml.dump(cfg))
+    bot = start(folder)
+    assert (bot.order_book['BTC'].hour, bot.order_book['BTC'].minute) == (11, 0)
+    stop(bot)
+
+
+def test_recorded_purchase_is_not_repeated(folder):
+    bot = start(folder)
+    due = (datetime.datetime.today() - datetime.timedelta(hours=1)).replace(microsecond=0)
+    bot.order_book['BTC'] = bot.coin['BTC']['SCHEDULE'] = due
+    state = bot.checkpoint_state()
+    bot.buy_due()
+    # the bot stopped after the purchase, before the checkpoint was saved
+    bot.checkpoint.save(state)
+    stop(bot)
+
+    bot = start(folder)
+    assert bot.order_book['BTC'] == bot.coin['BTC']['SCHEDULE'] == due + datetime.timedelta(days=1)
+    assert len(bot.storage.orders_frame()) == 1
+    stop(bot)
@@ -0,0 +1,144 @@
+import datetime
+
+import yaml
+
+from dca_bot import Dca
+from utils.fee_reconciler import FeeReconciler
+from utils.simulated_exchange import SimulatedExchange
+
+
+class RecordingStorage(object):
+    """Storage keeping the fee updates"""
+    def __init__(self):
+        self.fees = {}
+
+    def update_fees(self, fees):
+        self.fees.update(fees)
+
+
+def exchange(**kwargs):
+    return SimulatedExchange({'BTC/USDT': [40000], 'ETH/USDT': [2000]}, balance={'USDT': 1000},
+                             exchange_id='kraken', report_fees=False, **kwargs)
+
+
+def buy(ex, symbol='BTC/USDT', amount=0.001):
+    return ex.create_order(symbol, 'market', 'buy', amount)
+
+
+def test_fees_are_resolved_from_the_trades(tmp_path):
+    ex = exchange()
+    storage = RecordingStorage()
+    reconciler = FeeReconciler(ex, storage, tmp_path / 'fees.db', interval=0)
+    assert reconciler.due_time() is None and not reconciler.reconcile_if_due()
+
+    for n, symbol in enumerate(['BTC/USDT', 'BTC/USDT', 'ETH/USDT']):
+        reconciler.add(buy(ex, symbol), n, symbol.split('/')[0])
+    assert reconciler.due_time() <= datetime.datetime.now()
+    assert reconciler.reconcile_if_due()
+
+    assert sorted(storage.fees) == [0, 1, 2]
+    fee, currency, rate = storage.fees[0][0]
+    assert abs(fee - 0.04) < 1e-9 and (currency, rate) == ('USDT', 0.001)
+    assert ex.calls['fetch_my_trades'] == 2  # once per symbol
+    assert reconciler.due_time() is None  # nothing left
+    reconciler.close()
+
+
+def test_reconciliation_waits_for_the_interval(tmp_path):
+    ex = exchange()
+    reconciler = FeeReconciler(ex, RecordingStorage(), tmp_path / 'fees.db', interval=60)
+    reconciler.add(buy(ex), 0, 'BTC')
+
+    assert reconciler.due_time() > datetime.datetime.now() + datetime.timedelta(seconds=50)
+    assert not reconciler.reconcile_if_due()
+    assert 'fetch_my_trades' not in ex.calls
+    reconciler.close()
+
+
+def test_cursor_skips_the_processed_trades(tmp_path):
+    ex = exchange()
+    storage = RecordingStorage()
+    reconciler = FeeReconciler(ex, storage, tmp_path / 'fees.db', interval=0)
+    reconciler.add(buy(ex), 0, 'BTC')
+    reconciler.reconcile_if_due()
+    first = reconciler.cursors.get('BTC/USDT')
+
+    order = buy(ex)
+    reconciler.add(order, 1, 'BTC')
+    reconciler.reconcile_if_due()
+    assert 1 in storage.fees
+    assert first <= order['timestamp'] < reconciler.cursors.get('BTC/USDT')
+    reconciler.close()
+
+
+def test_orders_are_queried_one_by_one_without_fetch_my_trades(tmp_path):
+    ex = exchange()
+    ex.has['fetchMyTrades'] = False
+    storage = RecordingStorage()
+    reconciler = FeeReconciler(ex, storage, tmp_path / 'fees.db', interval=0)
+    reconciler.add(buy(ex), 0, 'BTC')
+    reconciler.add(buy(ex), 1, 'BTC')
+    reconciler.reconcile_if_due()
+
+    assert sorted(storage.fees) == [0, 1]
+    assert ex.calls['fetch_order_trades'] == 2 and 'fetch_my_trades' not in ex.calls
+    reconciler.close()
+
+
+def test_pending_orders_survive_a_restart(tmp_path):
+    ex = exchange()
+    reconciler = FeeReconciler(ex, RecordingStorage(), tmp_path / 'fees.db', interval=0)
+    reconciler.add(buy(ex), 0, 'BTC')
+    reconciler.close()
+
+    storage = RecordingStorage()
+    reconciler = FeeReconciler(ex, storage, tmp_path / 'fees.db', interval=0)
+    assert reconciler.due_time() is not None
+    reconciler.reconcile_if_due()
+    assert list(storage.fees) == [0]
+    reconciler.close()
+
+
+def test_unresolved_fees_are_dropped_after_max_age(tmp_path):
+    ex = exchange()
+    storage = RecordingStorage()
+    reconciler = FeeReconciler(ex, storage, tmp_path / 'fees.db', interval=0, max_age=0)
+    reconciler.add({'id': 'unknown', 'symbol': 'BTC/USDT', 'timestamp': 1}, 0, 'BTC')
+    reconciler.reconcile_if_due()
+
+    assert storage.fees == {} and reconciler.due_time() is None
+    reconciler.close()
+
+
+def test_sources_share_the_requests(tmp_path):
+    ex = exchange()
+    first, second = RecordingStorage(), RecordingStorage()
+    reconciler = FeeReconciler(ex, None, tmp_path / 'fees.db', interval=0)
+    source_first = reconciler.register(first, tmp_path / 'a.db')
+    source_second = reconciler.register(second, tmp_path / 'b.db')
+    reconciler.add(buy(ex), 0, 'BTC', source_first)
+    reconciler.add(buy(ex), 0, 'BTC', source_second)
+    reconciler.reconcile_if_due()
+
+    assert list(first.fees) == [0] and list(second.fees) == [0]
+    assert ex.calls['fetch_my_trades'] == 1
+    reconciler.close()
+
+
+def test_bot_resolves_the_fees_while_waiting(tmp_path):
+    cfg = {'COINS': {'BTC': {'PAIRING': 'USDT', 'AMOUNT': 20, 'CYCLE': 'minutely'}}, 'EXCHANGE': 'kraken',
+           'TEST': True, 'SEND_NOTIFICATIONS': False, 'FEE_RECONCILE_INTERVAL': 0.05}
+    (tmp_path / 'config.yml').write_text(yaml.dump(cfg))
+    (tmp_path / 'api.yml').write_text(yaml.dump({'KRAKEN': {'TEST': {'APIKEY': 'x', 'SECRET': 'x'}}}))
+    ex = exchange()
+    bot = Dca(tmp_path / 'config.yml', tmp_path / 'api.yml', trades_dir=tmp_path / 'trades', exchange=ex)
+    bot.order_book['BTC'] = datetime.datetime.now()
+    bot.update_order_book()
+    bot.buy_due()
+    assert bot.storage.orders_frame()['fee'].tolist() == ['N.A.']
+
+    bot.idle_until(datetime.datetime.now() + datetime.timedelta(seconds=0.3))
+    assert bot.storage.orders_frame()['fee'].tolist()[0] > 0
+    assert ex.calls['fetch_my_trades'] == 1
+    bot.renderer.shutdown()
+    bot.fee_reconciler.close()
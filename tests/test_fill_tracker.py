@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+
+from utils.fill_tracker import FillTimeout, FillTracker, LatencyProfiles, LocalOrderStream, PendingFills
+from utils.simulated_exchange import SimulatedExchange
+
+
+def exchange(**kwargs):
+    return SimulatedExchange({'BTC/USDT': [40000, 39000]}, balance={'USDT': 1000}, **kwargs)
+
+
+def buy(ex, cost=20):
+    return ex.create_order('BTC/USDT', 'market', 'buy', None, params={'quoteOrderQty': cost})
+
+
+def test_stream_returns_a_published_closed_order():
+    stream = LocalOrderStream()
+    stream.publish({'id': '1', 'status': 'open'})
+    assert stream.wait('1', 'BTC/USDT', 0.01) is None
+
+    timer = threading.Timer(0.05, stream.publish, args=[{'id': '1', 'status': 'closed', 'filled': 1.0}])
+    timer.start()
+    start = time.monotonic()
+    order = stream.wait('1', 'BTC/USDT', 5)
+    timer.join()
+
+    assert order['status'] == 'closed' and order['filled'] == 1.0
+    assert time.monotonic() - start < 1
+
+
+def test_stream_keeps_the_last_updates_only():
+    stream = LocalOrderStream(max_orders=2)
+    for n in range(3):
+        stream.publish({'id': str(n), 'status': 'closed'})
+
+    assert list(stream.orders) == ['1', '2']
+    assert stream.wait('0', 'BTC/USDT', 0) is None
+
+
+def test_tracker_polls_until_the_fill():
+    ex = exchange(fill_delay=0.1)
+    order = buy(ex)
+    assert order['status'] == 'open'
+
+    profiles = LatencyProfiles(default=0.05)
+    filled = FillTracker(ex, deadline=5, profiles=profiles).wait_for_fill(order, 'BTC/USDT')
+
+    assert filled['status'] == 'closed' and filled['filled'] > 0
+    assert ex.calls['fetch_order'] >= 1
+    assert profiles.get('binance') != 0.05  # latency learned
+
+
+def test_tracker_timeout_keeps_the_order():
+    ex = exchange(fill_delay=10)
+    order = buy(ex)
+
+    with pytest.raises(FillTimeout) as error:
+        FillTracker(ex, deadline=0.2, max_interval=0.05).wait_for_fill(order, 'BTC/USDT')
+    assert error.value.order['id'] == order['id']
+
+
+def test_stream_ends_the_wait_early():
+    ex = exchange(fill_delay=10)
+    order = buy(ex)
+    stream = LocalOrderStream()
+    timer = threading.Timer(0.05, stream.publish, args=[dict(order, status='closed')])
+    timer.start()
+
+    start = time.monotonic()
+    tracker = FillTracker(ex, deadline=5, profiles=LatencyProfiles(default=2), stream=stream, max_interval=2)
+    filled = tracker.wait_for_fill(order, 'BTC/USDT')
+    timer.join()
+
+    assert filled['status'] == 'closed'
+    assert time.monotonic() - start < 1
+    assert 'fetch_order' not in ex.calls
+
+
+def test_profiles_are_persisted(tmp_path):
+    profiles = LatencyProfiles(tmp_path / 'latency.json', alpha=0.5)
+    profiles.update('binance', 1.0)
+    profiles.update('binance', 0.5)
+
+    assert LatencyProfiles(tmp_path / 'latency.json').get('binance') == 0.75
+    assert LatencyProfiles(tmp_path / 'latency.json', default=0.3).get('kraken') == 0.3
+
+
+def test_pending_fills_are_checked_again(tmp_path):
+    ex = exchange(fill_delay=0.1)
+    order = buy(ex)
+    pending = PendingFills(ex, tmp_path / 'pending.db')
+    pending.add(order, 'BTC')
+    assert pending.check() == [] and len(pending) == 1  # still open
+
+    time.sleep(0.15)
+    filled = pending.check()
+    assert [(coin, order['status']) for coin, order in filled] == [('BTC', 'closed')]
+    assert len(pending) == 0
+    pending.close()
+
+
+def test_pending_fills_survive_a_restart(tmp_path):
+    ex = exchange(fill_delay=10)
+    pending = PendingFills(ex, tmp_path / 'pending.db')
+    pending.add(buy(ex), 'BTC')
+    pending.close()
+
+    pending = PendingFills(ex, tmp_path / 'pending.db')
+    assert len(pending) == 1
+    pending.max_age = 0
+    time.sleep(0.01)
+    assert pending.check() == [] and len(pending) == 0  # too old: dropped
+    pending.close()
+
+
+def test_stream_is_opened_on_the_first_order_not_filled_at_once():
+    opened = []
+
+    def open_stream():
+        opened.append(LocalOrderStream())
+        return opened[-1]
+
+    ex = exchange()
+    tracker = FillTracker(ex, deadline=5, open_stream=open_stream)
+    tracker.wait_for_fill(buy(ex), 'BTC/USDT')
+    assert opened == []  # filled at once
+
+    ex.fill_delay = 0.05
+    tracker.wait_for_fill(buy(ex), 'BTC/USDT')
+    tracker.wait_for_fill(buy(ex), 'BTC/USDT')
+    assert len(opened) == 1 and tracker.stream is opened[0]
@@ -0,0 +1,124 @@
+import pandas as pd
+import pytest
+
+from utils.exchange import order_to_dataframe
+from utils.ledger import OrderLedger
+from utils.misc import read_csv_custom
+
+
+def order(n, cost=20.0, fees=None):
+    return {'id': str(n), 'datetime': '2024-01-01T00:00:00.000Z', 'timestamp': 1704067200000 + n,
+            'symbol': 'BTC/USDT', 'status': 'closed', 'filled': cost / 40000, 'average': 40000.0, 'cost': cost,
+            'remaining': 0.0, 'fees': fees if fees is not None else [{'cost': 0.02, 'currency': 'USDT', 'rate': 0.001}]}
+
+
+def append(ledger, n, coin='BTC', **kwargs):
+    return ledger.append(order_to_dataframe(order(n, **kwargs), coin))
+
+
+def test_append_writes_rows_with_increasing_n(tmp_path):
+    ledger = OrderLedger(tmp_path / 'orders.csv')
+    for n in range(3):
+        rows = append(ledger, n)
+        assert list(rows.index) == [n]
+
+    df = read_csv_custom(tmp_path / 'orders.csv')
+    assert list(df.index) == [0, 1, 2]
+    assert (tmp_path / 'orders.csv').read_text().count('N,') == 1  # a single header
+
+
+def test_append_does_not_load_the_file(tmp_path):
+    ledger = OrderLedger(tmp_path / 'orders.csv')
+    append(ledger, 0)
+    append(ledger, 1)
+
+    # a new ledger only reads the header and the last line to go on
+    ledger = OrderLedger(tmp_path / 'orders.csv')
+    rows = append(ledger, 2)
+    assert not ledger.loaded
+    assert list(rows.index) == [2]
+    assert len(ledger) == 3
+
+
+def test_frame_and_coin_values_include_buffered_rows(tmp_path):
+    ledger = OrderLedger(tmp_path / 'orders.csv', chunk_size=2)
+    ledger.load()
+    for n, coin in enumerate(['BTC', 'ETH', 'BTC', 'ETH', 'BTC']):
+        append(ledger, n, coin=coin, cost=10.0 * (n + 1))
+
+    assert len(ledger.chunks) == 2 and len(ledger.rows) == 1
+    df = ledger.frame()
+    assert list(df.index) == [0, 1, 2, 3, 4]
+    assert ledger.coin_values('BTC', 'cost') == [10.0, 30.0, 50.0]
+    assert ledger.coin_values('ETH', 'cost') == [20.0, 40.0]
+    pd.testing.assert_frame_equal(df, read_csv_custom(tmp_path / 'orders.csv'), check_dtype=False)
+
+
+def test_fee_backfill_goes_to_the_sidecar(tmp_path):
+    ledger = OrderLedger(tmp_path / 'orders.csv')
+    append(ledger, 0, fees=[])
+    append(ledger, 1, fees=[])
+    before = (tmp_path / 'orders.csv').read_text()
+
+    ledger.add_fees({1: [(0.03, 'USDT', 0.001)]})
+
+    assert (tmp_path / 'orders.csv').read_text() == before  # never rewritten
+    df = OrderLedger(tmp_path / 'orders.csv').frame()
+    assert df.loc[0, 'fee'] == 'N.A.'
+    assert (df.loc[1, 'fee'], df.loc[1, 'fee currency'], df.loc[1, 'fee rate']) == (0.03, 'USDT', 0.001)
+
+
+def test_fees_in_several_currencies_stay_numeric(tmp_path):
+    ledger = OrderLedger(tmp_path / 'orders.csv')
+    fees = [{'cost': 0.02, 'currency': 'USDT', 'rate': 0.001}, {'cost': 0.0001, 'currency': 'BNB', 'rate': 0.00075}]
+    rows = append(ledger, 0, fees=fees)
+    assert rows.loc[0, 'fee'] == 'N.A.'
+
+    ledger.add_fees({0: [(0.02, 'USDT', 0.001), (0.0001, 'BNB', 0.00075)]})
+    table = ledger.fee_table()
+    assert table['fee'].dtype == float
+    assert sorted(table['fee currency']) == ['BNB', 'USDT']
+    # the ledger row does not hold several currencies
+    assert OrderLedger(tmp_path / 'orders.csv').frame().loc[0, 'fee'] == 'N.A.'
+
+
+def test_loaded_ledger_sees_later_fees(tmp_path):
+    ledger = OrderLedger(tmp_path / 'orders.csv')
+    append(ledger, 0, fees=[])
+    ledger.load()
+
+    ledger.add_fees({0: [(0.02, 'USDT', 0.001)]})
+    assert ledger.frame().loc[0, 'fee'] == 0.02
+
+
+def test_fee_updates_do_not_read_the_history(tmp_path, monkeypatch):
+    ledger = OrderLedger(tmp_path / 'orders.csv', chunk_size=2)
+    for n in range(3):
+        append(ledger, n, fees=[])
+    ledger.add_fees({0: [(0.01, 'USDT', 0.001)]})
+    ledger.load()
+    append(ledger, 3, fees=[])  # buffered
+
+    monkeypatch.setattr(OrderLedger, 'fee_table', lambda self: pytest.fail('sidecar read again'))
+    ledger.add_fees({1: [(0.02, 'USDT', 0.001)], 3: [(0.04, 'BNB', None)]})
+    ledger.add_fees({0: [(0.001, 'BNB', 0.00075)]})  # now two currencies
+
+    df = ledger.frame()
+    assert df['fee'].tolist() == ['N.A.', 0.02, 'N.A.', 0.04]
+    assert (df.loc[3, 'fee currency'], df.loc[3, 'fee rate']) == ('BNB', 'N.A.')
+
+
+def test_partial_last_line_is_removed(tmp_path):
+    ledger = OrderLedger(tmp_path / 'orders.csv')
+    append(ledger, 0)
+    append(ledger, 1)
+    content = (tmp_path / 'orders.csv').read_text()
+    (tmp_path / 'orders.csv').write_text(content[:-20])  # crash while appending N = 1
+
+    ledger = OrderLedger(tmp_path / 'orders.csv')
+    rows = append(ledger, 1)
+    assert list(rows.index) == [1]
+    assert list(ledger.frame().index) == [0, 1]
+
+    (tmp_path / 'orders.csv').write_text((tmp_path / 'orders.csv').read_text()[:-5])
+    assert list(OrderLedger(tmp_path / 'orders.csv').frame().index) == [0]
@@ -0,0 +1,100 @@
+from email import message_from_string
+import smtplib
+
+import pytest
+
+from utils.mail_notifier import DebuggingSMTP, Notifier
+
+
+def config(**kwargs):
+    cfg = {'SMTP_SERVER': 'smtp.example.com', 'EMAIL_ADDRESS_FROM': 'bot@example.com',
+           'EMAIL_ADDRESS_TO': 'me@example.com', 'EMAIL_PASSWORD': 'secret', 'EXCHANGE': 'BINANCE', 'TEST': True,
+           'SMTP_DEBUG': True}
+    cfg.update(kwargs)
+    return cfg
+
+
+@pytest.fixture
+def messages():
+    DebuggingSMTP.messages.clear()
+    yield DebuggingSMTP.messages
+    DebuggingSMTP.messages.clear()
+
+
+def subjects(messages):
+    return [message_from_string(msg)['subject'] for _, _, msg in messages]
+
+
+def body(message):
+    html = message_from_string(message[2]).get_payload()[0]
+    return html.get_payload(decode=True).decode('utf-8')
+
+
+def test_messages_are_delivered_in_order(tmp_path, messages):
+    notifier = Notifier(config(), trades_dir=tmp_path)
+    notifier.info('started')
+    notifier.send('DCA: chart', '<p>body</p>', img=b'\x89PNG\r\n\x1a\n')
+    notifier.send('DCA: no chart', '<p>body</p>', img=tmp_path / 'missing.png')  # sent without the chart
+    assert notifier.flush(timeout=5)
+
+    assert subjects(messages) == ['DCA: info', 'DCA: chart', 'DCA: no chart']
+    assert [len(message_from_string(msg).get_payload()) for _, _, msg in messages] == [1, 2, 1]
+    assert messages[0][:2] == ('bot@example.com', 'me@example.com')
+    assert 'started' in body(messages[0]) and 'binance (test mode)' in body(messages[0])
+    notifier.close(timeout=5)
+
+
+def test_session_is_reused(tmp_path, messages):
+    sessions = []
+
+    def factory():
+        sessions.append(DebuggingSMTP())
+        return sessions[-1]
+
+    notifier = Notifier(config(), smtp_factory=factory, trades_dir=tmp_path)
+    for n in range(3):
+        notifier.info(str(n))
+    notifier.flush(timeout=5)
+
+    assert len(messages) == 3 and len(sessions) == 1
+    notifier.close(timeout=5)
+    assert notifier.server is None
+
+
+def test_sending_requires_a_login(messages):
+    with pytest.raises(smtplib.SMTPSenderRefused):
+        DebuggingSMTP().sendmail('bot@example.com', 'me@example.com', 'Subject: test\n\nbody')
+    assert messages == []
+
+
+def test_failed_delivery_does_not_stop_the_thread(tmp_path, messages):
+    attempts = []
+
+    def factory():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise smtplib.SMTPServerDisconnected('down')
+        return DebuggingSMTP()
+
+    notifier = Notifier(config(SMTP_RETRIES=1), smtp_factory=factory, trades_dir=tmp_path)
+    notifier.info('lost')
+    notifier.info('delivered')
+    notifier.flush(timeout=5)
+
+    assert len(attempts) == 2
+    assert 'delivered' in body(messages[0]) and len(messages) == 1
+    notifier.close(timeout=5)
+
+
+def test_views_share_the_delivery_thread(tmp_path, messages):
+    notifier = Notifier(config(), trades_dir=tmp_path / 'a')
+    view = notifier.view(config(EXCHANGE='KRAKEN', TEST=False), tmp_path / 'b')
+
+    assert view.queue is notifier.queue and view.thread is notifier.thread
+    assert view.trades_dir == tmp_path / 'b'
+    view.info('from the view')
+    notifier.flush(timeout=5)
+
+    assert len(messages) == 1
+    assert 'kraken' in body(messages[0]) and 'test mode' not in body(messages[0])
+    notifier.close(timeout=5)
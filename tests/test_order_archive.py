@@ -0,0 +1,81 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from utils.exchange import order_to_dataframe
+from utils.ledger import OrderLedger
+from utils.order_archive import OrderArchive
+
+JAN = int(datetime.datetime(2024, 1, 15, tzinfo=datetime.timezone.utc).timestamp() * 1000)
+FEB = int(datetime.datetime(2024, 2, 15, tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+
+def orders(rows):
+    """Ledger rows (N, coin, timestamp, cost, fee) in the format of orders.csv"""
+    frames = []
+    for n, coin, timestamp, cost, fee in rows:
+        fees = [{'cost': fee, 'currency': 'USDT', 'rate': 0.001}] if fee is not None else []
+        order = {'datetime': '2024-01-01T00:00:00.000Z', 'timestamp': timestamp, 'symbol': coin + '/USDT',
+                 'status': 'closed', 'filled': cost / 100, 'average': 100.0, 'cost': cost, 'remaining': 0.0,
+                 'fees': fees}
+        frames.append(order_to_dataframe(order, coin).set_index(pd.Index([n], name='N')))
+    return pd.concat(frames)
+
+
+def test_append_and_read(tmp_path):
+    archive = OrderArchive(tmp_path / 'archive')
+    assert archive.is_empty() and archive.next_n() == 0
+    archive.append(orders([(0, 'BTC', JAN, 20, 0.02), (1, 'ETH', JAN, 10, None), (2, 'BTC', FEB, 30, 0.03)]))
+
+    assert (tmp_path / 'archive' / 'coin=BTC' / 'month=2024-02').is_dir()
+    df = archive.read()
+    assert list(df.index) == [0, 1, 2] and archive.next_n() == 3
+    assert df['fee'].isna().tolist() == [False, True, False]  # 'N.A.' is null
+    assert df.loc[0, 'fee currency'] == 'USDT' and df.loc[2, 'cost'] == 30
+
+
+def test_filters_by_coin_and_time(tmp_path):
+    archive = OrderArchive(tmp_path / 'archive')
+    archive.append(orders([(0, 'BTC', JAN, 20, 0.02), (1, 'ETH', JAN, 10, None), (2, 'BTC', FEB, 30, 0.03)]))
+
+    assert list(archive.read(coin='BTC').index) == [0, 2]
+    assert list(archive.read(start='2024-02-01').index) == [2]
+    assert list(archive.read(coin=['ETH', 'BTC'], end='2024-02-01').index) == [0, 1]
+    assert archive.coin_values('BTC', 'cost') == [20, 30]
+    assert archive.coin_stats_frame(coin='BTC')['cost'].sum() == 50
+
+
+def test_import_csv(tmp_path):
+    ledger = OrderLedger(tmp_path / 'orders.csv')
+    for row in [(0, 'BTC', JAN, 20, 0.02), (1, 'ETH', JAN, 10, None), (2, 'BTC', FEB, 30, 0.03)]:
+        ledger.append(orders([row]))
+    archive = OrderArchive(tmp_path / 'archive')
+
+    assert archive.import_csv(tmp_path / 'orders.csv', start_n=1) == 2
+    df = archive.read()
+    assert list(df.index) == [1, 2]
+    assert df['fee'].isna().tolist() == [True, False] and df.loc[2, 'fee rate'] == 0.001
+    assert archive.import_csv(tmp_path / 'orders.csv', start_n=3) == 0
+
+
+def test_update_fees(tmp_path):
+    archive = OrderArchive(tmp_path / 'archive')
+    archive.append(orders([(0, 'BTC', JAN, 20, None), (1, 'BTC', JAN, 10, None)]))
+    archive.update({1: {'fee': 0.01, 'fee currency': 'BNB', 'fee rate': 0.00075}})
+
+    df = archive.read()
+    assert df['fee'].isna().tolist() == [True, False]
+    assert (df.loc[1, 'fee'], df.loc[1, 'fee currency']) == (0.01, 'BNB')
+    assert len(list((tmp_path / 'archive' / 'coin=BTC' / 'month=2024-01').iterdir())) == 1
+
+
+def test_partitions_are_compacted(tmp_path):
+    archive = OrderArchive(tmp_path / 'archive', max_files=3)
+    for n in range(5):
+        archive.append(orders([(n, 'BTC', JAN + n, 20, 0.02)]))
+
+    assert len(archive.fragments('BTC', '2024-01')) < 3
+    assert list(archive.read().index) == list(range(5))
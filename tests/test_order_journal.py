@@ -0,0 +1,68 @@
+import json
+
+from utils.order_journal import OrderJournal
+
+
+def test_append_and_read(tmp_path):
+    journal = OrderJournal(tmp_path / 'orders.jsonl')
+    journal.append({'id': '1', 'cost': 10})
+    journal.append({'id': '2', 'cost': 20})
+
+    assert [order['id'] for order in journal] == ['1', '2']
+    assert (tmp_path / 'orders.jsonl').read_text().count('\n') == 2
+
+
+def test_compaction_drops_duplicates_and_corrupted_lines(tmp_path):
+    filename = tmp_path / 'orders.jsonl'
+    filename.write_text('{"id":"1"}\n{"id":"2"}\nnot json\n{"id":"1"}\n{"cost":5}\n')
+
+    journal = OrderJournal(filename, compact_every=0)
+    journal.compact()
+
+    lines = filename.read_text().splitlines()
+    assert [json.loads(line) for line in lines] == [{'id': '1'}, {'id': '2'}, {'cost': 5}]
+    assert not (tmp_path / 'orders.jsonl.tmp').exists()
+
+
+def test_compaction_every_n_appends(tmp_path):
+    journal = OrderJournal(tmp_path / 'orders.jsonl', compact_every=3)
+    for order_id in ['1', '1', '2']:
+        journal.append({'id': order_id})
+
+    assert [order['id'] for order in journal] == ['1', '2']
+    assert journal.appended == 0
+
+
+def test_tail_repair_truncates_interrupted_write(tmp_path):
+    filename = tmp_path / 'orders.jsonl'
+    filename.write_text('{"id":"1"}\n{"id":"2"}\n{"id":"3","co')
+
+    journal = OrderJournal(filename)
+    assert filename.read_text() == '{"id":"1"}\n{"id":"2"}\n'
+
+    # the next order starts on a clean line
+    journal.append({'id': '4'})
+    assert [order['id'] for order in journal] == ['1', '2', '4']
+
+
+def test_tail_repair_of_a_single_partial_line(tmp_path):
+    filename = tmp_path / 'orders.jsonl'
+    filename.write_text('{"id":"1"')
+
+    OrderJournal(filename)
+    assert filename.read_text() == ''
+
+
+def test_legacy_file_is_migrated_once_and_left_in_place(tmp_path):
+    legacy = tmp_path / 'orders.json'
+    legacy.write_text(json.dumps([{'id': '1'}, {'id': '2'}]))
+
+    journal = OrderJournal(tmp_path / 'orders.jsonl', legacy_filename=legacy)
+    journal.append({'id': '3'})
+    assert legacy.exists()
+    assert [order['id'] for order in journal] == ['1', '2', '3']
+
+    # the journal exists: the legacy file is not migrated again
+    journal = OrderJournal(tmp_path / 'orders.jsonl', legacy_filename=legacy)
+    assert [order['id'] for order in journal] == ['1', '2', '3']
+    assert json.loads(legacy.read_text()) == [{'id': '1'}, {'id': '2'}]
@@ -0,0 +1,55 @@
+import ccxt
+import pytest
+
+from utils.quotes import QuoteSnapshot
+from utils.simulated_exchange import SimulatedExchange
+
+SYMBOLS = ['BTC/USDT', 'ETH/USDT', 'XRP/USDT']
+
+
+def exchange():
+    return SimulatedExchange({'BTC/USDT': [40000, 41000], 'ETH/USDT': [2000], 'XRP/USDT': [0.5]},
+                             advance_on_order=False)
+
+
+def test_prices_are_fetched_together_and_reused():
+    ex = exchange()
+    quotes = QuoteSnapshot(ex, SYMBOLS, max_age=60)
+    assert quotes.cached_price('BTC/USDT') is None
+
+    assert quotes.price('BTC/USDT') == 40000
+    ex.advance()
+    assert quotes.price('ETH/USDT') == 2000 and quotes.price('BTC/USDT') == 40000  # same snapshot
+    assert ex.calls == {'fetch_tickers': 1}
+
+
+def test_stale_prices_are_fetched_again():
+    ex = exchange()
+    quotes = QuoteSnapshot(ex, SYMBOLS, max_age=60)
+    quotes.refresh()
+    ex.advance()
+    quotes.quotes['BTC/USDT']['timestamp'] -= 61
+
+    assert quotes.cached_price('BTC/USDT') is None
+    assert quotes.price('BTC/USDT') == 41000
+    assert ex.calls['fetch_tickers'] == 2
+
+
+def test_without_fetch_tickers_symbols_are_fetched_one_by_one():
+    ex = exchange()
+    ex.has['fetchTickers'] = False
+    quotes = QuoteSnapshot(ex, SYMBOLS)
+    quotes.refresh(['BTC/USDT', 'ETH/USDT'])
+
+    assert ex.calls == {'fetch_ticker': 2}
+    assert quotes.cached_price('ETH/USDT') == 2000 and quotes.cached_price('XRP/USDT') is None
+
+
+def test_missing_ticker_raises_a_network_error(monkeypatch):
+    ex = exchange()
+    quotes = QuoteSnapshot(ex, SYMBOLS)
+    monkeypatch.setattr(ex, 'fetch_tickers', lambda symbols=None: {})
+    monkeypatch.setattr(ex, 'fetch_ticker', lambda symbol: {'symbol': symbol, 'last': None})
+
+    with pytest.raises(ccxt.NetworkError):  # retried by the bot
+        quotes.price('BTC/USDT')
@@ -0,0 +1,88 @@
+import datetime
+import time
+
+from utils.retry_policy import CircuitBreaker, RetryPolicy
+
+
+def expire(breaker):
+    """End the cooldown of an open breaker"""
+    breaker.open_until = time.monotonic() - 1
+
+
+def test_delays_grow_up_to_the_cap():
+    policy = RetryPolicy(5, 10, factor=2, max_delay=60, jitter=0)
+    assert [policy.delay(attempt) for attempt in range(1, 7)] == [10, 20, 40, 60, 60, False]
+
+
+def test_jitter_stays_within_bounds():
+    policy = RetryPolicy(1, 100, jitter=0.2)
+    delays = {policy.delay(1) for _ in range(200)}
+    assert min(delays) >= 80 and max(delays) <= 120 and len(delays) > 1
+
+
+def test_delays_are_at_least_one_second():
+    assert RetryPolicy(1, 0.1, jitter=0).delay(1) == 1
+
+
+def test_breaker_opens_after_the_threshold():
+    breaker = CircuitBreaker('binance', threshold=3, cooldown=60)
+    assert not breaker.record_failure() and not breaker.record_failure()
+    assert not breaker.is_open() and breaker.resume_time() is None
+
+    assert breaker.record_failure()
+    assert breaker.is_open() and not breaker.is_half_open()
+    assert breaker.resume_time() > datetime.datetime.today() + datetime.timedelta(seconds=50)
+
+
+def test_success_resets_the_count():
+    breaker = CircuitBreaker('binance', threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    assert not breaker.record_failure()
+
+
+def test_immediate_failure_opens_the_breaker():
+    breaker = CircuitBreaker('binance', threshold=3)
+    assert breaker.record_failure(immediate=True)
+    assert breaker.is_open()
+
+
+def test_half_open_probe_success_closes_the_breaker():
+    breaker = CircuitBreaker('binance', threshold=1, cooldown=60)
+    breaker.record_failure()
+    expire(breaker)
+
+    assert breaker.is_half_open() and not breaker.is_open()
+    breaker.record_success()
+    assert not breaker.is_open() and not breaker.is_half_open()
+    assert breaker.openings == 0 and breaker.resume_time() is None
+
+
+def test_half_open_probe_failure_doubles_the_cooldown():
+    breaker = CircuitBreaker('binance', threshold=1, cooldown=60, max_cooldown=200)
+    breaker.record_failure()
+    for openings, cooldown in [(2, 120), (3, 200)]:
+        expire(breaker)
+        assert breaker.record_failure()
+        remaining = breaker.open_until - time.monotonic()
+        assert breaker.openings == openings and cooldown * 0.99 <= remaining <= cooldown * 1.1
+        assert breaker.is_open()
+
+
+def test_state_round_trip():
+    breaker = CircuitBreaker('binance', threshold=1, cooldown=60)
+    breaker.record_failure()
+    state = breaker.state()
+
+    restored = CircuitBreaker('binance', threshold=1, cooldown=60)
+    restored.restore(state)
+    assert restored.is_open() and restored.openings == 1 and restored.failures == 1
+    assert abs(restored.open_until - breaker.open_until) < 1
+
+    # the cooldown ended while the bot was stopped: the next purchase is a probe
+    state['reopen_time'] = (datetime.datetime.today() - datetime.timedelta(seconds=5)).isoformat()
+    restored.restore(state)
+    assert restored.is_half_open()
+
+    restored.restore(CircuitBreaker('binance').state())
+    assert not restored.is_open() and not restored.is_half_open()
@@ -0,0 +1,98 @@
+import random
+
+from utils.scheduler import KeyedStore, Scheduler
+
+
+def test_peek_returns_the_closest_purchase():
+    book = Scheduler()
+    book['BTC'] = 30
+    book['ETH'] = 10
+    book['XRP'] = 20
+    assert book.peek() == ('ETH', 10)
+    assert book['XRP'] == 20 and 'XRP' in book and len(book) == 3
+
+
+def test_rescheduling_invalidates_the_old_entry():
+    book = Scheduler()
+    book['BTC'] = 10
+    book['ETH'] = 20
+    book['BTC'] = 30
+
+    assert book.peek() == ('ETH', 20)
+    assert book.items() == [('ETH', 20), ('BTC', 30)]
+    assert book.due(25) == ['ETH']
+
+
+def test_removed_coins_are_ignored():
+    book = Scheduler()
+    book['BTC'] = 10
+    book['ETH'] = 20
+    book.remove('BTC')
+
+    assert book.peek() == ('ETH', 20)
+    assert book.due(100) == ['ETH']
+    assert 'BTC' not in book.pop_changed()
+
+
+def test_ties_keep_the_first_scheduling_order():
+    book = Scheduler()
+    for coin in ['XRP', 'BTC', 'ETH']:
+        book[coin] = 10
+    book['XRP'] = 10  # rescheduled: keeps its rank
+    assert book.due(10) == ['XRP', 'BTC', 'ETH']
+
+
+def test_pop_changed_returns_rescheduled_coins_once():
+    book = Scheduler()
+    book['BTC'] = 10
+    book['ETH'] = 20
+    assert book.pop_changed() == {'BTC', 'ETH'}
+    book['BTC'] = 40
+    assert book.pop_changed() == {'BTC'}
+    assert book.pop_changed() == set()
+
+
+def test_stale_entries_are_purged():
+    book = Scheduler()
+    book['BTC'] = 0
+    book['ETH'] = 1
+    for when in range(2, 200):
+        book['BTC'] = when
+    assert len(book.heap) <= 2 * len(book) + 16
+    assert book.peek() == ('ETH', 1)
+
+
+def test_due_matches_a_full_sort():
+    rng = random.Random(0)
+    book = Scheduler()
+    coins = [f'C{i}' for i in range(50)]
+    for _ in range(500):
+        coin = rng.choice(coins)
+        if coin in book and rng.random() < 0.1:
+            book.remove(coin)
+        else:
+            book[coin] = rng.randint(0, 100)
+        until = rng.randint(0, 100)
+        expected = [coin for coin, when in book.items() if when <= until]
+        assert book.due(until) == expected
+
+
+def test_keyed_store_persists_entries(tmp_path):
+    store = KeyedStore(tmp_path / 'store.db', table='schedule')
+    store.update({'BTC': {'Purchase Time': '2024-01-01 10:00:00'}, 'ETH': {'Purchase Time': '2024-01-02'}})
+    store.delete('ETH')
+    store.close()
+
+    store = KeyedStore(tmp_path / 'store.db', table='schedule')
+    assert store.items() == [('BTC', {'Purchase Time': '2024-01-01 10:00:00'})]
+    assert store.get('ETH') is None
+    store.close()
+
+
+def test_keyed_store_counts_its_entries(tmp_path):
+    store = KeyedStore(tmp_path / 'store.db')
+    assert len(store) == 0
+    store.update({'a': 1, 'b': 2})
+    store.delete('a')
+    assert len(store) == 1
+    store.close()
@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+import ccxt
+import pytest
+
+from utils.simulated_exchange import AsyncSimulatedExchange, SimulatedExchange
+
+
+def exchange(**kwargs):
+    return SimulatedExchange({'BTC/USDT': [40000, 41000]}, balance={'USDT': 100}, **kwargs)
+
+
+def test_orders_update_the_balance_and_the_price():
+    ex = exchange()
+    order = ex.create_order('BTC/USDT', 'market', 'buy', None, params={'quoteOrderQty': 40})
+
+    assert order['status'] == 'closed' and order['filled'] == 0.001
+    assert ex.fetch_balance()['free']['BTC'] == 0.001
+    assert ex.balance['USDT'] == pytest.approx(100 - 40 * 1.001)
+    assert ex.fetch_ticker('BTC/USDT')['last'] == 41000
+    with pytest.raises(ccxt.InsufficientFunds):
+        ex.create_order('BTC/USDT', 'market', 'buy', 1)
+
+
+def test_scripted_errors():
+    ex = exchange(errors={'fetch_ticker': [ccxt.NetworkError, None]})
+    with pytest.raises(ccxt.NetworkError):
+        ex.fetch_ticker('BTC/USDT')
+    assert ex.fetch_ticker('BTC/USDT')['last'] == 40000
+    assert ex.calls['fetch_ticker'] == 2
+
+
+def test_async_calls_overlap_with_their_own_latency():
+    ex = exchange(latency={'fetch_ticker': 0.2, 'fetch_order': 0})
+    async_ex = AsyncSimulatedExchange(ex)
+    order = ex.create_order('BTC/USDT', 'market', 'buy', 0.001)
+
+    async def batch():
+        return await asyncio.gather(*[async_ex.fetch_ticker('BTC/USDT') for _ in range(3)],
+                                    async_ex.fetch_order(order['id'], 'BTC/USDT'))
+
+    start = time.monotonic()
+    results = asyncio.run(batch())
+    assert time.monotonic() - start < 0.4  # not 3 x 0.2 s
+    assert results[-1]['id'] == order['id']
+    assert ex.time_in_latency == pytest.approx(0.6)
+    assert ex.latency == {'fetch_ticker': 0.2, 'fetch_order': 0}  # unchanged
+
+    # the synchronous client keeps its latency meanwhile
+    start = time.monotonic()
+    ex.fetch_ticker('BTC/USDT')
+    assert time.monotonic() - start >= 0.2
@@ -0,0 +1,103 @@
+import datetime
+import json
+
+import pytest
+
+from utils.exchange import order_to_dataframe
+from utils.storage import open_storage, SQLiteStorage
+
+
+def order(n, cost=20.0, fees=None):
+    return {'id': str(n), 'datetime': '2024-01-01T00:00:00.000Z', 'timestamp': 1704067200000 + n,
+            'symbol': 'BTC/USDT', 'status': 'closed', 'filled': cost / 40000, 'average': 40000.0, 'cost': cost,
+            'remaining': 0.0, 'fees': fees if fees is not None else [{'cost': 0.02, 'currency': 'USDT', 'rate': 0.001}]}
+
+
+def record(storage, coin_stats, n, **kwargs):
+    new = order(n, **kwargs)
+    df = order_to_dataframe(new, 'BTC')
+    coin_stats.update('BTC', df['price'][0], df['cost'][0], df['filled'][0])
+    return storage.record_purchase('BTC', new, df, coin_stats)
+
+
+@pytest.fixture(params=['files', 'sqlite'])
+def storage(request, tmp_path):
+    storage = open_storage({'STORAGE': request.param}, tmp_path)
+    yield storage
+    storage.close()
+
+
+def test_purchases_are_recorded(storage):
+    coin_stats = storage.coin_stats()
+    assert [record(storage, coin_stats, n, cost=10.0 * (n + 1)) for n in range(3)] == [0, 1, 2]
+
+    df = storage.orders_frame()
+    assert list(df.index) == [0, 1, 2] and df['cost'].tolist() == [10, 20, 30]
+    assert storage.coin_values('BTC', 'cost') == [10, 20, 30]
+    assert storage.next_n() == 3
+    assert storage.coin_stats().aggregates['BTC']['cost'] == 60
+    assert storage.last_order_time('BTC') <= datetime.datetime.now()
+    assert storage.last_order_time('ETH') is None
+
+
+def test_fees_resolved_later(storage):
+    coin_stats = storage.coin_stats()
+    record(storage, coin_stats, 0, fees=[])
+    record(storage, coin_stats, 1, fees=[])
+    assert storage.orders_frame()['fee'].tolist() == ['N.A.', 'N.A.']
+
+    storage.update_fees({0: [(0.01, 'BNB', 0.00075)], 1: [(0.01, 'BNB', None), (0.02, 'USDT', 0.001)]})
+    df = storage.orders_frame()
+    assert (df.loc[0, 'fee'], df.loc[0, 'fee currency']) == (0.01, 'BNB')
+    assert df.loc[1, 'fee'] == 'N.A.'  # several currencies: stored aside
+    fees = storage.fee_table()
+    assert sorted(fees[fees['N'] == 1]['fee currency']) == ['BNB', 'USDT']
+
+
+def test_fees_in_several_currencies(storage):
+    record(storage, storage.coin_stats(), 0, fees=[{'cost': 0.01, 'currency': 'BNB', 'rate': None},
+                                                   {'cost': 0.02, 'currency': 'USDT', 'rate': 0.001}])
+    assert storage.orders_frame().loc[0, 'fee'] == 'N.A.'
+    assert sorted(storage.fee_table()['fee currency']) == ['BNB', 'USDT']
+
+
+def test_schedule_and_export(storage, tmp_path):
+    record(storage, storage.coin_stats(), 0)
+    storage.schedule.update({'BTC': {'Purchase Time': '2024-01-02 10:00:00', 'Cycle': 'daily', 'Strategy': ''}})
+    storage.export_csv(tmp_path / 'export')
+
+    assert (tmp_path / 'export' / 'orders.csv').exists() and (tmp_path / 'export' / 'stats.csv').exists()
+    assert 'BTC,2024-01-02 10:00:00,daily' in (tmp_path / 'export' / 'next_purchases.csv').read_text()
+
+
+def test_sqlite_imports_a_files_folder(tmp_path):
+    files = open_storage({'STORAGE': 'files'}, tmp_path)
+    coin_stats = files.coin_stats()
+    for n in range(2):
+        record(files, coin_stats, n, fees=[])
+    files.update_fees({1: [(0.01, 'BNB', 0.00075)]})
+    files.schedule.update({'BTC': {'Purchase Time': '2024-01-02 10:00:00', 'Cycle': 'daily'}})
+    files.close()
+
+    sqlite = open_storage({'STORAGE': 'sqlite'}, tmp_path)
+    assert isinstance(sqlite, SQLiteStorage)
+    df = sqlite.orders_frame()
+    assert list(df.index) == [0, 1] and df.loc[1, 'fee currency'] == 'BNB'
+    assert sqlite.coin_stats().aggregates['BTC']['n'] == 2
+    assert sqlite.schedule.get('BTC')['Cycle'] == 'daily'
+    assert sqlite.connection.execute('SELECT COUNT(*) FROM raw_orders').fetchone()[0] == 2
+    sqlite.close()
+
+
+def test_import_does_not_change_the_folder(tmp_path):
+    source = tmp_path / 'source'
+    source.mkdir()
+    order_to_dataframe(order(0), 'BTC').rename_axis('N').to_csv(source / 'orders.csv')
+    (source / 'orders.json').write_text(json.dumps([order(0)]))
+    before = sorted(path.name for path in source.iterdir())
+
+    storage = SQLiteStorage(tmp_path / 'trades.db')
+    storage.import_trades(source)
+    assert storage.connection.execute('SELECT id FROM raw_orders').fetchall() == [('0',)]
+    assert sorted(path.name for path in source.iterdir()) == before  # no orders.jsonl written
+    storage.close()
@@ -0,0 +1,118 @@
+import asyncio
+import atexit
+import logging
+import threading
+from utils.fill_tracker import FillTracker
+
+
+class AsyncExecutionEngine(object):
+    """
+    Execute several market orders concurrently (ccxt.async_support). The engine owns an event loop running
+    in a background thread, so that it can be driven by the (synchronous) bot loop.
+    Requests are throttled by the ccxt rate limiter and by "max_concurrency".
+    """
+    def __init__(self, exchange, max_concurrency=5, fill_tracker=None, loop=None, http=None):
+        """
+        Args:
+            exchange: async ccxt exchange (see connect_to_exchange)
+            max_concurrency: maximum number of orders in flight
+            fill_tracker: FillTracker used to wait for the orders to be filled
+            loop: event loop (already running in another thread) shared with other engines.
+                If None, the engine runs its own loop
+            http: HttpPool providing the (keep-alive) session of the exchange
+        """
+        self.exchange = exchange
+        self.max_concurrency = max_concurrency
+        self.fill_tracker = fill_tracker if fill_tracker is not None else FillTracker(exchange)
+
+        self.owns_loop = loop is None
+        self.closed = False
+        if self.owns_loop:
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self.loop.run_forever, name='async-engine', daemon=True)
+            self.thread.start()
+        else:
+            self.loop = loop
+        atexit.register(self.close)
+        if http is not None:
+            self.run(http.open_async_session(exchange))
+
+    def run(self, coroutine, timeout=None):
+        """
+        Run a coroutine on the engine loop and wait for its result
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def execute(self, requests):
+        """
+        Execute a batch of orders concurrently.
+        Args:
+            requests: dictionary coin -> request (see place_order for the keys)
+        Returns:
+            dictionary coin -> (order, price) or the exception raised while placing the order
+        """
+        return self.run(self.gather(requests))
+
+    async def gather(self, requests):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def limited(request):
+            async with semaphore:
+                return await self.place_order(**request)
+
+        coins = list(requests)
+        results = await asyncio.gather(*[limited(requests[coin]) for coin in coins], return_exceptions=True)
+        return dict(zip(coins, results))
+
+    async def place_order(self, symbol, amount, mapper=None, quote_order_qty=False, price=None):
+        """
+        Place a market buy order.
+        Args:
+            symbol: symbol to buy (e.g., BTC/USDT)
+            amount: quantity to buy in the pairing currency (ignored if a mapper is given)
+            mapper: PriceMapper used to get the amount from the current price (None for the classic DCA)
+            quote_order_qty: if True, the amount is given to the exchange in the pairing currency (binance)
+            price: last price of the symbol (e.g., from a QuoteSnapshot). If None, the ticker is fetched when needed
+        Returns:
+            (order, price). The order is None if the price is outside the buy conditions.
+        """
+        type_order = 'market'
+        side = 'buy'
+        last_price = price
+        price = None
+
+        if mapper is not None:
+            if last_price is None:
+                last_price = (await self.exchange.fetch_ticker(symbol))['last']
+            price = last_price
+            amount = mapper.get_amount(price)
+            if amount == 0:
+                return None, price
+
+        if quote_order_qty:
+            params = {
+                'quoteOrderQty': amount,
+                }
+            order = await self.exchange.create_order(symbol, type_order, side, amount, price, params)
+        else:
+            if last_price is None:
+                last_price = (await self.exchange.fetch_ticker(symbol))['last']
+            amount = self.exchange.amount_to_precision(symbol, amount / float(last_price))
+            order = await self.exchange.create_order(symbol, type_order, side, amount, price)
+            # for some exchanges (as FTX) the order must be retrieved to be updated
+            order = await self.fill_tracker.wait_for_fill_async(order, symbol)
+        return order, price
+
+    def close(self):
+        if self.closed or self.loop.is_closed():
+            return
+        self.closed = True
+        try:
+            self.run(self.exchange.close(), timeout=10)
+        except Exception as e:
+            logging.warning(f"Closing the async exchange failed: {type(e).__name__} {str(e)}")
+        if not self.owns_loop:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=10)
+        self.loop.close()
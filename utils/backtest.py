@@ -0,0 +1,245 @@
+"""
+Backtest DCA plans (Classic, BuyBelow and VariableAmount) on historical candles.
+
+Candle files are csv files with the columns returned by ccxt fetch_ohlcv (timestamp in ms, open, high, low,
+close, volume), with or without a header. Example:
+    python -m utils.backtest --config config/config.yml --candles BTC=data/BTC_USDT_1h.csv --start 2021-01-01
+Compare variants of the plan (all the combinations of the values, backtested in a process pool):
+    python -m utils.backtest --candles BTC=data/BTC_USDT_1h.csv --grid CYCLE=daily,weekly AT_TIME=08:00,20:00
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import logging
+import os
+from utils.misc import lazy_import, load_config, format_table
+from utils.stats_and_plots import CoinStats
+from utils.timing import get_hour_minute, get_on_weekday, get_on_day
+from utils.trade_strategies import get_strategy
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+ohlcv_columns = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+
+
+def load_candles(filename):
+    """
+    Read a candle file. Returns (open times as datetime64[ms], open prices, close prices)
+    """
+    with open(filename, 'r', encoding='utf-8') as file:
+        has_header = not file.readline().split(',')[0].strip().isdigit()
+    df = pd.read_csv(filename, header=0 if has_header else None, usecols=range(6))
+    df.columns = ohlcv_columns
+    df = df.sort_values('timestamp').drop_duplicates('timestamp')
+    times = df['timestamp'].to_numpy(dtype='int64').astype('datetime64[ms]')
+    return times, df['open'].to_numpy(dtype=float), df['close'].to_numpy(dtype=float)
+
+
+def purchase_times(coin_cfg, start, end):
+    """
+    Expand the cycle of a coin (CYCLE, ON_WEEKDAY, ON_DAY, AT_TIME) into all the purchase times
+    between start and end (included), following the same rules as the bot
+    """
+    start = pd.Timestamp(start)
+    end = pd.Timestamp(end)
+    cycle = coin_cfg['CYCLE'].lower()
+
+    if cycle == 'minutely':
+        return pd.date_range(start.ceil('min'), end, freq='min')
+
+    hours, minutes = get_hour_minute(coin_cfg['AT_TIME'])
+    at_time = pd.Timedelta(hours=hours, minutes=minutes)
+
+    if cycle == 'daily':
+        first = start.normalize() + at_time
+        if first < start:
+            first += pd.Timedelta(days=1)
+        return pd.date_range(first, end, freq='D')
+    elif cycle in ['weekly', 'bi-weekly']:
+        on_weekday = get_on_weekday(coin_cfg['ON_WEEKDAY'])
+        first = start.normalize() + pd.Timedelta(days=(on_weekday - start.weekday()) % 7) + at_time
+        if first < start:
+            first += pd.Timedelta(days=7)
+        return pd.date_range(first, end, freq='7D' if cycle == 'weekly' else '14D')
+    elif cycle == 'monthly':
+        on_day = get_on_day(coin_cfg['ON_DAY'])
+        months = pd.date_range(start.normalize().replace(day=1), end, freq='MS')
+        times = months + pd.Timedelta(days=on_day - 1) + at_time
+        return times[(times >= start) & (times <= end)]
+    else:
+        raise Exception('Cycle not recognized. Valid cycle strings are: "daily", "weekly", '
+                        '"bi-weekly" and "monthly".')
+
+
+def backtest(coin, coin_cfg, candles, start=None, end=None, fee_rate=0.0):
+    """
+    Simulate the purchases of a coin on historical candles.
+    Args:
+        coin: coin to buy (e.g., BTC)
+        coin_cfg: configuration of the coin (same keys as in the config file)
+        candles: (open times, open prices, close prices) as returned by load_candles
+        start, end: backtest interval (default: the whole candle file)
+        fee_rate: fee paid on each purchase (fraction of the cost, deducted from the quantity)
+    Returns:
+        dictionary with the strategy and the same metrics as calculate_stats
+        (N, Quantity, AvgPrice, TotalCost, ROI, ROI%). The ROI is computed at the last purchase price as
+        in the bot, ROI_end and ROI_end% at the last close.
+    """
+    times, opens, closes = candles
+    start = times[0] if start is None else np.datetime64(pd.Timestamp(start), 'ms')
+    end = times[-1] if end is None else min(np.datetime64(pd.Timestamp(end), 'ms'), times[-1])
+
+    schedule = purchase_times(coin_cfg, start, end).to_numpy(dtype='datetime64[ms]')
+    # each purchase is done at the open price of the candle containing the purchase time
+    index = np.searchsorted(times, schedule, side='right') - 1
+    index = index[index >= 0]
+    prices = opens[index]
+
+    strategy, mapper, strategy_string = get_strategy(coin, dict(coin_cfg))
+    if mapper is None:
+        amounts = np.full(prices.shape, float(coin_cfg['AMOUNT']))
+    else:
+        amounts = mapper.get_amounts(prices)
+    bought = amounts > 0
+    prices = prices[bought]
+    costs = amounts[bought]
+
+    result = {'Coin': coin, 'Strategy': strategy_string}
+    if prices.size == 0:
+        result.update({column: 0 for column in CoinStats.columns})
+        result.update({'ROI_end': 0, 'ROI_end%': 0})
+        return result
+
+    filled = costs * (1 - fee_rate) / prices
+    stats = CoinStats()
+    stats.aggregates[coin] = {'n': int(prices.size),
+                              'cost': float(costs.sum()),
+                              'price_cost': float((prices * costs).sum()),
+                              'filled': float(filled.sum()),
+                              'last_price': float(prices[-1])}
+    result.update(zip(CoinStats.columns, stats.row(coin)))
+
+    last_close = float(closes[np.searchsorted(times, end, side='right') - 1])
+    value = result['Quantity'] * last_close
+    result['ROI_end'] = value - result['TotalCost']
+    result['ROI_end%'] = 100 * result['ROI_end'] / result['TotalCost']
+    return result
+
+
+def parameter_grid(coin, coin_cfg, **grid):
+    """
+    Return the list of (coin, configuration) obtained by replacing the keys of coin_cfg with all the
+    combinations of the given values, e.g. parameter_grid('BTC', cfg, CYCLE=['daily', 'weekly'], AT_TIME=[8, 20])
+    """
+    keys = list(grid)
+    configs = []
+    for values in itertools.product(*[grid[key] for key in keys]):
+        cfg = dict(coin_cfg)
+        cfg.update(zip(keys, values))
+        configs.append((coin, cfg))
+    return configs
+
+
+def parse_grid(items):
+    """
+    Parse the grid options of the command line (e.g., ['CYCLE=daily,weekly', 'AMOUNT=10,20']) into a dictionary
+    key -> list of values (see parameter_grid). Numbers are converted, the other values are kept as strings
+    """
+    def value(x):
+        for kind in [int, float]:
+            try:
+                return kind(x)
+            except ValueError:
+                pass
+        return x
+
+    grid = {}
+    for item in items:
+        key, _, values = item.partition('=')
+        if not values:
+            raise ValueError(f"Grid option {item} should be KEY=VALUE1,VALUE2,...")
+        grid[key.strip().upper()] = [value(x.strip()) for x in values.split(',')]
+    return grid
+
+
+# candles loaded once per worker process (see sweep)
+_candles = {}
+
+
+def _load_worker_candles(candle_files):
+    for coin, filename in candle_files.items():
+        _candles[coin] = load_candles(filename)
+
+
+def _backtest_worker(args):
+    coin, coin_cfg, start, end, fee_rate = args
+    try:
+        return backtest(coin, coin_cfg, _candles[coin], start, end, fee_rate)
+    except Exception as e:
+        return {'Coin': coin, 'Strategy': None, 'Error': f"{type(e).__name__} {str(e)}"}
+
+
+def sweep(configs, candle_files, start=None, end=None, fee_rate=0.0, workers=None, chunksize=64):
+    """
+    Backtest many configurations in a process pool.
+    Args:
+        configs: list of (coin, coin configuration), e.g. from parameter_grid
+        candle_files: dictionary coin -> candle file (each file is read once per worker)
+        start, end, fee_rate: see backtest
+        workers: number of processes (default: number of cpus, at most one per configuration)
+        chunksize: configurations sent to a worker at a time
+    Returns:
+        DataFrame with one row per configuration (same order as configs)
+    """
+    tasks = [(coin, coin_cfg, start, end, fee_rate) for coin, coin_cfg in configs]
+    workers = max(min(workers or os.cpu_count() or 1, len(tasks)), 1)
+    if workers == 1:
+        _load_worker_candles(candle_files)
+        results = [_backtest_worker(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_load_worker_candles,
+                                 initargs=(candle_files,)) as pool:
+            results = list(pool.map(_backtest_worker, tasks, chunksize=chunksize))
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Backtest the DCA plan of a config file on historical candles')
+    parser.add_argument('--config', default='config/config.yml', help='config file')
+    parser.add_argument('--candles', nargs='+', required=True, metavar='COIN=FILE',
+                        help='candle file of each coin (ccxt OHLCV csv)')
+    parser.add_argument('--start', default=None, help='start date (e.g., 2021-01-01)')
+    parser.add_argument('--end', default=None, help='end date')
+    parser.add_argument('--fee', type=float, default=0.0, help='fee rate (e.g., 0.001)')
+    parser.add_argument('--grid', nargs='+', default=[], metavar='KEY=VALUES',
+                        help='values of the coin settings to compare, e.g. CYCLE=daily,weekly AMOUNT=10,20')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: number of cpus)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    cfg = load_config(args.config)
+    # coins are upper case, as in the bot
+    coins = {coin.upper(): coin_cfg for coin, coin_cfg in cfg['COINS'].items()}
+    candle_files = {}
+    for item in args.candles:
+        coin, _, filename = item.partition('=')
+        candle_files[coin.strip().upper()] = filename
+    missing = [coin for coin in candle_files if coin not in coins]
+    if missing:
+        parser.error(f"{', '.join(missing)} not in {args.config}")
+    try:
+        grid = parse_grid(args.grid)
+    except ValueError as e:
+        parser.error(str(e))
+
+    configs = [config for coin in candle_files for config in parameter_grid(coin, coins[coin], **grid)]
+    df = sweep(configs, candle_files, args.start, args.end, args.fee, workers=args.workers)
+
+    columns = list(grid) + ['Strategy'] + CoinStats.columns + ['ROI_end', 'ROI_end%']
+    if 'Error' in df.columns:
+        columns.append('Error')
+    rows = [(coin, [coin_cfg[key] for key in grid] + [row.get(column) for column in columns[len(grid):]])
+            for (coin, coin_cfg), row in zip(configs, df.to_dict('records'))]
+    print(format_table(rows, columns, index_name='Coin'))
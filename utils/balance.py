@@ -0,0 +1,119 @@
+import datetime
+import heapq
+import threading
+import time
+from utils.timing import next_purchase_time
+
+
+class BalanceCache(object):
+    """
+    Balance of the account, fetched once and reused for "ttl" seconds or until a fill invalidates it, so that
+    the startup summary, the funds checks and the funding forecast share a single fetch_balance call.
+    """
+    def __init__(self, exchange, ttl=60):
+        """
+        Args:
+            exchange: ccxt exchange
+            ttl: time (in seconds) a balance is reused
+        """
+        self.exchange = exchange
+        self.ttl = ttl
+        self.balance = None
+        self.timestamp = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        """
+        Return the balance (as returned by fetch_balance), fetching it if missing or stale
+        """
+        with self.lock:
+            if self.balance is None or time.monotonic() - self.timestamp > self.ttl:
+                self.balance = self.exchange.fetch_balance()
+                self.timestamp = time.monotonic()
+            return self.balance
+
+    def invalidate(self):
+        """
+        Force a new fetch at the next use (e.g., after a fill)
+        """
+        with self.lock:
+            self.balance = None
+
+    def available(self, currency):
+        """
+        Return the amount of currency available for the purchases
+        """
+        balance = self.get()
+        # the Kraken API returns total only
+        balance_type = 'total' if self.exchange.id == 'kraken' else 'free'
+        return balance[balance_type].get(currency) or 0
+
+
+def max_cost(coin_cfg):
+    cost = coin_cfg['AMOUNT']
+    if type(cost) is dict:
+        cost = cost['RANGE'][1]  # In this case we check for the maximum possible amount
+    return cost
+
+
+def purchase_times(when, cycle, until, coin=None):
+    """
+    Generate the times of the purchases from "when" to "until" (included), as (time, coin) if coin is given
+    """
+    while when <= until:
+        yield when if coin is None else (when, coin)
+        when = next_purchase_time(when, cycle)
+
+
+def count_purchases(when, cycle, until):
+    """
+    Return the number of purchases from "when" to "until" (included)
+    """
+    if when > until:
+        return 0
+    if cycle.lower() == 'monthly':
+        return sum(1 for _ in purchase_times(when, cycle, until))
+    step = next_purchase_time(when, cycle) - when
+    return int((until - when) / step) + 1
+
+
+def funding_forecast(coins, schedule, balances, horizon, now=None):
+    """
+    Compare, for each pairing currency, the cost of the purchases of the next "horizon" seconds to the balance.
+    Returns a dictionary pairing -> {'needed', 'available', 'orders', 'short_from', 'short_coin'}, where
+    short_from is the time of the first purchase that cannot be funded (None if all of them can).
+    Args:
+        coins: configuration of the coins (CYCLE, AMOUNT, PAIRING)
+        schedule: coin -> time of the next purchase
+        balances: BalanceCache
+        horizon: seconds
+    """
+    if now is None:
+        now = datetime.datetime.today()
+    until = now + datetime.timedelta(seconds=horizon)
+    forecast = {}
+    for coin, when in schedule.items():
+        pairing = coins[coin]['PAIRING']
+        if pairing not in forecast:
+            forecast[pairing] = {'needed': 0, 'available': balances.available(pairing), 'orders': 0,
+                                 'short_from': None, 'short_coin': None, 'coins': []}
+        n = count_purchases(when, coins[coin]['CYCLE'], until)
+        forecast[pairing]['needed'] += n * max_cost(coins[coin])
+        forecast[pairing]['orders'] += n
+        forecast[pairing]['coins'].append(coin)
+
+    for pairing, entry in forecast.items():
+        if entry['needed'] <= entry['available']:
+            continue
+        # the purchases are walked in chronological order up to the first one that cannot be funded
+        purchases = heapq.merge(*[purchase_times(schedule[coin], coins[coin]['CYCLE'], until, coin)
+                                  for coin in entry['coins']])
+        needed = 0
+        for when, coin in purchases:
+            needed += max_cost(coins[coin])
+            if needed > entry['available']:
+                entry['short_from'], entry['short_coin'] = when, coin
+                break
+    for entry in forecast.values():
+        del entry['coins']
+    return forecast
@@ -0,0 +1,127 @@
+import concurrent.futures
+from concurrent.futures import Future, ProcessPoolExecutor
+import io
+import logging
+import multiprocessing
+import threading
+
+
+# Figures are kept alive inside the worker processes (one per chart), so that the Agg canvas is reused
+_figures = {}
+
+
+def _render(key, draw, args, path):
+    """
+    Executed in a worker process: draw the chart on the persistent canvas of "key",
+    save it to "path" and return the PNG bytes.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = _figures.get(key)
+    if fig is None:
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        _figures[key] = fig
+    else:
+        fig.clf()
+
+    draw(fig, *args)
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png')
+    png = buffer.getvalue()
+    if path is not None:
+        with open(path, 'wb') as file:
+            file.write(png)
+    return png
+
+
+def _draw_buy_conditions(fig, mapper):
+    mapper.plot(fig)
+
+
+def _draw_purchases(fig, coin, prices, costs, pairing):
+    from utils.stats_and_plots import plot_purchases
+    plot_purchases(fig, coin, prices, costs, pairing)
+
+
+class ChartRenderer(object):
+    """
+    Render the charts in a pool of worker processes, so that the purchase path never waits for matplotlib.
+    Each request returns a Future holding the PNG bytes. If a chart is requested while a render of the same
+    chart is still in progress, only the latest request is rendered (and all the callers get its result).
+    The workers are spawned: like any script using multiprocessing, the main script must create the renderer
+    under "if __name__ == '__main__'" (as dca_bot.py and dca_multi.py do).
+    """
+    def __init__(self, workers=1):
+        # the workers are spawned, not forked: the bot already runs threads (logging, mails, ...) whose locks
+        # would be copied in whatever state they are
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        self.lock = threading.Lock()
+        self.running = {}  # key -> futures waiting for the render in progress
+        self.pending = {}  # key -> (latest arguments, futures waiting for them)
+
+    def plot_purchases(self, coin, prices, costs, pairing, path=None):
+        if path is None:
+            path = f'trades/graph_{coin}.png'
+        return self.submit(f'purchases_{path}', _draw_purchases, (coin, list(prices), list(costs), pairing), path)
+
+    def plot_buy_conditions(self, mapper, path=None):
+        if path is None:
+            path = f'trades/graph_{mapper.coin}_buy_conditions.png'
+        return self.submit(f'buy_conditions_{path}', _draw_buy_conditions, (mapper,), path)
+
+    def submit(self, key, draw, args, path):
+        future = Future()
+        with self.lock:
+            if key in self.running:
+                # merge with any other request still waiting: only the latest data matter
+                _, waiting = self.pending.get(key, (None, []))
+                waiting.append(future)
+                self.pending[key] = ((draw, args, path), waiting)
+            else:
+                self.launch(key, (draw, args, path), [future])
+        return future
+
+    def launch(self, key, job, waiting):
+        # must be called holding the lock
+        self.running[key] = waiting
+        try:
+            render = self.pool.submit(_render, key, *job)
+        except Exception as e:
+            del self.running[key]
+            for future in waiting:
+                future.set_exception(e)
+            logging.warning(f"Chart rendering failed: {type(e).__name__} {str(e)}")
+            return
+        render.add_done_callback(lambda f: self.completed(key, f))
+
+    def completed(self, key, render):
+        with self.lock:
+            waiting = self.running.pop(key)
+            if key in self.pending:
+                job, next_waiting = self.pending.pop(key)
+                self.launch(key, job, next_waiting)
+
+        error = render.exception()
+        if error is not None:
+            logging.warning(f"Chart rendering failed: {type(error).__name__} {str(error)}")
+        for future in waiting:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(render.result())
+
+    def shutdown(self, wait=True):
+        if wait:
+            # let the coalesced renders complete first
+            while True:
+                with self.lock:
+                    futures = [future for waiting in self.running.values() for future in waiting]
+                    futures += [future for _, waiting in self.pending.values() for future in waiting]
+                if not futures:
+                    break
+                concurrent.futures.wait(futures)
+        self.pool.shutdown(wait=wait)
@@ -0,0 +1,64 @@
+import datetime
+import json
+import logging
+import os
+
+
+class Checkpoint(object):
+    """
+    Checkpoint of a state (json), written atomically: the new state is written to a temporary file, synced to disk
+    and renamed over the previous checkpoint, so that a crash leaves either the old or the new one.
+    Each checkpoint carries the version of its format (checkpoints of other versions are ignored) and a
+    sequence number.
+    """
+    version = 1
+
+    def __init__(self, filename):
+        """
+        Args:
+            filename: json file of the checkpoint
+        """
+        self.filename = filename
+        self.sequence = 0
+        self.last = None  # content of the last checkpoint (unchanged states are not written again)
+
+    def load(self):
+        """
+        Return the state of the last checkpoint (None if missing or not readable)
+        """
+        if not os.path.isfile(self.filename):
+            return None
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as file:
+                checkpoint = json.load(file)
+        except ValueError:
+            logging.warning(f"Checkpoint {self.filename} is corrupted. Ignoring it")
+            return None
+        if checkpoint.get('version') != self.version:
+            logging.warning(f"Checkpoint {self.filename} has version {checkpoint.get('version')} "
+                            f"(expected {self.version}). Ignoring it")
+            return None
+        self.sequence = checkpoint['sequence']
+        self.last = json.dumps(checkpoint['state'], sort_keys=True)
+        return checkpoint['state']
+
+    def save(self, state):
+        """
+        Write the state, if it changed since the last checkpoint. Return True if written
+        """
+        content = json.dumps(state, sort_keys=True)
+        if content == self.last:
+            return False
+        self.sequence += 1
+        checkpoint = {'version': self.version,
+                      'sequence': self.sequence,
+                      'saved': datetime.datetime.now().isoformat(),
+                      'state': state}
+        tmp_filename = str(self.filename) + '.tmp'
+        with open(tmp_filename, 'w', encoding='utf-8') as file:
+            json.dump(checkpoint, file, sort_keys=True)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_filename, self.filename)
+        self.last = content
+        return True
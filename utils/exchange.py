@@ -1,7 +1,9 @@
-import pandas as pd
 import datetime
-import ccxt
 import logging
+from utils.misc import lazy_import
+
+pd = lazy_import('pandas')
+ccxt = lazy_import('ccxt')
 
 
 class ExceededAmountLimits(Exception):
@@ -35,39 +37,73 @@ def check_cost_limits(exchange, coins):
             if (min_ is not None and cost <= min_) or (max_ is not None and cost >= max_):
                 raise ExceededAmountLimits(symbol, min_, max_)
 
-def get_non_zero_balance(exchange, sort_by='total', ascending=False ):
-    """Get non zero balance (total,free and used). Use "sort_by" to sort
-        according to the type of balance"""
-    balance = exchange.fetch_balance()
-    coin_name = []
+def get_non_zero_balance(exchange, sort_by='total', ascending=False, balance=None):
+    """Get non zero balance (total,free and used) as a list of (coin, {'free', 'used', 'total'}).
+        Use "sort_by" to sort according to the type of balance. "balance" is an already fetched balance"""
+    if balance is None:
+        balance = exchange.fetch_balance()
     coin_list = []
     for key in balance['total']:
         if balance['total'][key] > 0:
-            coin_list.append(balance[key])
-            coin_name.append(key)
-    df = pd.DataFrame.from_records(coin_list)
-    df.index = coin_name
-    # sort df
-    if df.shape[0] > 0:
-        df.sort_values(sort_by, axis=0, ascending=ascending, inplace=True)
-    return df
+            coin_list.append((key, balance[key]))
+    # sort the list
+    coin_list.sort(key=lambda item: item[1][sort_by] or 0, reverse=not ascending)
+    return coin_list
 
 
-def get_price(exchange, symbol):
+def get_price(exchange, symbol, quotes=None):
+    """Get the last price of the symbol (from the QuoteSnapshot "quotes", if given)"""
+    if quotes is not None:
+        return quotes.price(symbol)
     exchange.load_markets()
     last_price = exchange.fetch_ticker(symbol)['last']
     return last_price
 
 
-def get_quantity_to_buy(exchange, amount, symbol):
+def get_quantity_to_buy(exchange, amount, symbol, last_price=None):
+    """Convert the amount (in pairing currency) into the quantity to buy, using last_price if given"""
     exchange.load_markets()
-    last_price = exchange.fetch_ticker(symbol)['last']
+    if last_price is None:
+        last_price = exchange.fetch_ticker(symbol)['last']
     amount = exchange.amount_to_precision(symbol, amount / float(last_price))
     return amount
 
 
-def order_to_dataframe(exchange, order, coin):
+def reduce_fees(fees):
+    """
+    Merge the fees (e.g., of the trades of an order) paid in the same currency
+    """
+    reduced = {}
+    for fee in fees:
+        if not fee or fee.get('cost') is None:
+            continue
+        currency = fee.get('currency')
+        if currency in reduced:
+            reduced[currency]['cost'] += fee['cost']
+            if reduced[currency].get('rate') != fee.get('rate'):
+                reduced[currency]['rate'] = None
+        else:
+            reduced[currency] = {'currency': currency, 'cost': fee['cost'], 'rate': fee.get('rate')}
+    return list(reduced.values())
+
+
+def fee_rows(fees):
+    """
+    Return the (fee, fee currency, fee rate) of a list of fees, one tuple per currency (e.g., a part in BNB and
+    a part in USDT). Missing currencies and rates are 'N.A.'
+    """
+    def value(x):
+        return 'N.A.' if x is None else x
+
+    return [(fee['cost'], value(fee['currency']), value(fee['rate'])) for fee in reduce_fees(fees)]
+
 
+def order_to_dataframe(order, coin):
+    """
+    Convert a filled order into a row of the ledger. No request is made: orders returned without fee are
+    recorded with 'N.A.' fees, which are resolved later on (see FeeReconciler). Fees paid in several currencies
+    are 'N.A.' too: they are stored by currency aside (see Storage.update_fees)
+    """
     data = {'datetime (local)': datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
             'datetime (exchange)': order['datetime'],
             'timestamp': order['timestamp'],
@@ -83,40 +119,41 @@ def order_to_dataframe(exchange, order, coin):
             'fee rate': 'N.A.',
             }
 
-    if not order['fee']:
-        # some exchanges return None. Let's try to retrieve fees from the trade history
-        try:
-            if exchange.has['fetchOrderTrades']:
-                trades = exchange.fetch_order_trades(order['id'], order['symbol'], since=None, limit=None, params={})
-                fees = [trade['fee'] for trade in trades]
-                # In case the order is split into multiple trades:
-                fees = exchange.reduce_fees_by_currency(fees)
-                order['fee'] = fees[0]  # We assume fees are paid in the same currency (may not always be true, e.g.,
-                # a portion paid in BNB and a portion in USDT. We are discarding this case)
-        except Exception as e:
-            logging.warning(f"Couldn't retrieve fees due to: {type(e).__name__} {str(e)}")
-
-    if order['fee']:
-        if 'currency' in order['fee']:
-            data['fee currency'] = order['fee']['currency']
-        if 'cost' in order['fee']:
-            data['fee'] = order['fee']['cost']
-        if 'rate' in order['fee']:
-            data['fee rate'] = order['fee']['rate']
+    # some exchanges return the fees of each currency in "fees", others only "fee" (or None)
+    fees = fee_rows(order.get('fees') or [order.get('fee')])
+    if len(fees) == 1:
+        data['fee'], data['fee currency'], data['fee rate'] = fees[0]
 
     df = pd.DataFrame(data, index=[0])
     return df
 
 
-def connect_to_exchange(cfg, api):
+def has_fee(order):
+    """True if the exchange returned the fee of the order"""
+    return bool(reduce_fees(order.get('fees') or [order.get('fee')]))
+
+
+def connect_to_exchange(cfg, api, async_support=False, http=None, pro=False):
     """
-    Connect to the exchange using the cfg info and the api (both already loaded)
+    Connect to the exchange using the cfg info and the api (both already loaded).
+    If async_support is True, the exchange is created from ccxt.async_support (from ccxt.pro, with the websocket
+    methods such as watch_orders, if pro is True).
+    "http" is the HttpPool providing the (keep-alive) session of a synchronous client; the session of an
+    asynchronous client is opened on its event loop (see AsyncExecutionEngine).
     """
     api_test_selector = 'TEST' if cfg['TEST'] else 'REAL'
 
+    if pro:
+        import ccxt.pro as ccxt_module
+        async_support = True
+    elif async_support:
+        import ccxt.async_support as ccxt_module
+    else:
+        ccxt_module = ccxt
+
     exchange_id = cfg['EXCHANGE'].upper()
     if 'PASSPHRASE' in api[exchange_id][api_test_selector]:
-        exchange_class = getattr(ccxt, exchange_id.lower())
+        exchange_class = getattr(ccxt_module, exchange_id.lower())
         exchange = exchange_class({
             'apiKey': api[exchange_id][api_test_selector]['APIKEY'],
             'secret': api[exchange_id][api_test_selector]['SECRET'],
@@ -125,7 +162,7 @@ def connect_to_exchange(cfg, api):
             'options': {'adjustForTimeDifference': True}
         })
     else:
-        exchange_class = getattr(ccxt, exchange_id.lower())
+        exchange_class = getattr(ccxt_module, exchange_id.lower())
         exchange = exchange_class({
             'apiKey': api[exchange_id][api_test_selector]['APIKEY'],
             'secret': api[exchange_id][api_test_selector]['SECRET'],
@@ -133,10 +170,16 @@ def connect_to_exchange(cfg, api):
             'options': {'adjustForTimeDifference': True}
         })
 
+    if http is not None and not async_support:
+        session = http.session()
+        session.trust_env = exchange.requests_trust_env
+        exchange.session = session
+
     if 'TEST' in api_test_selector:
-        logging.info(f"Connected to {exchange_id} in TEST mode!")
+        if not async_support:
+            logging.info(f"Connected to {exchange_id} in TEST mode!")
         exchange.set_sandbox_mode(True)
-    else:
+    elif not async_support:
         logging.info(f"Connected to {exchange_id}!")
         #are_you_sure_to_continue()
 
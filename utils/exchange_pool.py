@@ -0,0 +1,230 @@
+import asyncio
+import atexit
+import hashlib
+import threading
+from pathlib import Path
+from utils.async_engine import AsyncExecutionEngine
+from utils.balance import BalanceCache
+from utils.chart_renderer import ChartRenderer
+from utils.checkpoint import Checkpoint
+from utils.exchange import connect_to_exchange
+from utils.fee_reconciler import FeeReconciler
+from utils.fill_tracker import FillTracker, open_order_stream
+from utils.http_pool import HttpPool
+from utils.mail_notifier import Notifier
+from utils.market_cache import MarketCache
+from utils.metrics import Metrics
+from utils.quotes import QuoteSnapshot
+from utils.retry_policy import CircuitBreaker
+
+
+class ExchangePool(object):
+    """
+    Resources shared by several portfolios (Dca instances) running in the same process:
+    - one client and one balance cache per account (exchange, mode and API key), so portfolios using the same keys
+      share them
+    - one market cache and one price snapshot per exchange (public data), covering the symbols of all the portfolios
+    - one circuit breaker per exchange, so that an outage pauses the purchases of all the portfolios. Their state is
+      checkpointed (and restored) here, not by the portfolios
+    - one fee reconciler per account (run by the waiting portfolio) and one notifier (thread and SMTP session) per
+      mail address
+    - one event loop for the concurrent orders, one chart renderer, one connection layer (HttpPool) and one metrics
+      endpoint for everything
+    The symbols of all the portfolios must be registered (see register) before the first client is created.
+    """
+    def __init__(self, cache_dir=Path('trades'), chart_workers=1, markets_ttl=24*60*60, quote_max_age=5, http=None,
+                 metrics=None):
+        """
+        Args:
+            cache_dir: folder of the shared market caches (and of the checkpoint of the circuit breakers)
+            chart_workers: number of background processes rendering the charts
+            markets_ttl: time (in seconds) after which the market metadata are refreshed
+            quote_max_age: time (in seconds) a price snapshot is considered fresh
+            http: HttpPool of the clients (default settings if None)
+            metrics: Metrics of the shared resources, parent of the metrics of the portfolios (disabled if None)
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.markets_ttl = markets_ttl
+        self.quote_max_age = quote_max_age
+        self.renderer = ChartRenderer(workers=chart_workers)
+        self.http = http if http is not None else HttpPool()
+        self.metrics = metrics if metrics is not None else Metrics('')
+
+        self.symbols = {}  # (exchange, test) -> symbols of all the portfolios
+        self.clients = {}  # (exchange, test, api key) -> client
+        self.caches = {}  # (exchange, test) -> MarketCache
+        self.snapshots = {}  # (exchange, test) -> QuoteSnapshot
+        self.engines = {}  # (exchange, test, api key) -> AsyncExecutionEngine
+        self.balance_caches = {}  # (exchange, test, api key) -> BalanceCache
+        self.breakers = {}  # (exchange, test) -> CircuitBreaker
+        self.checkpoint = Checkpoint(self.cache_dir / 'breakers.json')
+        self.breaker_states = None  # last checkpoint of the breakers (loaded on first use)
+        self.reconcilers = {}  # (exchange, test, api key) -> FeeReconciler
+        self.notifiers = {}  # (smtp server, sender, recipient) -> Notifier
+        self.streams = {}  # (exchange, test, api key) -> WatchOrdersStream (or None)
+        self.stream_lock = threading.Lock()  # streams are opened on first use, possibly by the engines' loop
+        self.loop = None
+
+    @staticmethod
+    def market_key(cfg):
+        return cfg['EXCHANGE'].lower(), bool(cfg['TEST'])
+
+    @staticmethod
+    def account_key(cfg, api):
+        exchange_id = cfg['EXCHANGE'].upper()
+        api_test_selector = 'TEST' if cfg['TEST'] else 'REAL'
+        return cfg['EXCHANGE'].lower(), bool(cfg['TEST']), api[exchange_id][api_test_selector]['APIKEY']
+
+    def register(self, cfg):
+        """
+        Add the symbols of a portfolio to the shared market cache and price snapshot of its exchange
+        """
+        symbols = self.symbols.setdefault(self.market_key(cfg), [])
+        for coin in cfg['COINS']:
+            symbol = coin.upper() + '/' + cfg['COINS'][coin]['PAIRING']
+            if symbol not in symbols:
+                symbols.append(symbol)
+
+    def client(self, cfg, api):
+        """
+        Return the (connected) client of the account, with the markets already loaded
+        """
+        key = self.account_key(cfg, api)
+        if key not in self.clients:
+            exchange = connect_to_exchange(cfg, api, http=self.http)
+            market_key = self.market_key(cfg)
+            if market_key not in self.caches:
+                exchange_id, test = market_key
+                filename = self.cache_dir / f"markets_{exchange_id}{'_test' if test else ''}.json"
+                cache = MarketCache(exchange, self.symbols[market_key], filename, ttl=self.markets_ttl, sandbox=test)
+                cache.load()
+                self.caches[market_key] = cache
+                self.snapshots[market_key] = QuoteSnapshot(exchange, self.symbols[market_key],
+                                                           max_age=self.quote_max_age)
+            else:
+                self.caches[market_key].share(exchange)
+            self.clients[key] = exchange
+        return self.clients[key]
+
+    def market_cache(self, cfg):
+        return self.caches[self.market_key(cfg)]
+
+    def quotes(self, cfg):
+        return self.snapshots[self.market_key(cfg)]
+
+    def balances(self, cfg, api, ttl=60):
+        """
+        Return the balance cache of the account (shared by the portfolios of the same account)
+        """
+        key = self.account_key(cfg, api)
+        if key not in self.balance_caches:
+            self.balance_caches[key] = BalanceCache(self.client(cfg, api), ttl=cfg.get('BALANCE_TTL', ttl))
+        return self.balance_caches[key]
+
+    def breaker(self, cfg):
+        """
+        Return the circuit breaker of the exchange (the settings of the first portfolio are used), restored from
+        the checkpoint of the previous run
+        """
+        key = self.market_key(cfg)
+        if key not in self.breakers:
+            breaker = CircuitBreaker.from_config(cfg, metrics=self.metrics.child(key[0], enabled=self.metrics.enabled))
+            if self.breaker_states is None:
+                self.breaker_states = self.checkpoint.load() or {}
+            state = self.breaker_states.get(self.breaker_name(key))
+            if state is not None:
+                breaker.restore(state)
+            self.breakers[key] = breaker
+        return self.breakers[key]
+
+    @staticmethod
+    def breaker_name(key):
+        exchange_id, test = key
+        return exchange_id + ('_test' if test else '')
+
+    def save_breakers(self):
+        """
+        Checkpoint the state of the circuit breakers (only written if it changed)
+        """
+        self.checkpoint.save({self.breaker_name(key): breaker.state() for key, breaker in self.breakers.items()})
+
+    def metrics_of(self, cfg, name):
+        """
+        Return the metrics of a portfolio (labelled by exchange and portfolio), served by the endpoint of the pool
+        """
+        return self.metrics.child(cfg['EXCHANGE'].lower(), portfolio=name, enabled=cfg.get('METRICS', False))
+
+    def notifier(self, cfg, trades_dir):
+        """
+        Return the notifier of a portfolio. The portfolios sending to the same address share the delivery thread
+        and the SMTP session
+        """
+        key = cfg['SMTP_SERVER'], cfg['EMAIL_ADDRESS_FROM'], cfg['EMAIL_ADDRESS_TO']
+        if key not in self.notifiers:
+            self.notifiers[key] = Notifier(cfg, trades_dir=trades_dir, metrics=self.metrics)
+        return self.notifiers[key].view(cfg, trades_dir)
+
+    def fee_reconciler(self, cfg, api, storage, filename):
+        """
+        Return the fee reconciler of the account, with the storage of a portfolio registered (its pending orders
+        are kept in filename), and the source to give to FeeReconciler.add
+        """
+        key = self.account_key(cfg, api)
+        if key not in self.reconcilers:
+            exchange_id, test, api_key = key
+            # the cursors of the trade history belong to the account (the file name does not show the key)
+            digest = hashlib.sha1(str(api_key).encode('utf-8')).hexdigest()[:8]
+            filename_cursors = self.cache_dir / f"fees_{exchange_id}{'_test' if test else ''}_{digest}.db"
+            self.reconcilers[key] = FeeReconciler(self.client(cfg, api), None, filename_cursors,
+                                                  interval=cfg.get('FEE_RECONCILE_INTERVAL', 60))
+        reconciler = self.reconcilers[key]
+        return reconciler, reconciler.register(storage, filename)
+
+    def order_stream(self, cfg, api):
+        """
+        Return the order stream of the account (None if the exchange does not offer one)
+        """
+        key = self.account_key(cfg, api)
+        with self.stream_lock:
+            if key not in self.streams:
+                self.streams[key] = open_order_stream(cfg, api)
+            return self.streams[key]
+
+    def engine(self, cfg, api, max_concurrency=5, deadline=30, profiles=None, open_stream=None):
+        """
+        Return the engine for the concurrent orders of the account. All the engines run on the same event loop.
+        "open_stream" returns the order stream of the account (see FillTracker), None to poll only
+        """
+        key = self.account_key(cfg, api)
+        if key not in self.engines:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self.loop.run_forever, name='async-engines', daemon=True)
+                thread.start()
+                atexit.register(self.close_loop)
+            async_exchange = connect_to_exchange(cfg, api, async_support=True)
+            engine = AsyncExecutionEngine(async_exchange, max_concurrency=max_concurrency,
+                                          fill_tracker=FillTracker(async_exchange, deadline=deadline,
+                                                                   profiles=profiles, stream=self.streams.get(key),
+                                                                   open_stream=open_stream),
+                                          loop=self.loop, http=self.http)
+            self.client(cfg, api)  # markets loaded
+            self.market_cache(cfg).share(async_exchange)
+            self.engines[key] = engine
+        return self.engines[key]
+
+    def close_loop(self):
+        for engine in self.engines.values():
+            engine.close()
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def shutdown(self):
+        self.close_loop()
+        self.renderer.shutdown()
+        for reconciler in self.reconcilers.values():
+            reconciler.close()
+        for notifier in self.notifiers.values():
+            notifier.close(timeout=30)
+        self.metrics.close()
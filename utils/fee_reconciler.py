@@ -0,0 +1,191 @@
+import datetime
+import logging
+import threading
+import time
+from utils.exchange import fee_rows, reduce_fees
+from utils.scheduler import KeyedStore
+
+
+class FeeReconciler(object):
+    """
+    Resolve later the fees of the orders returned without fee, so that recording an order never waits for an
+    extra request. The trades of each symbol are fetched in bulk (fetch_my_trades) from a persisted "since"
+    cursor, and the fees of the pending orders are written back into the storage (ledger).
+    Exchanges without fetchMyTrades are queried order by order (fetch_order_trades).
+    The reconciliation runs on the thread placing the orders, between two purchases (see reconcile_if_due): ccxt
+    clients must not be used concurrently.
+    Several storages of the same account (e.g., portfolios, see ExchangePool) can share the reconciler (see register).
+    """
+    def __init__(self, exchange, storage, filename, interval=60, max_age=24*60*60, limit=500):
+        """
+        Args:
+            exchange: ccxt exchange
+            storage: Storage of the orders (see utils/storage.py), updated with update_fees (None to register the
+                storages later on)
+            filename: sqlite file of the cursors (and of the pending orders of storage)
+            interval: seconds between two reconciliations
+            max_age: seconds after which the fee of an order is no longer searched
+            limit: trades requested per call
+        """
+        self.exchange = exchange
+        self.interval = interval
+        self.max_age = max_age
+        self.limit = limit
+        # symbol -> timestamp (ms) from which the trades have not been processed yet
+        self.filename = str(filename)
+        self.cursors = KeyedStore(filename, table='trade_cursors')
+        # source -> (storage, pending orders: order id -> {'N', 'coin', 'symbol', 'timestamp'})
+        self.sources = {}
+        self.lock = threading.Lock()
+        self.next_time = None  # time of the next reconciliation (None if no order is pending)
+        if storage is not None:
+            self.register(storage, filename)
+
+    def register(self, storage, filename):
+        """
+        Resolve also the fees of the orders of storage, whose pending orders are kept in filename (sqlite).
+        Return the source to give to add. The orders left pending by a previous run are resumed.
+        """
+        source = str(filename)
+        with self.lock:
+            if source not in self.sources:
+                if source == self.filename:
+                    pending = KeyedStore(filename, table='pending_fees', connection=self.cursors.connection,
+                                         lock=self.cursors.lock)
+                else:
+                    pending = KeyedStore(filename, table='pending_fees')
+                self.sources[source] = (storage, pending)
+                if len(pending) > 0:
+                    self.schedule()
+        return source
+
+    def add(self, order, n, coin, source=None):
+        """
+        Queue an order (recorded with index N in the storage of source, the first one if None) whose fee has to
+        be resolved
+        """
+        with self.lock:
+            pending = self.sources[source][1] if source is not None else next(iter(self.sources.values()))[1]
+            pending.update({str(order['id']): {'N': int(n), 'coin': coin, 'symbol': order['symbol'],
+                                               'timestamp': order['timestamp']}})
+            self.schedule()
+
+    def has_pending(self):
+        """True if the fee of some order is still to be resolved (called with the lock held)"""
+        return any(len(pending) > 0 for storage, pending in self.sources.values())
+
+    def schedule(self):
+        """
+        Plan a reconciliation in "interval" seconds, unless one is already planned (called with the lock held).
+        The first attempt is delayed too: trades may not be available right after the order
+        """
+        if self.next_time is None:
+            self.next_time = time.time() + self.interval
+
+    def due_time(self):
+        """
+        Return the (local) datetime of the next reconciliation, None if no order is pending
+        """
+        with self.lock:
+            return None if self.next_time is None else datetime.datetime.fromtimestamp(self.next_time)
+
+    def reconcile_if_due(self):
+        """
+        Reconcile if the time has come (to be called by the thread using the client). Return True if done
+        """
+        with self.lock:
+            if self.next_time is None or time.time() < self.next_time:
+                return False
+        try:
+            self.reconcile()
+        except Exception as e:
+            logging.warning(f"Couldn't retrieve fees due to: {type(e).__name__} {str(e)}")
+        with self.lock:
+            self.next_time = None
+            if self.has_pending():
+                self.schedule()
+        return True
+
+    def reconcile(self):
+        """
+        Resolve the fees of the pending orders now
+        """
+        with self.lock:
+            # the order ids are unique on the account: the trades of a symbol are fetched once for all the sources
+            pending = {order_id: dict(entry, source=source) for source, (storage, store) in self.sources.items()
+                       for order_id, entry in store.items()}
+        by_symbol = {}
+        for order_id, entry in pending.items():
+            by_symbol.setdefault(entry['symbol'], {})[order_id] = entry
+
+        resolved = {}  # order id -> fee rows
+        for symbol, orders in by_symbol.items():
+            if self.exchange.has.get('fetchMyTrades'):
+                fees = self.fetch_symbol_fees(symbol, orders)
+            else:
+                fees = self.fetch_order_fees(symbol, orders)
+            for order_id, order_fees in fees.items():
+                resolved[order_id] = fee_rows(order_fees)
+
+        now = time.time() * 1000
+        expired = [order_id for order_id, entry in pending.items()
+                   if order_id not in resolved and now - (entry['timestamp'] or 0) > self.max_age * 1000]
+        for order_id in expired:
+            logging.warning(f"Fee of order {order_id} ({pending[order_id]['coin']}) not found")
+
+        for source, (storage, store) in self.sources.items():
+            fees = {pending[order_id]['N']: rows for order_id, rows in resolved.items()
+                    if pending[order_id]['source'] == source}
+            if fees:
+                storage.update_fees(fees)
+        if resolved:
+            logging.info(f"Fees of {len(resolved)} order(s) updated")
+        with self.lock:
+            for order_id in list(resolved) + expired:
+                self.sources[pending[order_id]['source']][1].delete(order_id)
+
+    def fetch_symbol_fees(self, symbol, orders):
+        """
+        Return the fees of the given orders (order id -> list of fees) found in the trades of the symbol
+        """
+        with self.lock:
+            since = self.cursors.get(symbol)
+        if since is None:
+            since = min(entry['timestamp'] for entry in orders.values())
+        trade_fees = {}
+        seen = set()
+        last = since
+        while True:
+            trades = self.exchange.fetch_my_trades(symbol, since=since, limit=self.limit)
+            new = [trade for trade in trades if trade['id'] not in seen]
+            for trade in new:
+                seen.add(trade['id'])
+                last = max(last, trade['timestamp'])
+                if str(trade.get('order')) in orders:
+                    trade_fees.setdefault(str(trade['order']), []).extend(trade.get('fees') or [trade.get('fee')])
+            if len(trades) < self.limit or not new:
+                break
+            # trades at the same millisecond of the last one are fetched again (and skipped)
+            since = max(trade['timestamp'] for trade in trades)
+
+        fees = {order_id: order_fees for order_id, order_fees in trade_fees.items() if reduce_fees(order_fees)}
+        # the cursor does not go past the orders still unresolved
+        unresolved = [entry['timestamp'] for order_id, entry in orders.items() if order_id not in fees]
+        with self.lock:
+            self.cursors.update({symbol: min(unresolved + [last + 1])})
+        return fees
+
+    def fetch_order_fees(self, symbol, orders):
+        fees = {}
+        for order_id in orders:
+            trades = self.exchange.fetch_order_trades(order_id, symbol)
+            order_fees = [fee for trade in trades for fee in (trade.get('fees') or [trade.get('fee')])]
+            if reduce_fees(order_fees):
+                fees[order_id] = order_fees
+        return fees
+
+    def close(self):
+        for storage, pending in self.sources.values():
+            if pending.connection is not self.cursors.connection:
+                pending.close()
+        self.cursors.close()
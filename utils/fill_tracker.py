@@ -0,0 +1,317 @@
+import asyncio
+import atexit
+import collections
+import json
+import logging
+import os
+import threading
+import time
+from utils.exchange import connect_to_exchange
+from utils.scheduler import KeyedStore
+
+
+class FillTimeout(Exception):
+    """
+    Raised when an order is not filled within the deadline. The order was placed: it is kept in "order" (see
+    PendingFills)
+    """
+    def __init__(self, order, symbol, deadline):
+        self.order = order
+        self.message = f"The exchange did not return a closed order for {symbol} (id {order['id']}) within {deadline} s"
+        super().__init__(self.message)
+
+
+class LatencyProfiles(object):
+    """
+    Fill latency learned from past orders (exponential moving average per exchange), stored on disk
+    """
+    def __init__(self, filename=None, alpha=0.3, default=0.25):
+        self.filename = filename
+        self.alpha = alpha
+        self.default = default
+        self.latency = {}
+        if filename is not None and os.path.isfile(filename):
+            try:
+                with open(filename, 'r', encoding='utf-8') as file:
+                    self.latency = json.load(file)
+            except ValueError:
+                logging.warning(f"Fill latency profiles {filename} are corrupted. Ignoring them")
+
+    def get(self, exchange_id):
+        return self.latency.get(exchange_id, self.default)
+
+    def update(self, exchange_id, latency):
+        if exchange_id in self.latency:
+            self.latency[exchange_id] = (1 - self.alpha) * self.latency[exchange_id] + self.alpha * latency
+        else:
+            self.latency[exchange_id] = latency
+        if self.filename is not None:
+            tmp_filename = str(self.filename) + '.tmp'
+            with open(tmp_filename, 'w', encoding='utf-8') as file:
+                json.dump(self.latency, file)
+            os.replace(tmp_filename, self.filename)
+
+
+class LocalOrderStream(object):
+    """
+    Order-update stream (push mode): order updates are published with "publish" and received by "wait".
+    Used as is in tests, and fed by the exchange in WatchOrdersStream. Only the last max_orders updates are kept.
+    """
+    def __init__(self, max_orders=1000):
+        self.condition = threading.Condition()
+        self.orders = collections.OrderedDict()
+        self.max_orders = max_orders
+
+    def publish(self, order):
+        with self.condition:
+            self.orders[order['id']] = order
+            self.orders.move_to_end(order['id'])
+            while len(self.orders) > self.max_orders:
+                self.orders.popitem(last=False)
+            self.condition.notify_all()
+
+    def wait(self, order_id, symbol, timeout):
+        """
+        Return the latest update of the order as soon as it is closed, or None after "timeout" seconds
+        """
+        end = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                order = self.orders.get(order_id)
+                if order is not None and order['status'] == 'closed':
+                    return order
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+
+class WatchOrdersStream(LocalOrderStream):
+    """
+    Order updates pushed by the exchange (ccxt.pro watch_orders, over a websocket), received by a background
+    thread running its own event loop. The subscription is started at creation, so that the updates of the orders
+    placed later are not missed. If the connection is lost, it is opened again after retry_delay seconds (in the
+    meantime FillTracker keeps polling).
+    """
+    def __init__(self, exchange, retry_delay=5):
+        """
+        Args:
+            exchange: ccxt.pro exchange (see connect_to_exchange)
+            retry_delay: seconds before a new subscription after an error
+        """
+        super().__init__()
+        self.exchange = exchange
+        self.retry_delay = retry_delay
+        self.loop = asyncio.new_event_loop()
+        self.task = None
+        self.thread = threading.Thread(target=self.loop.run_forever, name='orders-stream', daemon=True)
+        self.thread.start()
+        self.task = asyncio.run_coroutine_threadsafe(self.run(), self.loop)
+        atexit.register(self.close)
+
+    async def run(self):
+        connected = False
+        while True:
+            try:
+                orders = await self.exchange.watch_orders()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if connected:
+                    logging.warning(f"Order stream interrupted: {type(e).__name__} {str(e)}")
+                connected = False
+                await asyncio.sleep(self.retry_delay)
+                continue
+            connected = True
+            for order in orders:
+                self.publish(order)
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        self.task.cancel()
+        try:
+            asyncio.run_coroutine_threadsafe(self.exchange.close(), self.loop).result(timeout=5)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+        self.loop.close()
+
+
+def open_order_stream(cfg, api):
+    """
+    Return the order stream (WatchOrdersStream) of the account, or None if the exchange does not push the order
+    updates
+    """
+    try:
+        exchange = connect_to_exchange(cfg, api, pro=True)
+    except Exception as e:
+        logging.warning(f"Order stream not available: {type(e).__name__} {str(e)}")
+        return None
+    if not exchange.has.get('watchOrders'):
+        return None
+    return WatchOrdersStream(exchange)
+
+
+class PendingFills(object):
+    """
+    Orders placed but not confirmed as filled within the deadline (see FillTimeout). They are persisted and checked
+    again later (see check), so that a slow exchange neither stops the bot nor loses an order.
+    """
+    def __init__(self, exchange, filename, max_age=7*24*60*60):
+        """
+        Args:
+            exchange: ccxt exchange
+            filename: sqlite file of the pending orders
+            max_age: seconds after which an order still open is no longer checked
+        """
+        self.exchange = exchange
+        self.max_age = max_age
+        # order id -> {'coin', 'symbol', 'timestamp'}
+        self.store = KeyedStore(filename, table='pending_fills')
+
+    def add(self, order, coin):
+        self.store.update({str(order['id']): {'coin': coin, 'symbol': order['symbol'],
+                                              'timestamp': order.get('timestamp') or time.time() * 1000}})
+
+    def __len__(self):
+        return len(self.store)
+
+    def check(self):
+        """
+        Return the pending orders filled since (as a list of (coin, order)). Orders canceled without any fill,
+        or too old, are dropped
+        """
+        filled = []
+        for order_id, entry in self.store.items():
+            try:
+                order = self.exchange.fetch_order(order_id, entry['symbol'])
+            except Exception as e:
+                logging.warning(f"Couldn't check order {order_id} ({entry['coin']}): {type(e).__name__} {str(e)}")
+                continue
+            if order['status'] == 'closed' or (order['status'] in ['canceled', 'expired', 'rejected']
+                                               and order.get('filled')):
+                filled.append((entry['coin'], order))
+            elif order['status'] in ['canceled', 'expired', 'rejected']:
+                logging.warning(f"Order {order_id} ({entry['coin']}) {order['status']} without any fill")
+            elif time.time() * 1000 - entry['timestamp'] > self.max_age * 1000:
+                logging.warning(f"Order {order_id} ({entry['coin']}) still {order['status']}: no longer checked")
+            else:
+                continue
+            self.store.delete(order_id)
+        return filled
+
+    def close(self):
+        self.store.close()
+
+
+class FillTracker(object):
+    """
+    Wait for a market order to be filled. fetch_order is polled with an adaptive backoff: the first check is done
+    after the latency learned from the previous fills, then the interval grows geometrically until the deadline.
+    With a stream (WatchOrdersStream, or LocalOrderStream in tests) the waits between two checks end as soon as
+    the fill is pushed, while polling goes on in case the stream is down. The stream can be opened on the first
+    order not filled at once (see open_stream), so that exchanges filling the market orders immediately never
+    open it.
+    """
+    def __init__(self, exchange, deadline=30, profiles=None, stream=None, open_stream=None, backoff=1.5,
+                 max_interval=5):
+        """
+        Args:
+            exchange: ccxt exchange (sync or async)
+            deadline: maximum time (in seconds) to wait for the fill
+            profiles: LatencyProfiles (a default in-memory one is used if None)
+            stream: optional order-update stream (push mode)
+            open_stream: function returning the stream (or None), called on the first order not filled at once
+            backoff: growth factor of the polling interval
+            max_interval: maximum polling interval (in seconds)
+        """
+        self.exchange = exchange
+        self.deadline = deadline
+        self.profiles = profiles if profiles is not None else LatencyProfiles()
+        self.stream = stream
+        self.open_stream = open_stream
+        self.backoff = backoff
+        self.max_interval = max_interval
+
+    def intervals(self):
+        """
+        Polling intervals: starting from the learned latency and growing up to max_interval
+        """
+        interval = min(max(self.profiles.get(self.exchange.id), 0.05), self.max_interval)
+        while True:
+            yield interval
+            interval = min(interval * self.backoff, self.max_interval)
+
+    def get_stream(self):
+        """
+        Return the order stream, opened on first use (None if there is none)
+        """
+        if self.stream is None and self.open_stream is not None:
+            open_stream, self.open_stream = self.open_stream, None
+            self.stream = open_stream()
+        return self.stream
+
+    def learn(self, elapsed, polls):
+        """
+        Update the latency profile after a fill confirmed by polling
+        """
+        if polls == 1:
+            # the order was filled at some point before the first check: probe a shorter interval next time
+            elapsed = elapsed / 2
+        self.profiles.update(self.exchange.id, elapsed)
+
+    def wait_for_fill(self, order, symbol):
+        """
+        Return the closed order (raise FillTimeout if not filled before the deadline)
+        """
+        if order['status'] == 'closed':
+            return order
+        stream = self.get_stream()
+        start = time.monotonic()
+
+        for polls, interval in enumerate(self.intervals(), 1):
+            elapsed = time.monotonic() - start
+            if elapsed >= self.deadline:
+                raise FillTimeout(order, symbol, self.deadline)
+            # let's give the exchange some time to fill the order
+            timeout = min(interval, self.deadline - elapsed)
+            if stream is not None:
+                filled = stream.wait(order['id'], symbol, timeout)
+                if filled is not None:
+                    self.profiles.update(self.exchange.id, time.monotonic() - start)
+                    return filled
+            else:
+                time.sleep(timeout)
+            order = self.exchange.fetch_order(order['id'], symbol)
+            if order['status'] == 'closed':
+                self.learn(time.monotonic() - start, polls)
+                return order
+
+    async def wait_for_fill_async(self, order, symbol):
+        """
+        Same as wait_for_fill for async exchanges (the stream, if any, is waited in a thread)
+        """
+        if order['status'] == 'closed':
+            return order
+        stream = self.get_stream()
+        start = time.monotonic()
+
+        for polls, interval in enumerate(self.intervals(), 1):
+            elapsed = time.monotonic() - start
+            if elapsed >= self.deadline:
+                raise FillTimeout(order, symbol, self.deadline)
+            timeout = min(interval, self.deadline - elapsed)
+            if stream is not None:
+                filled = await asyncio.get_running_loop().run_in_executor(None, stream.wait,
+                                                                          order['id'], symbol, timeout)
+                if filled is not None:
+                    self.profiles.update(self.exchange.id, time.monotonic() - start)
+                    return filled
+            else:
+                await asyncio.sleep(timeout)
+            order = await self.exchange.fetch_order(order['id'], symbol)
+            if order['status'] == 'closed':
+                self.learn(time.monotonic() - start, polls)
+                return order
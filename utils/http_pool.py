@@ -0,0 +1,218 @@
+import collections
+import logging
+import socket
+import ssl
+import threading
+import time
+from urllib.parse import urlsplit
+from utils.misc import lazy_import
+
+requests = lazy_import('requests')
+urllib3 = lazy_import('urllib3')
+aiohttp = lazy_import('aiohttp')
+
+
+class DnsCache(object):
+    """
+    DNS resolutions of the hosts reached by the requests sessions of HttpPool, reused for "ttl" seconds.
+    Only the connections opened by their adapters use it (see dns_pool_classes): the resolver of the process is
+    not changed. The asynchronous sessions use the cache of aiohttp instead.
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}  # (host, port) -> (time, addresses)
+        self.lock = threading.Lock()
+        self.pool_classes = None  # connection pools using the cache (created on first use)
+
+    def resolve(self, host, port):
+        """
+        Return the addresses of host (cached), or an empty list if it cannot be resolved
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get((host, port))
+        if entry is not None and now - entry[0] < self.ttl:
+            return entry[1]
+        try:
+            infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except OSError:
+            return []
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        with self.lock:
+            self.entries[(host, port)] = (now, addresses)
+        return addresses
+
+    def invalidate(self, host, port):
+        with self.lock:
+            self.entries.pop((host, port), None)
+
+
+def dns_pool_classes(dns):
+    """
+    Return the urllib3 connection pools (by scheme) whose connections resolve their host with the DnsCache dns.
+    The host name is kept for the TLS handshake (SNI and certificate check)
+    """
+    if dns.pool_classes is not None:
+        return dns.pool_classes
+
+    def cached_connection(base):
+        class CachedConnection(base):
+            def _new_conn(self):
+                host = self._dns_host
+                addresses = dns.resolve(host, self.port)
+                if not addresses:
+                    return super()._new_conn()  # raises the resolution error
+                error = None
+                for address in addresses:
+                    self._dns_host = address
+                    try:
+                        return super()._new_conn()
+                    except Exception as e:
+                        error = e
+                    finally:
+                        self._dns_host = host
+                # the host may have moved: it is resolved again by the next connection
+                dns.invalidate(host, self.port)
+                raise error
+        return CachedConnection
+
+    http_pool = type('HTTPConnectionPool', (urllib3.HTTPConnectionPool,),
+                     {'ConnectionCls': cached_connection(urllib3.connection.HTTPConnection)})
+    https_pool = type('HTTPSConnectionPool', (urllib3.HTTPSConnectionPool,),
+                      {'ConnectionCls': cached_connection(urllib3.connection.HTTPSConnection)})
+    dns.pool_classes = {'http': http_pool, 'https': https_pool}
+    return dns.pool_classes
+
+
+class ConnectionStats(object):
+    """
+    Reuse of the connections: for each request, whether it went through a warm (reused) connection or had to
+    open a new one. The counts are also exported as metrics (dca_http_connections_total)
+    """
+    def __init__(self, metrics=None, history=100):
+        self.metrics = metrics
+        self.counts = {'reused': 0, 'new': 0, 'expired': 0}
+        self.recent = collections.deque(maxlen=history)  # (time, method, host, path, reused)
+        self.lock = threading.Lock()
+
+    def record(self, method, url, reused):
+        parts = urlsplit(str(url))
+        outcome = 'reused' if reused else 'new'
+        with self.lock:
+            self.counts[outcome] += 1
+            self.recent.append((time.time(), method, parts.netloc, parts.path, reused))
+        if self.metrics is not None:
+            self.metrics.count('http_connections', '', outcome)
+
+    def expired(self):
+        with self.lock:
+            self.counts['expired'] += 1
+        if self.metrics is not None:
+            self.metrics.count('http_connections', '', 'expired')
+
+    def reuse_ratio(self):
+        total = self.counts['reused'] + self.counts['new']
+        return self.counts['reused'] / total if total else None
+
+
+def pooled_adapter(stats, max_idle, pool_size, dns=None):
+    """
+    Return a requests adapter (keep-alive connection pool) recording the reuse of its connections.
+    Connections idle for more than max_idle seconds are dropped before the next request, since the server has
+    likely closed them (a request on a half-closed connection fails, and orders are not retried).
+    New connections resolve their host with the DnsCache dns, if given.
+    """
+    class PooledAdapter(requests.adapters.HTTPAdapter):
+        def __init__(self):
+            self.last_used = None
+            self.idle_lock = threading.Lock()
+            super().__init__(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            if dns is not None:
+                self.poolmanager.pool_classes_by_scheme = dns_pool_classes(dns)
+
+        def opened(self):
+            pools = self.poolmanager.pools
+            return sum(pools[key].num_connections for key in pools.keys())
+
+        def send(self, request, **kwargs):
+            with self.idle_lock:
+                now = time.monotonic()
+                if self.last_used is not None and now - self.last_used > max_idle:
+                    self.poolmanager.clear()
+                    stats.expired()
+                self.last_used = now
+            before = self.opened()
+            response = super().send(request, **kwargs)
+            stats.record(request.method, request.url, self.opened() == before)
+            return response
+
+    return PooledAdapter()
+
+
+class HttpPool(object):
+    """
+    Connection layer of the ccxt clients: keep-alive sessions with sized pools (for the concurrent calls),
+    DNS cache (of these sessions only), health check of the idle connections and connection reuse statistics.
+    Synchronous clients get a requests session, asynchronous clients an aiohttp session (see open_async_session).
+    """
+    def __init__(self, pool_size=10, max_idle=60, dns_ttl=300, metrics=None):
+        """
+        Args:
+            pool_size: maximum number of connections kept open per host
+            max_idle: seconds after which an idle connection is not reused
+            dns_ttl: seconds a DNS resolution is cached (0 to disable the cache)
+            metrics: Metrics receiving the connection reuse counts
+        """
+        self.pool_size = pool_size
+        self.max_idle = max_idle
+        self.dns_ttl = dns_ttl
+        self.stats = ConnectionStats(metrics)
+        self.dns = DnsCache(dns_ttl) if dns_ttl else None
+
+    @classmethod
+    def from_config(cls, cfg, metrics=None):
+        return cls(pool_size=cfg.get('HTTP_POOL_SIZE', 10), max_idle=cfg.get('HTTP_MAX_IDLE', 60),
+                   dns_ttl=cfg.get('DNS_CACHE_TTL', 300), metrics=metrics)
+
+    def session(self):
+        """
+        Return a new requests session (for a synchronous ccxt client)
+        """
+        session = requests.Session()
+        adapter = pooled_adapter(self.stats, self.max_idle, self.pool_size, self.dns)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    async def open_async_session(self, exchange):
+        """
+        Create the aiohttp session of an asynchronous ccxt client (must run on the loop of the client)
+        """
+        if exchange.session is not None:
+            return
+        stats = self.stats
+
+        async def on_reuse(session, context, params):
+            context.reused = True
+
+        async def on_create(session, context, params):
+            context.reused = False
+
+        async def on_end(session, context, params):
+            stats.record(params.method, params.url, getattr(context, 'reused', False))
+
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_reuseconn.append(on_reuse)
+        trace.on_connection_create_end.append(on_create)
+        trace.on_request_end.append(on_end)
+        ssl_context = ssl.create_default_context(cafile=exchange.cafile) if exchange.verify else False
+        connector = aiohttp.TCPConnector(ssl=ssl_context, limit=self.pool_size, limit_per_host=self.pool_size,
+                                         ttl_dns_cache=self.dns_ttl or None, use_dns_cache=bool(self.dns_ttl),
+                                         keepalive_timeout=self.max_idle, enable_cleanup_closed=True)
+        exchange.tcp_connector = connector
+        exchange.session = aiohttp.ClientSession(connector=connector, trust_env=exchange.aiohttp_trust_env,
+                                                 trace_configs=[trace])
+        logging.debug(f"HTTP pool of {exchange.id} (async) opened")
@@ -0,0 +1,206 @@
+import csv
+import logging
+import os
+from pathlib import Path
+from utils.misc import lazy_import, read_csv_custom, truncate_partial_line
+
+pd = lazy_import('pandas')
+
+
+class OrderLedger(object):
+    """
+    Readable ledger of the filled orders (orders.csv). New orders are appended to the file
+    (no full rewrite), while in memory rows are buffered and only assembled into a DataFrame
+    when requested. The file is only read when the ledger is used for the first time: appends
+    alone only read its header and last line.
+    Fees known after the order was recorded (see FeeReconciler), and fees paid in several currencies, are appended
+    to a sidecar file (orders_fees.csv, one row per order and fee currency) and merged on read: orders.csv is
+    never rewritten. The fee columns of the ledger only hold single-currency fees ('N.A.' otherwise).
+    """
+    # columns kept per coin, so that plots and stats do not have to filter the whole ledger
+    coin_columns = ['price', 'cost', 'filled', 'datetime (local)']
+
+    fee_columns = ['fee', 'fee currency', 'fee rate']
+
+    def __init__(self, filename, chunk_size=256):
+        self.filename = filename
+        self.fees_filename = Path(filename).with_name(Path(filename).stem + '_fees.csv')
+        self.chunk_size = chunk_size
+        self.columns = None
+        self.n = 0  # index (N) of the next order
+        self.chunks = []  # list of DataFrames
+        self.rows = []  # rows not yet gathered into a chunk
+        self.by_coin = {}
+        self.fee_currencies = {}  # N -> {fee currency: (fee, fee currency, fee rate)} of the sidecar (once loaded)
+        self.loaded = False
+        self.peeked = False
+        self.repaired = False
+
+    def load(self):
+        """
+        Read the ledger from disk (once)
+        """
+        if self.loaded:
+            return
+        self.loaded = True
+        self.repair_tail()
+        fees = self.fee_table()
+        for n, group in fees.groupby('N'):
+            self.fee_currencies[int(n)] = {row[1]: row for row in group[self.fee_columns].fillna('N.A.')
+                                           .itertuples(index=False, name=None)}
+        if os.path.isfile(self.filename):
+            df = read_csv_custom(self.filename)
+            if df.shape[0] > 0:
+                self.columns = list(df.columns)
+                self.n = int(df.index.max()) + 1
+                self.merge_fees(df, fees)
+                self.chunks.append(df)
+                for coin, group in df.groupby('coin', sort=False):
+                    self.by_coin[coin] = {col: group[col].tolist() for col in self.coin_columns}
+
+    def peek(self):
+        """
+        Read the columns and the index of the next order from the header and the last line of the file
+        """
+        if self.loaded or self.peeked:
+            return
+        self.peeked = True
+        self.repair_tail()
+        if not os.path.isfile(self.filename) or os.path.getsize(self.filename) == 0:
+            return
+        with open(self.filename, 'rb') as file:
+            header = file.readline().decode('utf-8').rstrip('\r\n')
+            # a row is much shorter than 64 kB
+            file.seek(max(os.path.getsize(self.filename) - 65536, 0))
+            last = [line for line in file.read().decode('utf-8', errors='replace').splitlines() if line.strip()][-1]
+        self.columns = header.split(',')[1:]
+        if last != header:
+            self.n = int(last.split(',')[0]) + 1
+
+    def repair_tail(self):
+        """
+        Remove a row whose write was interrupted (e.g., by a crash): the file does not end with a newline.
+        The order is still in the journal
+        """
+        if not self.repaired:
+            self.repaired = True
+            if truncate_partial_line(self.filename):
+                logging.warning(f"Removed an incomplete order from {self.filename}")
+
+    def __len__(self):
+        self.load()
+        return sum(len(chunk) for chunk in self.chunks) + len(self.rows)
+
+    def append(self, df):
+        """
+        Append new orders (a DataFrame as returned by order_to_dataframe) to the ledger.
+        Returns the new rows indexed by N.
+        """
+        self.peek()
+        df = df.copy()
+        df.index = pd.RangeIndex(self.n, self.n + df.shape[0], name='N')
+        if self.columns is None:
+            self.columns = list(df.columns)
+        else:
+            df = df.reindex(columns=self.columns)
+
+        header = not os.path.isfile(self.filename) or os.path.getsize(self.filename) == 0
+        df.to_csv(self.filename, mode='a', header=header)
+        self.n += df.shape[0]
+        if not self.loaded:
+            # the new rows will be read with the file
+            return df
+
+        for n, row in zip(df.index, df.to_dict('records')):
+            row['N'] = n
+            self.rows.append(row)
+            buffers = self.by_coin.setdefault(row['coin'], {col: [] for col in self.coin_columns})
+            for col in self.coin_columns:
+                buffers[col].append(row[col])
+        if len(self.rows) >= self.chunk_size:
+            self.flush_rows()
+        return df
+
+    def flush_rows(self):
+        """Gather the buffered rows into a DataFrame chunk"""
+        if self.rows:
+            chunk = pd.DataFrame.from_records(self.rows, index='N', columns=['N'] + self.columns)
+            self.chunks.append(chunk)
+            self.rows = []
+
+    def frame(self):
+        """
+        Return the whole ledger as a DataFrame. The chunks are merged only once, then reused.
+        """
+        self.load()
+        self.flush_rows()
+        if not self.chunks:
+            return pd.DataFrame()
+        if len(self.chunks) > 1:
+            self.chunks = [pd.concat(self.chunks)]
+        return self.chunks[0]
+
+    def fee_table(self):
+        """
+        Return the fees of the sidecar file (columns N, fee, fee currency, fee rate), one row per order and currency
+        """
+        if not os.path.isfile(self.fees_filename):
+            return pd.DataFrame(columns=['N'] + self.fee_columns)
+        fees = pd.read_csv(self.fees_filename)
+        return fees.drop_duplicates(subset=['N', 'fee currency'], keep='last')
+
+    @classmethod
+    def merge_fees(cls, df, fees):
+        """
+        Set the fee columns of the orders (df, indexed by N) paying their fee in a single currency
+        """
+        fees = fees[fees['N'].isin(df.index)]
+        single = fees.groupby('N').filter(lambda group: len(group) == 1).set_index('N')
+        if single.shape[0] == 0:
+            return
+        for column in cls.fee_columns:
+            if df[column].dtype != object:
+                df[column] = df[column].astype(object)
+            df.loc[single.index, column] = single[column].fillna('N.A.').values
+
+    def add_fees(self, fees):
+        """
+        Append fees of recorded orders ({N: [(fee, fee currency, fee rate), ...]}, one tuple per currency) to the
+        sidecar file. If the ledger is loaded, only the rows of these orders are updated
+        """
+        rows = [[int(n)] + list(values) for n, fee_rows in fees.items() for values in fee_rows]
+        if not rows:
+            return
+        header = not os.path.isfile(self.fees_filename) or os.path.getsize(self.fees_filename) == 0
+        with open(self.fees_filename, 'a', newline='') as file:
+            writer = csv.writer(file)
+            if header:
+                writer.writerow(['N'] + self.fee_columns)
+            writer.writerows(rows)
+        if self.loaded:
+            self.apply_fees(fees)
+
+    def apply_fees(self, fees):
+        """
+        Set the fee columns of loaded orders after new sidecar rows (single-currency fees, 'N.A.' otherwise)
+        """
+        self.flush_rows()
+        for n, fee_rows in fees.items():
+            currencies = self.fee_currencies.setdefault(int(n), {})
+            for values in fee_rows:
+                currencies[values[1]] = tuple('N.A.' if value is None else value for value in values)
+            values = next(iter(currencies.values())) if len(currencies) == 1 else ('N.A.',) * 3
+            for chunk in self.chunks:
+                if int(n) in chunk.index:
+                    for column, value in zip(self.fee_columns, values):
+                        if chunk[column].dtype != object:
+                            chunk[column] = chunk[column].astype(object)
+                        chunk.at[int(n), column] = value
+                    break
+
+    def coin_values(self, coin, column):
+        """
+        Return the values of a column (price, cost, filled or datetime (local)) for the orders of a given coin
+        """
+        self.load()
+        return self.by_coin.get(coin, {}).get(column, [])
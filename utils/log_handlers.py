@@ -0,0 +1,144 @@
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+
+
+class LazyFormat(object):
+    """
+    Message argument formatted only when the record is written (in the logging thread), e.g.:
+        logging.info("Balance:\\n%s", LazyFormat(format_table, rows, columns))
+    The arguments should not be modified after the call.
+    """
+    def __init__(self, function, *args, **kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.function(*self.args, **self.kwargs))
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves the formatting of the message to the listener thread (the standard one formats
+    it in the calling thread). Only the traceback, which refers to live frames, is formatted right away.
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class RotatingLogHandler(logging.handlers.TimedRotatingFileHandler):
+    """
+    File handler rotating the file when it reaches max_bytes and/or at the given interval ("when", see
+    TimedRotatingFileHandler, e.g. 'midnight'). At most backup_count old files are kept.
+    """
+    def __init__(self, filename, max_bytes=0, when=None, backup_count=5):
+        super().__init__(filename, when=when or 'midnight', backupCount=backup_count, encoding='utf-8', delay=True)
+        self.max_bytes = max_bytes
+        self.timed = when is not None
+
+    def shouldRollover(self, record):
+        if self.timed and super().shouldRollover(record):
+            return True
+        if self.max_bytes > 0:
+            if self.stream is None:
+                self.stream = self._open()
+            if self.stream.tell() + len(self.format(record)) + 1 >= self.max_bytes:
+                return True
+        return False
+
+    def rotation_filename(self, default_name):
+        # several size rollovers in the same interval: log.txt.2024-01-01, log.txt.2024-01-01.1, ...
+        name, n = default_name, 0
+        while os.path.exists(name):
+            n += 1
+            name = f'{default_name}.{n}'
+        return name
+
+    def getFilesToDelete(self):
+        prefix = os.path.basename(self.baseFilename) + '.'
+        folder = os.path.dirname(self.baseFilename)
+        backups = sorted((os.path.join(folder, name) for name in os.listdir(folder) if name.startswith(prefix)),
+                         key=os.path.getmtime)
+        return backups[:max(len(backups) - self.backupCount, 0)]
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One json object per record: time, level, message, thread (and portfolio, exception if any)
+    """
+    def format(self, record):
+        entry = {'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                 'level': record.levelno and logging.getLevelName(record.levelno).strip() or 'INFO',
+                 'message': record.getMessage(),
+                 'thread': record.threadName}
+        if getattr(record, 'portfolio', None):
+            entry['portfolio'] = record.portfolio
+        if record.exc_text or record.exc_info:
+            entry['exception'] = record.exc_text or self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class MessageListener(logging.handlers.QueueListener):
+    """
+    QueueListener formatting the message of a record once (in its thread) for all the handlers
+    """
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class LogQueue(object):
+    """
+    Logging backend: the root logger only puts the records in a queue, and a background thread (the listener)
+    formats and writes them, so that a slow disk or terminal never stalls the bot.
+    """
+    def __init__(self, formatter, max_bytes=0, when=None, backups=5):
+        """
+        Args:
+            formatter: formatter of the text handlers
+            max_bytes, when, backups: rotation of the log files (see RotatingLogHandler)
+        """
+        self.formatter = formatter
+        self.max_bytes = max_bytes
+        self.when = when
+        self.backups = backups
+        self.queue = queue.SimpleQueue()  # unbounded: logging never blocks
+        self.handler = DeferredQueueHandler(self.queue)
+        self.listener = MessageListener(self.queue, respect_handler_level=True)
+
+    def file_handler(self, filename, json_lines=False):
+        """
+        Return a rotating handler of a log file (text, or one json object per line)
+        """
+        handler = RotatingLogHandler(filename, self.max_bytes, self.when, self.backups)
+        handler.setFormatter(JsonFormatter() if json_lines else self.formatter)
+        return handler
+
+    def add_handler(self, handler):
+        """
+        Add a handler to the listener (also while it is running)
+        """
+        self.listener.handlers = self.listener.handlers + (handler,)
+        return handler
+
+    def start(self):
+        self.listener.start()
+
+    def stop(self):
+        """
+        Write the queued records and close the handlers
+        """
+        if self.listener._thread is not None:
+            self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
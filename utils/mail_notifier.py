@@ -1,32 +1,75 @@
+import copy
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.image import MIMEImage
+from email import message_from_string
 import logging
+from pathlib import Path
+import queue
 import smtplib
 import ssl
 from string import Template
+import threading
+import time
+from utils.metrics import Metrics
 from utils.misc import round_price
 
 
+template_dir = Path(__file__).parent / 'mail_template'
+
+
 class Notifier(object):
-    def __init__(self, cfg):
+    def __init__(self, cfg, smtp_factory=None, trades_dir='trades', metrics=None):
 
         self.smtp_server = cfg['SMTP_SERVER']
         self.sent_from = cfg['EMAIL_ADDRESS_FROM']
         self.to = cfg['EMAIL_ADDRESS_TO']
         self.password = cfg['EMAIL_PASSWORD']
         self.port = 465  # For SSL
+        self.trades_dir = Path(trades_dir)
 
         self.exchage = cfg['EXCHANGE'].lower()
 
         if cfg['TEST']:
             self.exchage += ' (test mode)'
 
-    def info(self, info):
-        with open('utils/mail_template/info.html', 'r', encoding='utf-8') as file:
-            body = file.read()
+        # templates are parsed once
+        self.templates = {}
+        for name in ['info', 'success', 'insufficientFundsWarning', 'error', 'critical']:
+            with open(template_dir / f'{name}.html', 'r', encoding='utf-8') as file:
+                self.templates[name] = Template(file.read())
 
-        body = Template(body)
+        # messages are delivered by a background thread, reusing the same SMTP session
+        if smtp_factory is None:
+            if cfg.get('SMTP_DEBUG', False):
+                smtp_factory = DebuggingSMTP
+            else:
+                smtp_factory = lambda: smtplib.SMTP_SSL(self.smtp_server, self.port,
+                                                        context=ssl.create_default_context(), timeout=30)
+        self.smtp_factory = smtp_factory
+        self.retries = cfg.get('SMTP_RETRIES', 3)
+        self.metrics = metrics if metrics is not None else Metrics(self.exchage)
+        self.idle_timeout = 60  # seconds an unused session is kept open
+        self.server = None
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.deliver_forever, name='notifier', daemon=True)
+        self.thread.start()
+
+    def view(self, cfg, trades_dir='trades'):
+        """
+        Return the notifier of another portfolio (exchange and trades folder of cfg) sending to the same address:
+        its messages are delivered by this thread, through the same SMTP session
+        """
+        view = copy.copy(self)
+        view.exchage = cfg['EXCHANGE'].lower()
+        if cfg['TEST']:
+            view.exchage += ' (test mode)'
+        view.trades_dir = Path(trades_dir)
+        view.server = None  # the session belongs to the delivery thread
+        return view
+
+    def info(self, info):
+        body = self.templates['info']
         body = body.substitute(info=info,
                                exchange=self.exchage)
 
@@ -41,7 +84,12 @@ class Notifier(object):
                 bought_on,
                 pairing,
                 stats,
-                extra):
+                extra,
+                graph=None):
+        """
+        "graph" is the chart of the purchases: PNG bytes or a Future returning them (as given by ChartRenderer).
+        If not given, the chart is read from the trades folder (when the mail is delivered).
+        """
 
         coin = df['coin'][0]
 
@@ -57,10 +105,7 @@ class Notifier(object):
             else:
                 fee_rate = "(" + round_price(df['fee rate'][0]*100) + " %)"
 
-        with open('utils/mail_template/success.html', 'r', encoding='utf-8') as file:
-            body = file.read()
-
-        body = Template(body)
+        body = self.templates['success']
         body = body.substitute(coin=coin,
                                exchange=self.exchage,
                                cycle=cycle,
@@ -81,16 +126,13 @@ class Notifier(object):
                                ROI=round_price(stats['ROI%']),
                                extra=extra)
 
-        # Attach graph
-        graph_path = 'trades/graph_' + coin + '.png'
-        with open(graph_path, 'rb') as img:
-            msgimg = MIMEImage(img.read())
-        msgimg.add_header('Content-ID', '<graph>')
-        # replace src image with src="cid:graph"
+        # Attach graph (the image is resolved by the delivery thread)
+        if graph is None:
+            graph = self.trades_dir / f'graph_{coin}.png'
 
         subject = f'DCA: {coin} purchase complete'
 
-        self.send(subject, body, msgimg)
+        self.send(subject, body, graph)
 
     def warning_funds(self,
                       coin,
@@ -99,10 +141,7 @@ class Notifier(object):
                       cost,
                       balance):
 
-        with open('utils/mail_template/insufficientFundsWarning.html', 'r', encoding='utf-8') as file:
-            body = file.read()
-
-        body = Template(body)
+        body = self.templates['insufficientFundsWarning']
         body = body.substitute(coin=coin,
                                exchange=self.exchage,
                                cost=cost,
@@ -119,15 +158,13 @@ class Notifier(object):
               retry_dict,
               error):
         """These errors are not critical and should be recoverable"""
-        with open('utils/mail_template/error.html', 'r', encoding='utf-8') as file:
-            body = file.read()
 
         error_type = type(error).__name__
 
         retry_time = retry_dict[1]
         attempts = retry_dict[0]
 
-        body = Template(body)
+        body = self.templates['error']
         body = body.substitute(coin=coin,
                                exchange=self.exchage,
                                error_type=error_type,
@@ -144,12 +181,9 @@ class Notifier(object):
                  when):
         """These errors are critical and the program is terminated after sending one of these"""
 
-        with open('utils/mail_template/critical.html', 'r', encoding='utf-8') as file:
-            body = file.read()
-
         error_type = type(error).__name__
 
-        body = Template(body)
+        body = self.templates['critical']
         body = body.substitute(when=when,
                                exchange=self.exchage,
                                error_type=error_type,
@@ -158,8 +192,46 @@ class Notifier(object):
         subject = f'DCA: Critical Error'
 
         self.send(subject, body)
+        # the program is going to be terminated: wait for the delivery
+        self.flush(timeout=self.retries * 30)
 
     def send(self, subject, body, img=None):
+        """
+        Queue the message for delivery and return immediately.
+        "img" (optional) is the chart to attach: PNG bytes, a Future returning them or the path of the file.
+        """
+        self.queue.put((subject, body, img))
+
+    def flush(self, timeout=None):
+        """
+        Wait until all the queued messages have been processed (or until timeout)
+        """
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=None):
+        self.flush(timeout)
+        self.disconnect()
+
+    def deliver_forever(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                # do not keep an idle session open
+                self.disconnect()
+                continue
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            try:
+                with self.metrics.timer('email'):
+                    self.deliver(*item)
+            except Exception as e:
+                logging.warning("SEND MAIL " + type(e).__name__ + ' ' + str(e))
+
+    def deliver(self, subject, body, img=None):
 
         # Create message container - the correct MIME type is multipart/alternative here!
         msg = MIMEMultipart('alternative')
@@ -178,14 +250,86 @@ class Notifier(object):
         # the HTML message, is best and preferred.
         msg.attach(html_body)
 
-        if img:
-            msg.attach(img)
-
-        try:
-            context = ssl.create_default_context()
-            with smtplib.SMTP_SSL(self.smtp_server, self.port, context=context) as server:
-                server.login(self.sent_from, self.password)
+        if img is not None:
+            png = self.get_image(img)
+            if png is not None:
+                msgimg = MIMEImage(png)
+                msgimg.add_header('Content-ID', '<graph>')
+                # replace src image with src="cid:graph"
+                msg.attach(msgimg)
+
+        for attempt in range(1, self.retries + 1):
+            try:
+                server = self.connect()
                 server.sendmail(self.sent_from, self.to, msg.as_string())
-
+                return
+            except Exception as e:
+                self.disconnect()
+                if attempt == self.retries:
+                    raise e
+                logging.warning(f"SEND MAIL attempt {attempt} failed: {type(e).__name__} {str(e)}")
+                time.sleep(2 ** attempt)
+
+    @staticmethod
+    def get_image(img):
+        try:
+            if isinstance(img, bytes):
+                return img
+            if hasattr(img, 'result'):
+                return img.result(timeout=60)
+            with open(img, 'rb') as file:
+                return file.read()
         except Exception as e:
-            logging.warning("SEND MAIL " + type(e).__name__ + ' ' + str(e))
+            logging.warning(f"Chart not available: {type(e).__name__} {str(e)}")
+            return None
+
+    def connect(self):
+        """
+        Return an authenticated SMTP session, reusing the open one if it is still alive
+        """
+        if self.server is not None:
+            try:
+                self.server.noop()
+                return self.server
+            except Exception:
+                self.disconnect()
+        server = self.smtp_factory()
+        server.login(self.sent_from, self.password)
+        self.server = server
+        return server
+
+    def disconnect(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+            self.server = None
+
+
+class DebuggingSMTP(object):
+    """
+    Local stand-in of an SMTP session (for tests and debugging): messages are logged and kept in memory
+    instead of being sent.
+    """
+    messages = []
+
+    def __init__(self, *args, **kwargs):
+        self.logged_in = False
+
+    def login(self, user, password):
+        self.logged_in = True
+
+    def noop(self):
+        return 250, b'OK'
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        if not self.logged_in:
+            raise smtplib.SMTPSenderRefused(530, b'Authentication required', from_addr)
+        DebuggingSMTP.messages.append((from_addr, to_addrs, msg))
+        subject = message_from_string(msg)['subject']
+        logging.info(f"[debugging SMTP] mail from {from_addr} to {to_addrs}: {subject}")
+        return {}
+
+    def quit(self):
+        self.logged_in = False
@@ -0,0 +1,122 @@
+import json
+import logging
+import os
+import threading
+import time
+
+
+class MarketCache(object):
+    """
+    On-disk cache of the market metadata (precision, limits, ids) of the configured symbols only.
+    A fresh cache makes a full market download unnecessary at startup. Stale metadata is refreshed
+    between two purchases (see refresh_if_stale), in the thread using the clients, and pushed to all the clients
+    sharing the markets.
+    """
+    def __init__(self, exchange, symbols, filename, ttl=24*60*60, sandbox=False):
+        """
+        Args:
+            exchange: ccxt exchange (already connected)
+            symbols: symbols to cache (e.g., ['BTC/USDT', 'XRP/BUSD'])
+            filename: json file where the cache is stored
+            ttl: time (in seconds) after which the metadata are refreshed
+            sandbox: True if the exchange is in sandbox (test) mode
+        """
+        self.exchange = exchange
+        self.symbols = list(symbols)
+        self.filename = filename
+        self.ttl = ttl
+        self.sandbox = sandbox
+        self.timestamp = 0
+        self.lock = threading.Lock()
+        self.retry_time = 0  # time before which a failed refresh is not attempted again
+        self.shared = []  # other clients of the same exchange using these markets (see share)
+
+    def load(self):
+        """
+        Set the markets of the exchange from the cache if possible (even if stale: they are refreshed before the
+        next purchase), otherwise download them.
+        """
+        markets = self.read()
+        if markets is None:
+            self.refresh()
+        else:
+            self.exchange.set_markets(list(markets.values()))
+            if self.exchange.options.get('adjustForTimeDifference') and hasattr(self.exchange, 'load_time_difference'):
+                # usually done while downloading the markets
+                self.exchange.load_time_difference()
+
+    def read(self):
+        """
+        Return the cached markets (if they cover all the symbols of this exchange) or None
+        """
+        if not os.path.isfile(self.filename):
+            return None
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as file:
+                cache = json.load(file)
+        except ValueError:
+            logging.warning(f"Market cache {self.filename} is corrupted. Ignoring it")
+            return None
+        if cache.get('exchange') != self.exchange.id or cache.get('sandbox') != self.sandbox:
+            return None
+        if any(symbol not in cache['markets'] for symbol in self.symbols):
+            return None
+        self.timestamp = cache['timestamp']
+        return cache['markets']
+
+    def refresh(self):
+        """
+        Download the markets and store the metadata of the configured symbols
+        """
+        with self.lock:
+            self.exchange.load_markets(reload=True)
+            markets = {symbol: self.exchange.markets[symbol] for symbol in self.symbols
+                       if symbol in self.exchange.markets}
+            # keep in memory only the markets we need
+            self.exchange.set_markets(list(markets.values()), self.exchange.currencies)
+            for exchange in self.shared:
+                self.copy_markets(exchange)
+            self.timestamp = time.time()
+            self.write(markets)
+
+    def share(self, exchange):
+        """
+        Let another client of the same exchange (e.g., with different API keys, or the asynchronous client of the
+        concurrent orders) use the cached markets. The client is also updated at every refresh.
+        """
+        self.copy_markets(exchange)
+        self.shared.append(exchange)
+
+    def copy_markets(self, exchange):
+        if self.exchange.markets:
+            exchange.set_markets(list(self.exchange.markets.values()), self.exchange.currencies)
+        if 'timeDifference' in self.exchange.options:
+            exchange.options['timeDifference'] = self.exchange.options['timeDifference']
+
+    def write(self, markets):
+        cache = {'exchange': self.exchange.id,
+                 'sandbox': self.sandbox,
+                 'timestamp': self.timestamp,
+                 'markets': markets}
+        tmp_filename = str(self.filename) + '.tmp'
+        with open(tmp_filename, 'w', encoding='utf-8') as file:
+            json.dump(cache, file)
+        os.replace(tmp_filename, self.filename)
+
+    def refresh_if_stale(self):
+        """
+        Refresh the metadata if stale. To be called between two purchases, by the thread using the clients
+        (set_markets is not safe while a client is placing an order). Return True if refreshed
+        """
+        if self.is_fresh() or time.time() < self.retry_time:
+            return False
+        try:
+            self.refresh()
+            return True
+        except Exception as e:
+            logging.warning(f"Market metadata refresh failed: {type(e).__name__} {str(e)}")
+            self.retry_time = time.time() + min(self.ttl, 60*60)  # try again later
+            return False
+
+    def is_fresh(self):
+        return time.time() - self.timestamp <= self.ttl
@@ -0,0 +1,166 @@
+import bisect
+import contextlib
+import copy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import os
+import threading
+import time
+
+# upper bounds (in seconds) of the histogram buckets
+default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Metrics(object):
+    """
+    Duration (histograms) of the phases of the purchase pipeline and counters of the outcomes, labelled by exchange
+    and coin (and portfolio, see child). The metrics are exported in the Prometheus text format, to a file and/or
+    to a local http endpoint. When disabled, timers and counters do nothing.
+    """
+    def __init__(self, exchange_id, enabled=False, buckets=default_buckets, portfolio=''):
+        """
+        Args:
+            exchange_id: exchange label of all the metrics
+            enabled: if False, nothing is measured
+            buckets: upper bounds (in seconds) of the histogram buckets
+            portfolio: portfolio label of all the metrics (none if empty)
+        """
+        self.exchange_id = exchange_id
+        self.portfolio = portfolio
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.histograms = {}  # (exchange, portfolio, phase, coin) -> [bucket counts, sum, count]
+        self.counters = {}  # (exchange, portfolio, name, coin, outcome) -> value
+        self.lock = threading.Lock()
+        self.server = None
+        self.shared = False  # True for the metrics of the children (rendered by their parent as well)
+
+    def child(self, exchange_id, portfolio='', enabled=True):
+        """
+        Return the metrics of a portfolio, kept with (and served by the endpoint of) these ones
+        """
+        child = copy.copy(self)
+        child.exchange_id = exchange_id
+        child.portfolio = portfolio
+        child.enabled = enabled
+        child.server = None
+        child.shared = True
+        return child
+
+    def timer(self, phase, coin=''):
+        """
+        Context manager measuring the duration of a phase
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self.measure(phase, coin)
+
+    @contextlib.contextmanager
+    def measure(self, phase, coin):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, coin, time.perf_counter() - start)
+
+    def observe(self, phase, coin, seconds):
+        if not self.enabled:
+            return
+        key = (self.exchange_id, self.portfolio, phase, coin)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, seconds)
+            if index < len(self.buckets):
+                histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def count(self, name, coin='', outcome='', value=1):
+        """
+        Increase a counter (e.g., count('purchases', 'BTC', 'filled'))
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            key = (self.exchange_id, self.portfolio, name, coin, outcome)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def render(self):
+        """
+        Return the metrics in the Prometheus text format (only its own ones for a child, all for the parent)
+        """
+        def own(key):
+            return not self.shared or key[:2] == (self.exchange_id, self.portfolio)
+
+        def label_string(exchange_id, portfolio):
+            return f'exchange="{exchange_id}"' + (f',portfolio="{portfolio}"' if portfolio else '')
+
+        lines = []
+        with self.lock:
+            histograms = sorted(item for item in self.histograms.items() if own(item[0]))
+            counters = sorted(item for item in self.counters.items() if own(item[0]))
+            if histograms:
+                lines.append('# HELP dca_phase_seconds Duration of the phases of the purchase pipeline')
+                lines.append('# TYPE dca_phase_seconds histogram')
+            for (exchange_id, portfolio, phase, coin), (counts, total, n) in histograms:
+                labels = f'phase="{phase}",{label_string(exchange_id, portfolio)},coin="{coin}"'
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'dca_phase_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'dca_phase_seconds_bucket{{{labels},le="+Inf"}} {n}')
+                lines.append(f'dca_phase_seconds_sum{{{labels}}} {total}')
+                lines.append(f'dca_phase_seconds_count{{{labels}}} {n}')
+            names = sorted(set(key[2] for key, value in counters))
+            for name in names:
+                lines.append(f'# TYPE dca_{name}_total counter')
+                for (exchange_id, portfolio, counter, coin, outcome), value in counters:
+                    if counter == name:
+                        lines.append(f'dca_{name}_total{{{label_string(exchange_id, portfolio)},coin="{coin}",'
+                                     f'outcome="{outcome}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename):
+        """
+        Write the metrics to a file (e.g., for the textfile collector of the node exporter)
+        """
+        if not self.enabled:
+            return
+        tmp_filename = str(filename) + '.tmp'
+        with open(tmp_filename, 'w', encoding='utf-8') as file:
+            file.write(self.render())
+        os.replace(tmp_filename, filename)
+
+    def serve(self, port, host='127.0.0.1'):
+        """
+        Expose the metrics at http://host:port/metrics (in a background thread)
+        """
+        if not self.enabled or self.server is not None:
+            return
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True).start()
+        logging.info(f"Metrics available at http://{host}:{port}/metrics")
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server = None
@@ -1,8 +1,30 @@
+import atexit
+import importlib.util
 import logging
 import sys, os
-import json
 import yaml
-import pandas as pd
+from utils.log_handlers import LogQueue
+
+
+def lazy_import(name):
+    """
+    Import a module lazily: the module is actually loaded on first attribute access.
+    Used for heavy packages (pandas, matplotlib, ccxt) to speed up the startup.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+pd = lazy_import('pandas')
 
 
 def load_config(file):
@@ -10,32 +32,85 @@ def load_config(file):
         return yaml.load(file, Loader=yaml.FullLoader)
 
 
-def register_logger(log_file=None, stdout=True):
+_log_queue = None
+
+
+def register_logger(log_file=None, stdout=True, cfg=None):
+    """
+    Set up the root logger. Records are queued and written by a background thread (see LogQueue).
+    Args:
+        log_file: text log, rotated according to LOG_MAX_BYTES / LOG_ROTATE_WHEN / LOG_BACKUPS of cfg
+        stdout: if True, log to the standard output too
+        cfg: configuration (optional logging settings). With LOG_JSON, records are also written as json lines
+            next to log_file (log.jsonl)
+    """
+    global _log_queue
+    cfg = cfg or {}
     log = logging.getLogger()  # root logger
     for hdlr in log.handlers[:]:  # remove all old handlers
         log.removeHandler(hdlr)
-
-    handlers = []
+    if _log_queue is not None:
+        _log_queue.stop()
+    else:
+        atexit.register(lambda: _log_queue.stop())
 
     formatter = logging.Formatter("%(asctime)s %(levelname)s%(message)s",
                                   "%Y-%m-%d %H:%M:%S")
+    _log_queue = LogQueue(formatter, max_bytes=cfg.get('LOG_MAX_BYTES', 10*1024*1024),
+                          when=cfg.get('LOG_ROTATE_WHEN'), backups=cfg.get('LOG_BACKUPS', 5))
 
     if stdout:
-        handlers.append(logging.StreamHandler(stream=sys.stdout))
+        handler = logging.StreamHandler(stream=sys.stdout)
+        handler.setFormatter(formatter)
+        _log_queue.add_handler(handler)
 
     if log_file is not None:
-        handlers.append(logging.FileHandler(log_file))
-
-    for h in handlers:
-        h.setFormatter(formatter)
+        _log_queue.add_handler(_log_queue.file_handler(log_file))
+        if cfg.get('LOG_JSON', False):
+            _log_queue.add_handler(_log_queue.file_handler(os.path.splitext(log_file)[0] + '.jsonl',
+                                                           json_lines=True))
 
-    logging.basicConfig(handlers=handlers)
+    logging.basicConfig(handlers=[_log_queue.handler])
+    _log_queue.start()
 
     logging.addLevelName(logging.INFO, '')
     logging.addLevelName(logging.ERROR, 'ERROR ')
     logging.addLevelName(logging.WARNING, 'WARNING ')
 
     logging.root.setLevel(logging.INFO)
+    return _log_queue
+
+
+def add_log_file(log_file, record_filter=None):
+    """
+    Write (part of) the records to another log file, rotated as the main one. Filters of the records must
+    not depend on the state of the logging thread (see register_logger)
+    """
+    handler = _log_queue.file_handler(log_file)
+    if record_filter is not None:
+        handler.addFilter(record_filter)
+    return _log_queue.add_handler(handler)
+
+
+def format_table(rows, columns, index_name=''):
+    """
+    Format a table as plain text (similar to DataFrame.to_string, without the need of pandas)
+    Args:
+        rows: list of (index, list of values)
+        columns: column names
+        index_name: name of the index column
+    """
+    table = [[str(index_name)] + [str(col) for col in columns]]
+    for index, values in rows:
+        table.append([str(index)] + [str(value) for value in values])
+    widths = [max(len(row[i]) for row in table) for i in range(len(table[0]))]
+    lines = []
+    for row in table:
+        line = row[0].ljust(widths[0])
+        for value, width in zip(row[1:], widths[1:]):
+            line += '  ' + value.rjust(width)
+        lines.append(line.rstrip())
+    return '\n'.join(lines)
 
 
 def read_csv_custom(filepath):
@@ -47,22 +122,30 @@ def read_csv_custom(filepath):
     return df
 
 
-def store_json_order(filename, order):
+def truncate_partial_line(filename):
     """
-    Save order into local json file
+    If the last write to a text file was interrupted, the file does not end with a newline: truncate the partial
+    line so that the next append starts on a clean line. Return True if the file was truncated
     """
-    if not os.path.exists(filename):
-        data = []
-    else:
-        # 1. Read file contents
-        with open(filename, "r") as file:
-            data = json.load(file)
-    # 2. Update json object
-    data.append(order)
-
-    # 3. Write json file
-    with open(filename, "w") as file:
-        json.dump(data, file, indent=4)
+    if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+        return False
+    with open(filename, 'rb+') as file:
+        file.seek(-1, os.SEEK_END)
+        if file.read(1) == b'\n':
+            return False
+        # walk back to the last complete line
+        position = file.tell() - 1
+        while position > 0:
+            step = min(4096, position)
+            position -= step
+            file.seek(position)
+            chunk = file.read(step)
+            index = chunk.rfind(b'\n')
+            if index >= 0:
+                position += index + 1
+                break
+        file.truncate(position)
+    return True
 
 
 def are_you_sure_to_continue():
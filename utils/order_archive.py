@@ -0,0 +1,278 @@
+"""
+Columnar archive (Parquet) of the filled orders, for fast analytics on long histories.
+The orders are stored with typed columns (missing fees are nulls, not 'N.A.'), partitioned by coin and month:
+    archive/coin=BTC/month=2022-05/part-....parquet
+Reads are memory-mapped and filtered by coin/time at the partition and row-group level, so per-coin stats and
+charts only load the rows they need. pyarrow is an optional dependency (pip install pyarrow).
+Fees paid in several currencies are null (they are kept by currency in orders_fees.csv or in the fees table).
+
+Build the archive of an existing trades folder and show the stats:
+    python -m utils.order_archive build trades/
+    python -m utils.order_archive stats trades/archive --coin BTC --start 2023-01-01
+"""
+import argparse
+import datetime
+import logging
+import os
+from pathlib import Path
+import uuid
+from utils.misc import lazy_import, format_table, round_price
+
+pd = lazy_import('pandas')
+pa = lazy_import('pyarrow')
+pc = lazy_import('pyarrow.compute')
+ds = lazy_import('pyarrow.dataset')
+pq = lazy_import('pyarrow.parquet')
+pa_csv = lazy_import('pyarrow.csv')
+pa_fs = lazy_import('pyarrow.fs')
+
+# columns of the ledger (orders.csv) and their type. Fees are nullable
+archive_columns = [('N', 'int64'),
+                   ('datetime (local)', 'string'),
+                   ('datetime (exchange)', 'string'),
+                   ('timestamp', 'int64'),
+                   ('coin', 'string'),
+                   ('symbol', 'string'),
+                   ('status', 'string'),
+                   ('filled', 'float64'),
+                   ('price', 'float64'),
+                   ('cost', 'float64'),
+                   ('remaining', 'float64'),
+                   ('fee', 'float64'),
+                   ('fee currency', 'string'),
+                   ('fee rate', 'float64')]
+
+fee_columns = ['fee', 'fee currency', 'fee rate']
+
+
+def to_month(timestamp):
+    """Month partition (YYYY-MM) of a timestamp in ms"""
+    return datetime.datetime.fromtimestamp(timestamp / 1000, datetime.timezone.utc).strftime('%Y-%m')
+
+
+def to_timestamp(value):
+    """Timestamp in ms of a datetime, a date string (e.g., '2023-01-01') or a timestamp"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+class OrderArchive(object):
+    """
+    Parquet dataset of the orders, partitioned by coin and month (hive layout). Each append writes a small file in
+    the partition of the order, and a partition is compacted into a single file once it has "max_files" files.
+    """
+    def __init__(self, folder, max_files=64):
+        """
+        Args:
+            folder: root folder of the dataset
+            max_files: number of files after which a partition is compacted
+        """
+        self.folder = Path(folder)
+        self.max_files = max_files
+        self.schema = pa.schema([(name, getattr(pa, kind)()) for name, kind in archive_columns]
+                                + [('month', pa.string())])
+        # the partition columns are not stored in the files
+        self.file_schema = pa.schema([field for field in self.schema if field.name not in ['coin', 'month']])
+        self.partitioning = ds.partitioning(pa.schema([('coin', pa.string()), ('month', pa.string())]),
+                                            flavor='hive')
+        self.filesystem = pa_fs.LocalFileSystem(use_mmap=True)
+
+    def is_empty(self):
+        return not self.folder.is_dir() or not any(self.folder.rglob('*.parquet'))
+
+    def dataset(self):
+        return ds.dataset(str(self.folder), schema=self.schema, format='parquet', partitioning=self.partitioning,
+                          filesystem=self.filesystem)
+
+    def to_table(self, df):
+        """
+        Convert orders (columns of orders.csv, indexed by N) to an arrow table of the archive schema
+        """
+        df = df.reset_index().rename(columns={'index': 'N'})
+        for name in fee_columns:
+            if name in df.columns:
+                df[name] = df[name].where(df[name] != 'N.A.', None)
+        for name in ['filled', 'price', 'cost', 'remaining', 'fee', 'fee rate']:
+            df[name] = pd.to_numeric(df[name], errors='coerce')
+        df['month'] = [to_month(timestamp) for timestamp in df['timestamp']]
+        return pa.Table.from_pandas(df[self.schema.names], schema=self.schema, preserve_index=False)
+
+    def write(self, table):
+        ds.write_dataset(table, str(self.folder), format='parquet', partitioning=self.partitioning,
+                         basename_template=f'part-{uuid.uuid4().hex}-{{i}}.parquet',
+                         existing_data_behavior='overwrite_or_ignore', filesystem=self.filesystem)
+
+    def append(self, df):
+        """
+        Append orders (a DataFrame with the columns of orders.csv, indexed by N)
+        """
+        if df.shape[0] == 0:
+            return
+        table = self.to_table(df)
+        self.write(table)
+        for coin, month in set(zip(table['coin'].to_pylist(), table['month'].to_pylist())):
+            self.compact(coin, month)
+
+    def import_csv(self, filename, start_n=0):
+        """
+        Append the orders of a ledger (orders.csv) from N = start_n. The csv is parsed by the (multi-threaded)
+        arrow reader, with 'N.A.' read as null.
+        """
+        column_types = {name: getattr(pa, kind)() for name, kind in archive_columns}
+        table = pa_csv.read_csv(str(filename),
+                                convert_options=pa_csv.ConvertOptions(column_types=column_types,
+                                                                      null_values=['N.A.', ''],
+                                                                      strings_can_be_null=True))
+        if start_n > 0:
+            table = table.filter(pc.greater_equal(table['N'], start_n))
+        if table.num_rows == 0:
+            return 0
+        months = pc.strftime(pc.cast(table['timestamp'], pa.timestamp('ms')), format='%Y-%m')
+        table = table.append_column('month', months).select(self.schema.names).cast(self.schema)
+        self.write(table)
+        return table.num_rows
+
+    def fragments(self, coin, month):
+        expression = (ds.field('coin') == coin) & (ds.field('month') == month)
+        return [fragment.path for fragment in self.dataset().get_fragments(filter=expression)]
+
+    def compact(self, coin, month, force=False):
+        """
+        Merge the files of a partition into a single file (sorted by N)
+        """
+        paths = self.fragments(coin, month)
+        if len(paths) < 2 or (len(paths) < self.max_files and not force):
+            return
+        self.rewrite(paths, pq.read_table(paths, schema=self.file_schema, memory_map=True))
+
+    def rewrite(self, paths, table):
+        """
+        Replace the files of a partition with a single file containing table
+        """
+        folder = os.path.dirname(paths[0])
+        tmp_filename = os.path.join(folder, '_rewrite.tmp')
+        pq.write_table(table.sort_by('N'), tmp_filename)
+        os.replace(tmp_filename, os.path.join(folder, f'part-{uuid.uuid4().hex}-0.parquet'))
+        for path in paths:
+            os.remove(path)
+
+    def update(self, values):
+        """
+        Change some values of archived orders ({N: {column: value}}, e.g., fees resolved later on).
+        The partitions of the orders are rewritten.
+        """
+        if self.is_empty() or not values:
+            return
+        located = self.dataset().to_table(columns=['N', 'coin', 'month'],
+                                          filter=ds.field('N').isin([int(n) for n in values]))
+        partitions = set(zip(located['coin'].to_pylist(), located['month'].to_pylist()))
+        for coin, month in partitions:
+            paths = self.fragments(coin, month)
+            df = pq.read_table(paths, schema=self.file_schema, memory_map=True).to_pandas()
+            df = df.astype({name: object for name in fee_columns}).set_index('N')
+            for n, row in values.items():
+                if n in df.index:
+                    for column, value in row.items():
+                        df.at[n, column] = value
+            df['coin'] = coin
+            self.rewrite(paths, self.to_table(df).drop_columns(['coin', 'month']))
+
+    def filter(self, coin=None, start=None, end=None):
+        """
+        Expression selecting the orders of a coin (or list of coins) between start and end. Coin and month prune
+        the partitions, the timestamp bounds are pushed down to the row groups.
+        """
+        conditions = []
+        if coin is not None:
+            conditions.append(ds.field('coin').isin([coin] if isinstance(coin, str) else list(coin)))
+        start, end = to_timestamp(start), to_timestamp(end)
+        if start is not None:
+            conditions += [ds.field('month') >= to_month(start), ds.field('timestamp') >= start]
+        if end is not None:
+            conditions += [ds.field('month') <= to_month(end), ds.field('timestamp') < end]
+        if not conditions:
+            return None
+        expression = conditions[0]
+        for condition in conditions[1:]:
+            expression = expression & condition
+        return expression
+
+    def read_table(self, coin=None, start=None, end=None, columns=None):
+        """
+        Return the selected orders as an arrow table sorted by N
+        """
+        if self.is_empty():
+            return self.schema.empty_table() if columns is None else \
+                pa.schema([self.schema.field(name) for name in columns]).empty_table()
+        read_columns = None if columns is None else list(dict.fromkeys(list(columns) + ['N']))
+        table = self.dataset().to_table(columns=read_columns, filter=self.filter(coin, start, end))
+        table = table.sort_by('N')
+        return table if columns is None else table.select(columns)
+
+    def read(self, coin=None, start=None, end=None, columns=None):
+        """
+        Return the selected orders as a DataFrame indexed by N (fees as nullable columns)
+        """
+        columns = None if columns is None else list(columns)
+        table = self.read_table(coin, start, end, None if columns is None else ['N'] + columns)
+        df = table.to_pandas(types_mapper={pa.float64(): pd.Float64Dtype(), pa.string(): pd.StringDtype()}.get)
+        return df.set_index('N')
+
+    def coin_values(self, coin, column):
+        """
+        Return the values of a column (price, cost or filled) for the orders of a given coin
+        """
+        return self.read_table(coin=coin, columns=[column])[column].to_pylist()
+
+    def coin_stats_frame(self, coin=None, start=None, end=None):
+        """
+        Return the columns needed by CoinStats (coin, price, cost, filled) of the selected orders
+        """
+        table = self.read_table(coin, start, end, columns=['coin', 'price', 'cost', 'filled'])
+        return table.to_pandas()
+
+    def next_n(self):
+        """
+        Return the N of the next order (0 if the archive is empty)
+        """
+        if self.is_empty():
+            return 0
+        n = pc.max(self.dataset().to_table(columns=['N'])['N']).as_py()
+        return 0 if n is None else n + 1
+
+
+if __name__ == "__main__":
+
+    from utils.stats_and_plots import CoinStats
+
+    parser = argparse.ArgumentParser(description='Parquet archive of the orders')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='archive (or update the archive of) a trades folder')
+    build.add_argument('trades', help='trades folder (with orders.csv)')
+    build.add_argument('--archive', help='archive folder (default: TRADES/archive)')
+    stats = subparsers.add_parser('stats', help='stats of the archived orders')
+    stats.add_argument('archive', help='archive folder')
+    stats.add_argument('--coin', nargs='*', help='coins (default: all)')
+    stats.add_argument('--start', help='first day (e.g., 2023-01-01)')
+    stats.add_argument('--end', help='last day (excluded)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'build':
+        archive = OrderArchive(args.archive or Path(args.trades) / 'archive')
+        n = archive.import_csv(Path(args.trades) / 'orders.csv', start_n=archive.next_n())
+        logging.info(f"{n} orders archived in {archive.folder}")
+    else:
+        archive = OrderArchive(args.archive)
+        coin_stats = CoinStats(archive.coin_stats_frame(args.coin, args.start, args.end))
+        rows = []
+        for coin in coin_stats.aggregates:
+            n, quantity, avg, cost, roi, roi_pct = coin_stats.row(coin)
+            rows.append((coin, [n, f'{quantity:g}', round_price(avg), round_price(cost), round_price(roi),
+                                f'{roi_pct:.2f}']))
+        print(format_table(rows, CoinStats.columns, index_name='Coin'))
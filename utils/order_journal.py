@@ -0,0 +1,120 @@
+import json
+import logging
+import os
+from utils.misc import truncate_partial_line
+
+
+class OrderJournal(object):
+    """
+    Append-only journal of the filled orders (one JSON object per line, i.e. JSON Lines).
+    Every purchase costs one appended line, regardless of the size of the history.
+    """
+    def __init__(self, filename, fsync=False, compact_every=500, legacy_filename=None):
+        """
+        Args:
+            filename: path of the journal (.jsonl)
+            fsync: if True, force every appended order to disk (safer but slower on SD cards)
+            compact_every: compact the journal every n appended orders (0 or None to disable)
+            legacy_filename: old json file (a single array of orders) to be migrated, if any (it is left in place)
+        """
+        self.filename = filename
+        self.fsync = fsync
+        self.compact_every = compact_every
+        self.appended = 0
+
+        if legacy_filename is not None and os.path.exists(legacy_filename) and not os.path.exists(filename):
+            self.migrate(legacy_filename)
+
+        self.repair_tail()
+
+    def append(self, order):
+        """
+        Append an order to the journal
+        """
+        line = json.dumps(order, separators=(',', ':')) + '\n'
+        with open(self.filename, 'a', encoding='utf-8') as file:
+            file.write(line)
+            if self.fsync:
+                file.flush()
+                os.fsync(file.fileno())
+        self.appended += 1
+
+        if self.compact_every and self.appended >= self.compact_every:
+            self.compact()
+
+    def __iter__(self):
+        return self.read()
+
+    def read(self):
+        """
+        Lazily yield the stored orders. Corrupted lines (e.g., an interrupted write) are skipped.
+        """
+        return read_journal(self.filename)
+
+    def compact(self):
+        """
+        Rewrite the journal dropping corrupted lines and duplicated orders (same id).
+        The new file is written aside and then renamed, so that a crash never loses the history.
+        """
+        self.appended = 0
+        if not os.path.exists(self.filename):
+            return
+        tmp_filename = str(self.filename) + '.tmp'
+        seen = set()
+        with open(tmp_filename, 'w', encoding='utf-8') as file:
+            for order in self.read():
+                order_id = order.get('id') if isinstance(order, dict) else None
+                if order_id is not None:
+                    if order_id in seen:
+                        continue
+                    seen.add(order_id)
+                file.write(json.dumps(order, separators=(',', ':')) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_filename, self.filename)
+
+    def migrate(self, legacy_filename):
+        """
+        One-shot migration from the old json array file, done while the journal does not exist. The old file is
+        not changed (e.g., for older versions or other tools reading it): the journal only appears once complete,
+        so an interrupted migration is done again at the next start.
+        """
+        with open(legacy_filename, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        tmp_filename = str(self.filename) + '.tmp'
+        with open(tmp_filename, 'w', encoding='utf-8') as file:
+            for order in data:
+                file.write(json.dumps(order, separators=(',', ':')) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_filename, self.filename)
+        logging.info(f"Migrated {len(data)} orders from {legacy_filename} to {self.filename}")
+
+    def repair_tail(self):
+        """
+        If the last write was interrupted, the journal does not end with a newline.
+        Truncate the partial line so that the next append starts on a clean line.
+        """
+        if truncate_partial_line(self.filename):
+            logging.warning(f"Removed an incomplete order from {self.filename}")
+
+
+def read_journal(filename, legacy_filename=None):
+    """
+    Lazily yield the orders of a journal, or of the old json array file if the journal does not exist, without
+    changing any file (e.g., to import a trades folder). Corrupted lines are skipped.
+    """
+    if not os.path.exists(filename):
+        if legacy_filename is not None and os.path.exists(legacy_filename):
+            with open(legacy_filename, 'r', encoding='utf-8') as file:
+                yield from json.load(file)
+        return
+    with open(filename, 'r', encoding='utf-8') as file:
+        for n, line in enumerate(file):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logging.warning(f"Skipping corrupted line {n + 1} in {filename}")
@@ -0,0 +1,76 @@
+import logging
+import threading
+import time
+from utils.misc import lazy_import
+
+ccxt = lazy_import('ccxt')
+
+
+class QuoteSnapshot(object):
+    """
+    Snapshot of the last prices of all the configured symbols. The prices are fetched with a single
+    fetch_tickers call (or with one fetch_ticker call per symbol if the exchange does not support it: the client
+    is not used concurrently) and reused as long as they are fresh, so that the buy decision and the order sizing
+    use the same quote.
+    """
+    def __init__(self, exchange, symbols, max_age=5):
+        """
+        Args:
+            exchange: ccxt exchange
+            symbols: symbols to fetch (e.g., ['BTC/USDT', 'XRP/BUSD'])
+            max_age: time (in seconds) a quote is considered fresh
+        """
+        self.exchange = exchange
+        self.symbols = list(symbols)
+        self.max_age = max_age
+        self.quotes = {}  # symbol -> {'symbol', 'last', 'timestamp'} (timestamp is the local fetch time)
+        self.lock = threading.Lock()
+
+    def get(self, symbol):
+        """
+        Return the quote of a symbol, refreshing the snapshot if the quote is missing or stale. Raise
+        ExchangeNotAvailable (retried as a network error) if the exchange does not return it
+        """
+        if self.cached_price(symbol) is None:
+            self.refresh()
+            if self.cached_price(symbol) is None:
+                self.refresh([symbol])
+            if self.cached_price(symbol) is None:
+                raise ccxt.ExchangeNotAvailable(f"{self.exchange.id} returned no price for {symbol}")
+        return self.quotes[symbol]
+
+    def price(self, symbol):
+        return self.get(symbol)['last']
+
+    def cached_price(self, symbol):
+        """
+        Return the last price in the snapshot (without refreshing it), or None if missing or stale
+        """
+        quote = self.quotes.get(symbol)
+        if quote is None or time.time() - quote['timestamp'] > self.max_age:
+            return None
+        return quote['last']
+
+    def refresh(self, symbols=None):
+        """
+        Fetch the last prices of the given symbols (all the configured symbols by default)
+        """
+        if symbols is None:
+            symbols = self.symbols
+        with self.lock:
+            if self.exchange.has.get('fetchTickers') is True and len(symbols) > 1:
+                tickers = self.exchange.fetch_tickers(symbols)
+            else:
+                tickers = {symbol: self.exchange.fetch_ticker(symbol) for symbol in symbols}
+            now = time.time()
+            for symbol in symbols:
+                if symbol not in tickers:
+                    logging.warning(f"No ticker returned for {symbol}")
+                    continue
+                self.quotes[symbol] = {'symbol': symbol,
+                                       'last': tickers[symbol]['last'],
+                                       'timestamp': now}
+        return self.quotes
+
+    def invalidate(self):
+        self.quotes = {}
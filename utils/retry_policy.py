@@ -0,0 +1,166 @@
+import datetime
+import logging
+import random
+import threading
+import time
+from utils.timing import retry_info
+
+
+class RetryPolicy(object):
+    """
+    Delays of the new attempts after a failed purchase: exponential backoff (base * factor^(attempt - 1), capped
+    at max_delay) with random jitter, so that the retries of different coins and bots do not hit the exchange
+    all at the same time.
+    """
+    def __init__(self, attempts, base, factor=2, max_delay=None, jitter=0.2):
+        """
+        Args:
+            attempts: maximum number of attempts (after which the purchase is skipped)
+            base: delay (in seconds) of the first attempt
+            factor: growth of the delay at each attempt (1 for a fixed delay)
+            max_delay: maximum delay in seconds (no limit if None)
+            jitter: relative random variation of the delay (e.g., 0.2 is +/- 20%)
+        """
+        self.attempts = attempts
+        self.base = base
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def delay(self, attempt):
+        """
+        Return the delay (in seconds) before the given attempt (starting from 1), or False if there are no
+        attempts left
+        """
+        if attempt > self.attempts:
+            return False
+        delay = self.base * self.factor ** (attempt - 1)
+        if self.max_delay is not None:
+            delay = min(delay, self.max_delay)
+        if self.jitter:
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(round(delay), 1)
+
+
+def retry_policies(cfg):
+    """
+    Return the retry policies of each cycle for the funds errors and for the network errors, as two dictionaries
+    cycle -> RetryPolicy. The number of attempts and the (maximum) delays are the ones of retry_info. The delays of
+    the network errors grow from RETRY_BASE with a factor RETRY_BACKOFF, capped at RETRY_MAX_DELAY.
+    """
+    retry_for_funds, retry_for_network = retry_info()
+    funds = {cycle: RetryPolicy(attempts, delay, factor=1, jitter=0)
+             for cycle, (attempts, delay) in retry_for_funds.items()}
+    network = {cycle: RetryPolicy(attempts, min(cfg.get('RETRY_BASE', 60), delay),
+                                  factor=cfg.get('RETRY_BACKOFF', 2),
+                                  max_delay=cfg.get('RETRY_MAX_DELAY') or delay,
+                                  jitter=cfg.get('RETRY_JITTER', 0.2))
+               for cycle, (attempts, delay) in retry_for_network.items()}
+    return funds, network
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker of an exchange, shared by all the coins (and portfolios) trading on it.
+    After "threshold" consecutive network errors (or a single DDoSProtection), the breaker opens: no order is sent
+    to the exchange for "cooldown" seconds, and the purchases due in the meantime are postponed to the reopening.
+    Then the breaker is half-open: a single purchase probes the exchange. If it succeeds the breaker closes and the
+    postponed purchases go on (together), otherwise it opens again with a doubled cooldown (up to max_cooldown).
+    """
+    def __init__(self, name, threshold=3, cooldown=300, max_cooldown=3600, metrics=None):
+        """
+        Args:
+            name: exchange (for the messages)
+            threshold: consecutive network errors opening the breaker
+            cooldown: seconds the breaker stays open the first time
+            max_cooldown: maximum seconds the breaker stays open
+            metrics: Metrics counting the openings of the breaker
+        """
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.metrics = metrics
+        self.failures = 0
+        self.openings = 0  # consecutive openings (the cooldown doubles at each one)
+        self.open_until = None  # monotonic time of the reopening, None if closed
+        self.reopen_time = None  # same, as a local datetime (used to reschedule the purchases)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cfg, metrics=None):
+        return cls(cfg['EXCHANGE'].lower(), threshold=cfg.get('BREAKER_THRESHOLD', 3),
+                   cooldown=cfg.get('BREAKER_COOLDOWN', 300), max_cooldown=cfg.get('BREAKER_MAX_COOLDOWN', 3600),
+                   metrics=metrics)
+
+    def is_open(self):
+        """
+        True if no order should be sent to the exchange now
+        """
+        with self.lock:
+            return self.open_until is not None and time.monotonic() < self.open_until
+
+    def is_half_open(self):
+        """
+        True if the cooldown is over, but no purchase has succeeded since (the next one is a probe)
+        """
+        with self.lock:
+            return self.open_until is not None and time.monotonic() >= self.open_until
+
+    def record_success(self):
+        with self.lock:
+            if self.open_until is not None:
+                logging.info(f"{self.name} is reachable again: purchases resumed")
+            self.failures = 0
+            self.openings = 0
+            self.open_until = self.reopen_time = None
+
+    def record_failure(self, immediate=False):
+        """
+        Count a network error. Return True if the breaker opens (or opens again)
+        Args:
+            immediate: open the breaker regardless of the number of errors (e.g., DDoSProtection)
+        """
+        with self.lock:
+            self.failures += 1
+            probe_failed = self.open_until is not None and time.monotonic() >= self.open_until
+            if not (immediate or probe_failed or self.failures >= self.threshold):
+                return False
+            cooldown = min(self.cooldown * 2 ** self.openings, self.max_cooldown) * random.uniform(1, 1.1)
+            self.openings += 1
+            self.open_until = time.monotonic() + cooldown
+            self.reopen_time = datetime.datetime.today() + datetime.timedelta(seconds=cooldown)
+        logging.warning(f"Too many errors from {self.name}: purchases paused until "
+                        f"{self.reopen_time.strftime('%d %b %Y at %H:%M:%S')}")
+        if self.metrics is not None:
+            self.metrics.count('circuit_breaker', '', 'open')
+        return True
+
+    def resume_time(self):
+        """
+        Return the (local) datetime at which the purchases can go on (None if the breaker is closed)
+        """
+        with self.lock:
+            return self.reopen_time if self.open_until is not None else None
+
+    def state(self):
+        """
+        Return the state of the breaker (json-serializable, see restore)
+        """
+        with self.lock:
+            reopen_time = self.reopen_time.isoformat() if self.open_until is not None else None
+            return {'failures': self.failures, 'openings': self.openings, 'reopen_time': reopen_time}
+
+    def restore(self, state):
+        """
+        Restore the state of the breaker (e.g., saved before a restart)
+        """
+        with self.lock:
+            self.failures = state['failures']
+            self.openings = state['openings']
+            if state['reopen_time'] is None:
+                self.open_until = self.reopen_time = None
+            else:
+                self.reopen_time = datetime.datetime.fromisoformat(state['reopen_time'])
+                remaining = (self.reopen_time - datetime.datetime.today()).total_seconds()
+                self.open_until = time.monotonic() + remaining
@@ -0,0 +1,159 @@
+import heapq
+import json
+import sqlite3
+import threading
+
+
+class Scheduler(object):
+    """
+    Priority queue of the next purchases (coin -> purchase time). It can be used as a dictionary, but
+    the closest purchase is found in O(1) and a coin is rescheduled in O(log n).
+    Coins with the same purchase time are returned in the order they were first scheduled.
+    """
+    def __init__(self):
+        self.heap = []
+        self.entries = {}  # coin -> [time, rank, coin, valid]
+        self.ranks = {}  # coin -> insertion order (used to break ties)
+        self.changed = set()  # coins rescheduled since the last call to pop_changed
+
+    def __setitem__(self, coin, when):
+        self.schedule(coin, when)
+
+    def __getitem__(self, coin):
+        return self.entries[coin][0]
+
+    def __contains__(self, coin):
+        return coin in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def schedule(self, coin, when):
+        """
+        Set (or update) the purchase time of a coin
+        """
+        if coin in self.entries:
+            # the old entry stays in the heap but is ignored from now on
+            self.entries[coin][3] = False
+        rank = self.ranks.setdefault(coin, len(self.ranks))
+        entry = [when, rank, coin, True]
+        self.entries[coin] = entry
+        heapq.heappush(self.heap, entry)
+        self.changed.add(coin)
+
+        if len(self.heap) > 2 * len(self.entries) + 16:
+            # too many stale entries: rebuild the heap
+            self.heap = [entry for entry in self.heap if entry[3]]
+            heapq.heapify(self.heap)
+
+    def remove(self, coin):
+        entry = self.entries.pop(coin)
+        entry[3] = False
+        self.changed.discard(coin)
+
+    def peek(self):
+        """
+        Return the closest purchase as a tuple (coin, time)
+        """
+        while not self.heap[0][3]:
+            heapq.heappop(self.heap)
+        when, _, coin, _ = self.heap[0]
+        return coin, when
+
+    def items(self):
+        """
+        Return all the purchases (coin, time) sorted by time (full sort: for occasional use, e.g. summaries)
+        """
+        return [(entry[2], entry[0]) for entry in sorted(self.entries.values())]
+
+    def times(self):
+        """
+        Return the purchase time of every coin (dictionary coin -> time, not sorted)
+        """
+        return {coin: entry[0] for coin, entry in self.entries.items()}
+
+    def due(self, until):
+        """
+        Return the coins scheduled up to "until" (included), sorted by time.
+        The heap is walked from its root, only through the entries up to "until" (stale entries included, since
+        their children may be valid): the cost depends on the number of due coins, not on the size of the book.
+        """
+        due = []
+        frontier = [(self.heap[0], 0)] if self.heap and self.heap[0][0] <= until else []
+        while frontier:
+            entry, i = heapq.heappop(frontier)
+            if entry[3]:
+                due.append(entry[2])
+            for child in [2 * i + 1, 2 * i + 2]:
+                if child < len(self.heap) and self.heap[child][0] <= until:
+                    heapq.heappush(frontier, (self.heap[child], child))
+        return due
+
+    def pop_changed(self):
+        """
+        Return the coins rescheduled since the last call (and reset them)
+        """
+        changed = self.changed
+        self.changed = set()
+        return changed
+
+
+class KeyedStore(object):
+    """
+    Tiny persistent key-value store (sqlite) for json-serializable values.
+    Each write only touches the entries that changed. The accesses to the connection are serialized by "lock",
+    which must be the one of the other users of the connection when it is shared.
+    """
+    def __init__(self, filename, table='store', connection=None, lock=None):
+        """
+        Args:
+            filename: sqlite database (ignored if a connection is given)
+            table: table of the store
+            connection: open sqlite connection shared with other tables (e.g., SQLiteStorage)
+            lock: lock guarding the shared connection (e.g., SQLiteStorage.lock)
+        """
+        self.table = table
+        if connection is None:
+            connection = sqlite3.connect(str(filename), check_same_thread=False)
+        self.connection = connection
+        self.lock = lock if lock is not None else threading.RLock()
+        with self.lock:
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value TEXT)")
+            self.connection.commit()
+
+    def get(self, key, default=None):
+        with self.lock:
+            row = self.connection.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def update(self, items):
+        """
+        Store several entries (a dictionary key -> value) in a single transaction
+        """
+        with self.lock:
+            with self.connection:
+                self.connection.executemany(f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)",
+                                            [(key, json.dumps(value)) for key, value in items.items()])
+
+    def delete(self, key):
+        with self.lock:
+            with self.connection:
+                self.connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def items(self):
+        with self.lock:
+            rows = self.connection.execute(f"SELECT key, value FROM {self.table}").fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,265 @@
+import asyncio
+import datetime
+import itertools
+import random
+import time
+from utils.misc import lazy_import
+
+ccxt = lazy_import('ccxt')
+
+
+class SimulatedExchange(object):
+    """
+    Deterministic in-process stand-in of a ccxt exchange, implementing the methods used by the bot.
+    Prices follow a scripted path, balances are updated by the fills, and latency and errors can be injected,
+    so that the bot can be tested and benchmarked without network access.
+    """
+    def __init__(self, price_path, balance=None, exchange_id='binance', latency=0, errors=None, seed=0,
+                 fee_rate=0.001, report_fees=True, fill_delay=0, advance_on_order=True, min_cost=1):
+        """
+        Args:
+            price_path: dictionary symbol -> list of prices (e.g., {'BTC/USDT': [30000, 29500, ...]}).
+                The last price is kept once the path is over
+            balance: initial free balance (e.g., {'USDT': 1000})
+            exchange_id: id of the simulated exchange (orders with "quoteOrderQty" are accepted only if 'binance')
+            latency: seconds added to every call, or dictionary method -> seconds
+            errors: dictionary method -> probability (0-1) or list of exception classes (None for a successful
+                call) raised on the successive calls. E.g., {'create_order': [ccxt.NetworkError, None]}
+            seed: seed of the error injection (the same seed gives the same errors)
+            fee_rate: fee rate of the orders (paid in the pairing currency)
+            report_fees: if False, orders are returned without fee (they are available from the trades)
+            fill_delay: seconds after which a new order is closed (it is returned open until then)
+            advance_on_order: move every price one step along its path after each order
+            min_cost: minimum cost of an order (market limits)
+        """
+        self.id = exchange_id
+        self.has = {'fetchTickers': True, 'fetchOrderTrades': True, 'fetchMyTrades': True}
+        self.options = {}
+        self.markets = {}
+        self.currencies = {}
+        self.price_path = {symbol: list(prices) for symbol, prices in price_path.items()}
+        self.steps = {symbol: 0 for symbol in self.price_path}
+        self.balance = dict(balance or {})
+        self.latency = latency
+        self.errors = {method: list(error) if isinstance(error, (list, tuple)) else error
+                       for method, error in (errors or {}).items()}
+        self.random = random.Random(seed)
+        self.fee_rate = fee_rate
+        self.report_fees = report_fees
+        self.fill_delay = fill_delay
+        self.advance_on_order = advance_on_order
+        self.min_cost = min_cost
+
+        self.ids = itertools.count(1)
+        self.orders = {}  # id -> closed order
+        self.trades = {}  # id -> list of trades
+        self.fills = {}  # id -> time at which the order is closed
+        self.calls = {}  # method -> number of calls
+        self.time_in_latency = 0.0  # total latency injected (seconds)
+
+    # --- simulation ---
+
+    def call(self, method, latency=None):
+        """
+        Account for a call: inject the latency (the one of the method, unless given by the caller, e.g.
+        AsyncSimulatedExchange) and the errors of the method
+        """
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if latency is None:
+            latency = self.latency_of(method)
+        if latency > 0:
+            time.sleep(latency)
+            self.time_in_latency += latency
+        error = self.errors.get(method)
+        if isinstance(error, list):
+            if error:
+                error = error.pop(0)
+                if error is not None:
+                    raise error(f"{self.id} {method} (simulated)")
+        elif error is not None and self.random.random() < error:
+            raise ccxt.NetworkError(f"{self.id} {method} (simulated)")
+
+    def latency_of(self, method):
+        return self.latency.get(method, 0) if isinstance(self.latency, dict) else self.latency
+
+    def price(self, symbol):
+        path = self.price_path[symbol]
+        return float(path[min(self.steps[symbol], len(path) - 1)])
+
+    def advance(self, steps=1):
+        """
+        Move all the prices along their path
+        """
+        for symbol in self.steps:
+            self.steps[symbol] += steps
+
+    @staticmethod
+    def now():
+        timestamp = int(time.time() * 1000)
+        iso = datetime.datetime.fromtimestamp(timestamp / 1000, datetime.timezone.utc)
+        iso = iso.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+        return timestamp, iso
+
+    # --- ccxt interface ---
+
+    def market_of(self, symbol):
+        base, quote = symbol.split('/')
+        return {'id': base + quote, 'symbol': symbol, 'base': base, 'quote': quote, 'type': 'spot', 'spot': True,
+                'active': True, 'precision': {'amount': 6, 'price': 2},
+                'limits': {'amount': {'min': None, 'max': None}, 'price': {'min': None, 'max': None},
+                           'cost': {'min': self.min_cost, 'max': None}}}
+
+    def load_markets(self, reload=False):
+        if not self.markets or reload:
+            self.call('load_markets')
+            self.markets = {symbol: self.market_of(symbol) for symbol in self.price_path}
+        return self.markets
+
+    def set_markets(self, markets, currencies=None):
+        self.markets = {market['symbol']: market for market in markets}
+        if currencies is not None:
+            self.currencies = currencies
+        return self.markets
+
+    def set_sandbox_mode(self, enabled):
+        pass
+
+    def market(self, symbol):
+        self.load_markets()
+        if symbol not in self.markets:
+            raise ccxt.BadSymbol(f"{self.id} does not have market symbol {symbol}")
+        return self.markets[symbol]
+
+    def amount_to_precision(self, symbol, amount):
+        digits = self.market(symbol)['precision']['amount']
+        return f"{int(amount * 10**digits) / 10**digits:.{digits}f}"
+
+    def fetch_balance(self):
+        self.call('fetch_balance')
+        balance = {'info': {}, 'free': {}, 'used': {}, 'total': {}}
+        for currency, amount in self.balance.items():
+            balance[currency] = {'free': amount, 'used': 0.0, 'total': amount}
+            balance['free'][currency] = amount
+            balance['used'][currency] = 0.0
+            balance['total'][currency] = amount
+        return balance
+
+    def fetch_ticker(self, symbol, latency=None):
+        self.call('fetch_ticker', latency)
+        return self.ticker(symbol)
+
+    def fetch_tickers(self, symbols=None):
+        self.call('fetch_tickers')
+        return {symbol: self.ticker(symbol) for symbol in (symbols or self.price_path)}
+
+    def ticker(self, symbol):
+        if symbol not in self.price_path:
+            raise ccxt.BadSymbol(f"{self.id} does not have market symbol {symbol}")
+        timestamp, iso = self.now()
+        last = self.price(symbol)
+        return {'symbol': symbol, 'timestamp': timestamp, 'datetime': iso, 'last': last, 'close': last,
+                'bid': last, 'ask': last}
+
+    def create_order(self, symbol, type, side, amount, price=None, params={}, latency=None):
+        self.call('create_order', latency)
+        market = self.market(symbol)
+        if type != 'market' or side != 'buy':
+            raise ccxt.InvalidOrder(f"{self.id} only market buy orders are simulated")
+        last = self.price(symbol)
+        if 'quoteOrderQty' in params:
+            if 'binance' not in self.id:
+                raise ccxt.InvalidOrder(f"{self.id} quoteOrderQty is not supported")
+            filled = float(self.amount_to_precision(symbol, float(params['quoteOrderQty']) / last))
+        else:
+            filled = float(amount)
+        cost = filled * last
+        if cost < market['limits']['cost']['min']:
+            raise ccxt.InvalidOrder(f"{self.id} order cost {cost} below the minimum")
+        if cost > self.balance.get(market['quote'], 0):
+            raise ccxt.InsufficientFunds(f"{self.id} account has insufficient balance for the requested action")
+
+        fee = {'currency': market['quote'], 'cost': cost * self.fee_rate, 'rate': self.fee_rate}
+        self.balance[market['quote']] = self.balance.get(market['quote'], 0) - cost - fee['cost']
+        self.balance[market['base']] = self.balance.get(market['base'], 0) + filled
+
+        order_id = str(next(self.ids))
+        timestamp, iso = self.now()
+        order = {'id': order_id, 'clientOrderId': None, 'timestamp': timestamp, 'datetime': iso,
+                 'lastTradeTimestamp': timestamp, 'symbol': symbol, 'type': type, 'side': side, 'price': last,
+                 'amount': filled, 'cost': cost, 'average': last, 'filled': filled, 'remaining': 0.0,
+                 'status': 'closed', 'fee': fee if self.report_fees else None, 'trades': [], 'info': {}}
+        self.orders[order_id] = order
+        self.trades[order_id] = [{'id': order_id, 'order': order_id, 'timestamp': timestamp, 'datetime': iso,
+                                  'symbol': symbol, 'side': side, 'price': last, 'amount': filled, 'cost': cost,
+                                  'fee': dict(fee)}]
+        if self.advance_on_order:
+            self.advance()
+
+        if self.fill_delay > 0:
+            self.fills[order_id] = time.monotonic() + self.fill_delay
+            return dict(order, status='open', filled=0.0, remaining=filled, cost=0.0, average=None)
+        return dict(order)
+
+    def fetch_order(self, id, symbol=None, params={}, latency=None):
+        self.call('fetch_order', latency)
+        if id not in self.orders:
+            raise ccxt.OrderNotFound(f"{self.id} order {id} not found")
+        if time.monotonic() < self.fills.get(id, 0):
+            order = self.orders[id]
+            return dict(order, status='open', filled=0.0, remaining=order['amount'], cost=0.0, average=None)
+        return dict(self.orders[id])
+
+    def fetch_order_trades(self, id, symbol=None, since=None, limit=None, params={}):
+        self.call('fetch_order_trades')
+        return [dict(trade) for trade in self.trades.get(id, [])]
+
+    def fetch_my_trades(self, symbol=None, since=None, limit=None, params={}):
+        self.call('fetch_my_trades')
+        trades = [dict(trade) for order_trades in self.trades.values() for trade in order_trades
+                  if (symbol is None or trade['symbol'] == symbol) and (since is None or trade['timestamp'] >= since)]
+        trades.sort(key=lambda trade: (trade['timestamp'], int(trade['id'])))
+        return trades if limit is None else trades[:limit]
+
+    def reduce_fees_by_currency(self, fees):
+        reduced = {}
+        for fee in fees:
+            if fee['currency'] in reduced:
+                reduced[fee['currency']]['cost'] += fee['cost']
+            else:
+                reduced[fee['currency']] = dict(fee)
+        return list(reduced.values())
+
+    def close(self):
+        pass
+
+
+class AsyncSimulatedExchange(object):
+    """
+    Asynchronous version of a SimulatedExchange (same state), to be used with the AsyncExecutionEngine
+    """
+    def __init__(self, exchange):
+        self.exchange = exchange
+
+    def __getattr__(self, name):
+        # attributes and synchronous helpers (id, has, markets, amount_to_precision...)
+        return getattr(self.exchange, name)
+
+    async def run(self, method, *args, **kwargs):
+        # latency is simulated by the event loop, so that concurrent calls overlap (and not again by the call)
+        latency = self.exchange.latency_of(method)
+        if latency > 0:
+            await asyncio.sleep(latency)
+            self.exchange.time_in_latency += latency
+        return getattr(self.exchange, method)(*args, latency=0, **kwargs)
+
+    async def fetch_ticker(self, symbol):
+        return await self.run('fetch_ticker', symbol)
+
+    async def create_order(self, symbol, type, side, amount, price=None, params={}):
+        return await self.run('create_order', symbol, type, side, amount, price, params)
+
+    async def fetch_order(self, id, symbol=None, params={}):
+        return await self.run('fetch_order', id, symbol, params)
+
+    async def close(self):
+        pass
@@ -1,28 +1,33 @@
-import matplotlib.pyplot as plt
 from utils.misc import *
 
+np = lazy_import('numpy')
+matplotlib = lazy_import('matplotlib')
 
-def plot_purchases(coin, df_orders, pairing):
-    prices = df_orders['price'][df_orders['coin'] == coin].values
-    costs = df_orders['cost'][df_orders['coin'] == coin].values
+
+def plot_purchases(fig, coin, prices, costs, pairing):
+    """
+    Draw the chart of the purchases of a coin onto "fig" (a matplotlib Figure)
+    """
+    prices = np.asarray(prices, dtype=float)
+    costs = np.asarray(costs, dtype=float)
     # Calculate the weighted average
     avg = (prices * costs).sum() / costs.sum()
 
-    plt.rcParams.update({'font.size': 12})
+    matplotlib.rcParams.update({'font.size': 12})
 
-    fig, ax = plt.subplots()
+    ax = fig.subplots()
 
     color_text_lines = '#6c6c72'
 
-    plt.plot(prices, '-o', color='#6f7a8f', mfc='#d0aa93', linewidth=0.4, markersize=9)
-    plt.axhline(y=avg, color='#da6517', linestyle='-', linewidth=0.8)
+    ax.plot(prices, '-o', color='#6f7a8f', mfc='#d0aa93', linewidth=0.4, markersize=9)
+    ax.axhline(y=avg, color='#da6517', linestyle='-', linewidth=0.8)
 
-    plt.title(f'{coin} | Average {round_price(avg)} {pairing}',
-              color=color_text_lines)
+    ax.set_title(f'{coin} | Average {round_price(avg)} {pairing}',
+                 color=color_text_lines)
     ax.ticklabel_format(useOffset=False, style='plain')
-    plt.ylabel(pairing, color=color_text_lines)
-    plt.xlabel('Purchases', color=color_text_lines)
-    plt.xticks([], [])
+    ax.set_ylabel(pairing, color=color_text_lines)
+    ax.set_xlabel('Purchases', color=color_text_lines)
+    ax.set_xticks([], [])
 
     # ax.grid('on', linestyle='--', linewidth=0.5, alpha = 0.5)
     ax.xaxis.set_tick_params(size=0)
@@ -36,36 +41,71 @@ def plot_purchases(coin, df_orders, pairing):
     ax.spines['right'].set_visible(False)
     ax.spines['top'].set_visible(False)
 
-    plt.tight_layout()
-
-    plt.savefig(f'trades/graph_{coin}.png')
-    plt.close()
-
 
-def calculate_stats(coin, df_orders, df_stats, stats_path):
+class CoinStats(object):
+    """
+    Running aggregates of the purchases of each coin: number of orders, sum(cost), sum(price*cost),
+    sum(filled) and last price. They are updated at every fill, so that stats do not depend on the
+    size of the order history.
+    """
+    columns = ['N', 'Quantity', 'AvgPrice', 'TotalCost', 'ROI', 'ROI%']
+
+    def __init__(self, df_orders=None):
+        self.aggregates = {}
+        if df_orders is not None and df_orders.shape[0] > 0:
+            self.rebuild(df_orders)
+
+    def rebuild(self, df_orders):
+        """
+        Rebuild the aggregates from the whole ledger (single groupby pass)
+        """
+        df = df_orders[['coin', 'price', 'cost', 'filled']].astype({'price': float, 'cost': float, 'filled': float})
+        df = df.assign(price_cost=df['price'] * df['cost'])
+        grouped = df.groupby('coin', sort=False).agg(n=('cost', 'size'),
+                                                     cost=('cost', 'sum'),
+                                                     price_cost=('price_cost', 'sum'),
+                                                     filled=('filled', 'sum'),
+                                                     last_price=('price', 'last'))
+        self.aggregates = {coin: row for coin, row in zip(grouped.index, grouped.to_dict('records'))}
+
+    def update(self, coin, price, cost, filled):
+        """
+        Add a new fill to the aggregates of the coin
+        """
+        agg = self.aggregates.setdefault(coin, {'n': 0, 'cost': 0.0, 'price_cost': 0.0, 'filled': 0.0,
+                                                'last_price': None})
+        agg['n'] += 1
+        agg['cost'] += cost
+        agg['price_cost'] += price * cost
+        agg['filled'] += filled
+        agg['last_price'] = price
+
+    def row(self, coin):
+        """
+        Return the stats of a coin in the same order as "columns"
+        """
+        agg = self.aggregates[coin]
+        # Calculate the weighted average
+        avg = agg['price_cost'] / agg['cost']
+        # ROI
+        roi = 100 * (agg['last_price'] - avg) / agg['last_price']
+        # Gain/Loss:
+        gain = roi * agg['cost'] / 100
+        return [agg['n'], agg['filled'], avg, agg['cost'], gain, roi]
+
+    def to_frame(self):
+        df_stats = pd.DataFrame([self.row(coin) for coin in self.aggregates],
+                                index=list(self.aggregates), columns=self.columns)
+        df_stats.index.name = 'Coin'
+        return df_stats
+
+
+def calculate_stats(coin, coin_stats, df_stats, stats_path):
     '''
-    Given the df_orders calculate stats and append to df_stats,
+    Given the running aggregates (coin_stats) update the stats of the coin in df_stats,
         also, save to disk the stat df
     '''
-    prices = df_orders['price'][df_orders['coin'] == coin].values
-    costs = df_orders['cost'][df_orders['coin'] == coin].values
-    # fees = df_orders['fee'][df_orders['coin'] == coin].values
-
-    # Calculate the weighted average
-    avg = (prices * costs).sum() / costs.sum()
-    # Total asset accumulated
-    fills = df_orders['filled'][df_orders['coin'] == coin].values
-    total_asset = fills.sum()
-    # Total cost:
-    total_cost = costs.sum()
-
-    # ROI
-    roi = 100 * (prices[-1] - avg) / prices[-1]
-    # Gain/Loss:
-    gain = roi * total_cost / 100
-
-    df_stats.loc[coin] = [len(prices), total_asset, avg, total_cost, gain, roi]
+    df_stats.loc[coin] = coin_stats.row(coin)
     # save stats to disk
     df_stats.to_csv(stats_path)
     return df_stats
-    
\ No newline at end of file
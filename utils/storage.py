@@ -0,0 +1,455 @@
+"""
+Storage of the orders, the stats and the schedule of the bot.
+- FileStorage: orders.jsonl (raw orders), orders.csv (ledger), stats.csv and next_purchases.db
+- SQLiteStorage: a single database (trades.db) in WAL mode, each purchase is written in one transaction
+Both can keep a columnar copy of the orders (ARCHIVE: True, see utils/order_archive.py), from which the file
+storage then reads the stats and the chart values.
+
+The sqlite database can be exported to the csv files, and existing trades folders can be imported:
+    python -m utils.storage export trades/trades.db trades/
+    python -m utils.storage import trades/ trades/trades.db
+"""
+import argparse
+import csv
+import datetime
+import json
+import logging
+import os
+from pathlib import Path
+import sqlite3
+import threading
+from utils.exchange import fee_rows
+from utils.ledger import OrderLedger
+from utils.metrics import Metrics
+from utils.misc import lazy_import, read_csv_custom
+from utils.order_journal import OrderJournal, read_journal
+from utils.scheduler import KeyedStore
+from utils.stats_and_plots import CoinStats, calculate_stats
+
+pd = lazy_import('pandas')
+
+fee_columns = ['fee', 'fee currency', 'fee rate']
+
+# columns of the ledger (orders.csv) -> columns of the orders table
+ledger_columns = {'datetime (local)': 'datetime_local',
+                  'datetime (exchange)': 'datetime_exchange',
+                  'timestamp': 'timestamp',
+                  'coin': 'coin',
+                  'symbol': 'symbol',
+                  'status': 'status',
+                  'filled': 'filled',
+                  'price': 'price',
+                  'cost': 'cost',
+                  'remaining': 'remaining',
+                  'fee': 'fee',
+                  'fee currency': 'fee_currency',
+                  'fee rate': 'fee_rate'}
+
+
+def open_storage(cfg, trades_dir, metrics=None):
+    """
+    Return the storage selected in the configuration (STORAGE: 'files' or 'sqlite')
+    """
+    kind = cfg.get('STORAGE', 'files').lower()
+    trades_dir = Path(trades_dir)
+    if kind == 'files':
+        storage = FileStorage(trades_dir, fsync=cfg.get('JOURNAL_FSYNC', False), metrics=metrics)
+    elif kind == 'sqlite':
+        storage = SQLiteStorage(trades_dir / 'trades.db', metrics=metrics)
+        if storage.is_empty() and (trades_dir / 'orders.csv').exists():
+            logging.info(f"Importing the orders of {trades_dir} into {storage.filename}...")
+            storage.import_trades(trades_dir)
+    else:
+        error_string = 'STORAGE should be "files" or "sqlite".'
+        logging.error(error_string)
+        raise Exception(error_string)
+
+    if cfg.get('ARCHIVE', False):
+        try:
+            from utils.order_archive import OrderArchive
+        except ModuleNotFoundError:
+            error_string = 'ARCHIVE requires pyarrow (pip install pyarrow).'
+            logging.error(error_string)
+            raise Exception(error_string)
+        storage.archive = OrderArchive(trades_dir / 'archive')
+        storage.sync_archive()
+    return storage
+
+
+class Storage(object):
+    """
+    Interface of the storages. "schedule" is a key-value store (see KeyedStore) of the next purchases.
+    "lock" serializes the accesses of the threads using the storage.
+    """
+    def __init__(self, metrics=None):
+        self.metrics = metrics if metrics is not None else Metrics('')
+        self.schedule = None
+        self.archive = None  # optional OrderArchive
+        self.lock = threading.RLock()
+
+    def coin_stats(self):
+        """Return the running aggregates (CoinStats) of the stored orders"""
+        raise NotImplementedError
+
+    def coin_values(self, coin, column):
+        """Return the values of a column (price, cost or filled) for the orders of a given coin"""
+        raise NotImplementedError
+
+    def orders_frame(self):
+        """Return all the orders as a DataFrame (same columns as orders.csv, indexed by N)"""
+        raise NotImplementedError
+
+    def fee_table(self):
+        """Return the fees stored by currency (columns N, fee, fee currency, fee rate, as orders_fees.csv)"""
+        raise NotImplementedError
+
+    def last_order_time(self, coin):
+        """
+        Return the local time (datetime) at which the last order of a coin was recorded (None if no order)
+        """
+        values = self.coin_values(coin, 'datetime (local)')
+        return datetime.datetime.fromisoformat(str(values[-1])) if len(values) > 0 else None
+
+    def record_purchase(self, coin, order, df, coin_stats):
+        """
+        Store a filled order.
+        Args:
+            coin: coin bought
+            order: order as returned by the exchange
+            df: order as returned by order_to_dataframe
+            coin_stats: CoinStats already updated with the order
+        Returns the index (N) of the order.
+        """
+        raise NotImplementedError
+
+    def update_fees(self, fees):
+        """
+        Set the fees of recorded orders: {N: [(fee, fee currency, fee rate), ...]}, one tuple per currency
+        (see fee_rows). Fees paid in a single currency are set in the orders, the others are stored by currency.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def split_fees(order):
+        """
+        Return the fees of a new order paid in several currencies ([] otherwise: they are in its ledger row)
+        """
+        fees = fee_rows(order.get('fees') or [order.get('fee')])
+        return fees if len(fees) > 1 else []
+
+    def next_n(self):
+        """Return the N of the next order"""
+        raise NotImplementedError
+
+    def sync_archive(self):
+        """
+        Add to the archive the stored orders it does not have yet (e.g., when it is enabled on an existing folder)
+        """
+        start = self.archive.next_n()
+        if start < self.next_n():
+            logging.info(f"Archiving the orders from N = {start} into {self.archive.folder}...")
+            df = self.orders_frame()
+            self.archive.append(df[df.index >= start])
+
+    def archive_orders(self, coin, df):
+        """
+        Append the new orders (indexed by N) to the archive, if enabled
+        """
+        if self.archive is not None:
+            with self.metrics.timer('archive', coin):
+                self.archive.append(df)
+
+    def archive_fees(self, fees):
+        # the archive only has the single-currency fees
+        if self.archive is not None:
+            self.archive.update({n: dict(zip(fee_columns, rows[0])) for n, rows in fees.items() if len(rows) == 1})
+
+    def close(self):
+        pass
+
+    def export_csv(self, folder):
+        """
+        Write orders.csv, stats.csv and next_purchases.csv (same format as the file storage) into folder
+        """
+        folder = Path(folder)
+        folder.mkdir(parents=True, exist_ok=True)
+        df = self.orders_frame()
+        if df.shape[0] > 0:
+            df.to_csv(folder / 'orders.csv')
+        fees = self.fee_table()
+        if fees.shape[0] > 0:
+            fees.to_csv(folder / 'orders_fees.csv', index=False)
+        self.coin_stats().to_frame().to_csv(folder / 'stats.csv')
+        entries = sorted(self.schedule.items(), key=lambda item: item[1]['Purchase Time'])
+        with open(folder / 'next_purchases.csv', 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['Coin', 'Purchase Time', 'Cycle', 'Strategy'])
+            for coin, entry in entries:
+                writer.writerow([coin, entry['Purchase Time'], entry['Cycle'], entry.get('Strategy', '')])
+
+
+class FileStorage(Storage):
+    """
+    Orders stored in orders.jsonl (raw) and orders.csv (ledger), stats in stats.csv and schedule in next_purchases.db
+    """
+    def __init__(self, trades_dir, fsync=False, metrics=None):
+        super().__init__(metrics)
+        trades_dir = Path(trades_dir)
+        self.ledger = OrderLedger(trades_dir / 'orders.csv')  # read on first use
+        # older versions stored a single json array: it is migrated
+        self.journal = OrderJournal(trades_dir / 'orders.jsonl', fsync=fsync,
+                                    legacy_filename=trades_dir / 'orders.json')
+        self.stats_path = trades_dir / 'stats.csv'
+        self.df_stats = None
+        self.schedule = KeyedStore(trades_dir / 'next_purchases.db', table='schedule')
+
+    def coin_stats(self):
+        # the aggregates are rebuilt from the ledger (or from the needed columns of the archive)
+        with self.lock:
+            if self.archive is not None:
+                coin_stats = CoinStats(self.archive.coin_stats_frame())
+            else:
+                coin_stats = CoinStats(self.ledger.frame())
+        self.df_stats = coin_stats.to_frame()
+        return coin_stats
+
+    def coin_values(self, coin, column):
+        with self.lock:
+            if self.archive is not None:
+                # only the partitions of the coin are read
+                return self.archive.coin_values(coin, column)
+            return self.ledger.coin_values(coin, column)
+
+    def orders_frame(self):
+        with self.lock:
+            return self.ledger.frame()
+
+    def fee_table(self):
+        with self.lock:
+            return self.ledger.fee_table()
+
+    def next_n(self):
+        self.ledger.peek()
+        return self.ledger.n
+
+    def sync_archive(self):
+        # the ledger is parsed by arrow, not by pandas
+        start = self.archive.next_n()
+        if start < self.next_n():
+            logging.info(f"Archiving the orders from N = {start} into {self.archive.folder}...")
+            self.archive.import_csv(self.ledger.filename, start_n=start)
+            # fees resolved after the orders were recorded
+            fees = self.ledger.fee_table()
+            fees = fees[fees['N'] >= start]
+            self.archive_fees({n: list(group[fee_columns].itertuples(index=False, name=None))
+                               for n, group in fees.groupby('N')})
+
+    def record_purchase(self, coin, order, df, coin_stats):
+        with self.lock:
+            with self.metrics.timer('journal', coin):
+                self.journal.append(order)
+            with self.metrics.timer('ledger', coin):
+                df = self.ledger.append(df)
+                fees = self.split_fees(order)
+                if fees:
+                    self.ledger.add_fees({df.index[0]: fees})
+            self.archive_orders(coin, df)
+        with self.metrics.timer('stats', coin):
+            if self.df_stats is None:
+                self.df_stats = coin_stats.to_frame()
+            self.df_stats = calculate_stats(coin, coin_stats, self.df_stats, self.stats_path)
+        return df.index[0]
+
+    def update_fees(self, fees):
+        # appended to orders_fees.csv, orders.csv is not rewritten
+        with self.lock:
+            self.ledger.add_fees(fees)
+            self.archive_fees(fees)
+
+    def close(self):
+        self.schedule.close()
+
+
+class SQLiteStorage(Storage):
+    """
+    Orders, raw orders, stats (running aggregates) and schedule in a single sqlite database (WAL mode).
+    Each purchase is written in one transaction.
+    """
+    def __init__(self, filename, metrics=None):
+        super().__init__(metrics)
+        self.filename = filename
+        self.connection = sqlite3.connect(str(filename), check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS orders (N INTEGER PRIMARY KEY, '
+                                    'datetime_local TEXT, datetime_exchange TEXT, timestamp INTEGER, coin TEXT, '
+                                    'symbol TEXT, status TEXT, filled REAL, price REAL, cost REAL, remaining REAL, '
+                                    'fee REAL, fee_currency TEXT, fee_rate REAL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS orders_coin_timestamp ON orders (coin, timestamp)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS raw_orders (id TEXT PRIMARY KEY, N INTEGER, '
+                                    'timestamp INTEGER, payload TEXT)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS stats (coin TEXT PRIMARY KEY, n INTEGER, cost REAL, '
+                                    'price_cost REAL, filled REAL, last_price REAL)')
+            # fees paid in several currencies, one row per currency
+            self.connection.execute('CREATE TABLE IF NOT EXISTS fees (N INTEGER, fee REAL, fee_currency TEXT, '
+                                    'fee_rate REAL, PRIMARY KEY (N, fee_currency))')
+        # the schedule shares the connection (and its lock) with the orders
+        self.schedule = KeyedStore(filename, table='schedule', connection=self.connection, lock=self.lock)
+
+    def is_empty(self):
+        return self.connection.execute('SELECT COUNT(*) FROM orders').fetchone()[0] == 0
+
+    def coin_stats(self):
+        coin_stats = CoinStats()
+        with self.lock:
+            rows = self.connection.execute('SELECT coin, n, cost, price_cost, filled, last_price FROM stats').fetchall()
+        for coin, n, cost, price_cost, filled, last_price in rows:
+            coin_stats.aggregates[coin] = {'n': n, 'cost': cost, 'price_cost': price_cost, 'filled': filled,
+                                           'last_price': last_price}
+        return coin_stats
+
+    def coin_values(self, coin, column):
+        if column not in ['price', 'cost', 'filled', 'datetime (local)']:
+            raise Exception(f'Unknown column {column}')
+        column = ledger_columns.get(column, column)
+        with self.lock:
+            rows = self.connection.execute(f'SELECT {column} FROM orders WHERE coin = ? ORDER BY timestamp, N',
+                                           (coin,)).fetchall()
+        return [row[0] for row in rows]
+
+    def orders_frame(self):
+        with self.lock:
+            df = pd.read_sql_query('SELECT * FROM orders ORDER BY N', self.connection, index_col='N')
+        df = df.rename(columns={column: name for name, column in ledger_columns.items()})
+        for name in ['fee', 'fee currency', 'fee rate']:
+            df[name] = df[name].astype(object).where(df[name].notna(), 'N.A.')
+        return df
+
+    def fee_table(self):
+        with self.lock:
+            df = pd.read_sql_query('SELECT * FROM fees ORDER BY N', self.connection)
+        return df.rename(columns={column: name for name, column in ledger_columns.items()})
+
+    @staticmethod
+    def to_sql_value(value):
+        # 'N.A.' (missing fee) is stored as NULL
+        if value == 'N.A.' or (isinstance(value, float) and value != value):
+            return None
+        if hasattr(value, 'item'):
+            return value.item()  # numpy scalar
+        return value
+
+    def insert_orders(self, df, index):
+        """
+        Insert the orders of df (columns as in orders.csv) with the given N
+        """
+        rows = []
+        for n, row in zip(index, df.to_dict('records')):
+            rows.append([int(n)] + [self.to_sql_value(row.get(name)) for name in ledger_columns])
+        columns = ', '.join(['N'] + list(ledger_columns.values()))
+        placeholders = ', '.join('?' * (len(ledger_columns) + 1))
+        self.connection.executemany(f'INSERT OR REPLACE INTO orders ({columns}) VALUES ({placeholders})', rows)
+
+    def next_n(self):
+        return self.connection.execute('SELECT COALESCE(MAX(N) + 1, 0) FROM orders').fetchone()[0]
+
+    def write_stats(self, coin_stats, coins):
+        rows = [(coin, agg['n'], agg['cost'], agg['price_cost'], agg['filled'], agg['last_price'])
+                for coin, agg in coin_stats.aggregates.items() if coin in coins]
+        self.connection.executemany('INSERT OR REPLACE INTO stats (coin, n, cost, price_cost, filled, last_price) '
+                                    'VALUES (?, ?, ?, ?, ?, ?)', [[self.to_sql_value(x) for x in row] for row in rows])
+
+    def record_purchase(self, coin, order, df, coin_stats):
+        with self.lock:
+            with self.metrics.timer('transaction', coin):
+                with self.connection:
+                    n = self.next_n()
+                    self.insert_orders(df, range(n, n + df.shape[0]))
+                    self.connection.execute('INSERT OR REPLACE INTO raw_orders (id, N, timestamp, payload) '
+                                            'VALUES (?, ?, ?, ?)',
+                                            (str(order.get('id')), n, order.get('timestamp'),
+                                             json.dumps(order, separators=(',', ':'))))
+                    self.insert_fees({n: self.split_fees(order)})
+                    self.write_stats(coin_stats, [coin])
+            df = df.copy()
+            df.index = pd.RangeIndex(n, n + df.shape[0], name='N')
+            self.archive_orders(coin, df)
+        return n
+
+    def insert_fees(self, fees):
+        """
+        Store the fees paid in several currencies ({N: [(fee, fee currency, fee rate), ...]})
+        """
+        self.connection.executemany('INSERT OR REPLACE INTO fees (N, fee, fee_currency, fee_rate) VALUES (?, ?, ?, ?)',
+                                    [[int(n)] + [self.to_sql_value(x) for x in values]
+                                     for n, rows in fees.items() if len(rows) > 1 for values in rows])
+
+    def update_fees(self, fees):
+        with self.lock:
+            with self.connection:
+                self.connection.executemany('UPDATE orders SET fee = ?, fee_currency = ?, fee_rate = ? WHERE N = ?',
+                                            [[self.to_sql_value(x) for x in rows[0]] + [int(n)]
+                                             for n, rows in fees.items() if len(rows) == 1])
+                self.insert_fees(fees)
+            self.archive_fees(fees)
+
+    def import_trades(self, trades_dir):
+        """
+        Load a trades folder of the file storage (orders.csv, orders_fees.csv, orders.jsonl/orders.json,
+    next_purchases.db/csv)
+        """
+        trades_dir = Path(trades_dir)
+        with self.connection:
+            if (trades_dir / 'orders.csv').exists():
+                # fees of orders_fees.csv included
+                ledger = OrderLedger(trades_dir / 'orders.csv')
+                df = ledger.frame()
+                if df.shape[0] > 0:
+                    self.insert_orders(df, df.index)
+                    coin_stats = CoinStats(df)
+                    self.write_stats(coin_stats, list(coin_stats.aggregates))
+                fees = ledger.fee_table()
+                self.insert_fees({n: list(group[fee_columns].itertuples(index=False, name=None))
+                                  for n, group in fees.groupby('N')})
+
+            # read only: the imported folder is not changed
+            orders = read_journal(trades_dir / 'orders.jsonl', legacy_filename=trades_dir / 'orders.json')
+            self.connection.executemany('INSERT OR REPLACE INTO raw_orders (id, N, timestamp, payload) '
+                                        'VALUES (?, NULL, ?, ?)',
+                                        [(str(order.get('id')), order.get('timestamp'),
+                                          json.dumps(order, separators=(',', ':'))) for order in orders])
+
+        if (trades_dir / 'next_purchases.db').exists():
+            store = KeyedStore(trades_dir / 'next_purchases.db', table='schedule')
+            self.schedule.update(dict(store.items()))
+            store.close()
+        elif (trades_dir / 'next_purchases.csv').exists():
+            df = read_csv_custom(trades_dir / 'next_purchases.csv')
+            self.schedule.update({coin: {'Purchase Time': str(df.loc[coin]['Purchase Time']),
+                                         'Cycle': df.loc[coin]['Cycle'],
+                                         'Strategy': df.loc[coin].get('Strategy', '')} for coin in df.index})
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Import/export the sqlite storage of the bot')
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('source', help='trades folder (import) or database (export)')
+    parser.add_argument('destination', help='database (import) or folder of the csv files (export)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'import':
+        storage = SQLiteStorage(args.destination)
+        storage.import_trades(args.source)
+    else:
+        if not os.path.isfile(args.source):
+            raise Exception(f'{args.source} not found')
+        storage = SQLiteStorage(args.source)
+        storage.export_csv(args.destination)
+    storage.close()
@@ -1,3 +1,8 @@
+import datetime
+from dateutil.relativedelta import relativedelta
+import logging
+import time
+
 
 def get_on_weekday(x):
     """
@@ -43,6 +48,41 @@ def get_hour_minute(at_time):
     return [hours, minutes]
 
 
+def next_purchase_time(when, cycle):
+    """
+    Return the time of the purchase following the one at "when" for a given CYCLE
+    """
+    cycle = cycle.lower()
+    if cycle == 'minutely':  # only for testing purpose
+        return when + datetime.timedelta(minutes=1)
+    elif cycle == 'daily':
+        return when + datetime.timedelta(days=1)
+    elif cycle == 'bi-weekly':
+        return when + datetime.timedelta(days=14)
+    elif cycle == 'weekly':
+        return when + datetime.timedelta(days=7)
+    elif cycle == 'monthly':
+        return when + relativedelta(months=1)
+    raise Exception(f'Unknown CYCLE {cycle}')
+
+
+def sleep_until(deadline, max_slice=60):
+    """
+    Sleep until the (local) datetime "deadline", in slices of at most max_slice seconds. The remaining time is
+    computed again from the wall clock after each slice (measured with the monotonic clock), so that the drift
+    of long sleeps, suspend/resume and clock adjustments (e.g., NTP) are corrected.
+    """
+    while True:
+        remaining = (deadline - datetime.datetime.today()).total_seconds()
+        if remaining <= 0:
+            return
+        wall_start, start = time.time(), time.monotonic()
+        time.sleep(min(remaining, max_slice))
+        jump = (time.time() - wall_start) - (time.monotonic() - start)
+        if abs(jump) > 1:
+            logging.info(f"The clock jumped by {jump:.0f} s (suspend/resume or clock adjustment)")
+
+
 def retry_info():
     retry_for_funds = {}  # for funds error (insufficient balance)
     retry_for_network = {}  # generic network error
@@ -62,3 +102,29 @@ def retry_info():
     retry_for_network['monthly'] = [24, 1*60*60]
 
     return retry_for_funds, retry_for_network
+
+
+class StartupProfiler(object):
+    """
+    Measure the duration of the startup phases (see the --profile-startup option)
+    """
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.last = self.start
+        self.phases = []
+
+    def mark(self, name):
+        """
+        Close the current phase (started at the previous mark) naming it "name"
+        """
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def report(self):
+        total = self.last - self.start
+        lines = ['Startup profile:']
+        for name, duration in self.phases:
+            lines.append(f"  {name:<32} {duration:8.3f} s  {100 * duration / total if total else 0:5.1f} %")
+        lines.append(f"  {'total':<32} {total:8.3f} s")
+        return '\n'.join(lines)
@@ -1,6 +1,8 @@
-import numpy as np
 import logging
-import matplotlib.pyplot as plt
+from utils.misc import lazy_import
+
+np = lazy_import('numpy')
+matplotlib = lazy_import('matplotlib')
 
 class PriceMapper(object):
     def __init__(self, amount_range, price_range, mapping_function, coin, pairing, n_points=1000):
@@ -15,6 +17,12 @@ class PriceMapper(object):
 
         self.n_points = n_points
 
+        # coefficients of the mapping functions (computed once)
+        self.slope = None
+        self.r = None
+        self.k = None
+        self.set_coefficients()
+
     def check_inputs(self):
 
         if len(self.prices) != 2:
@@ -27,31 +35,45 @@ class PriceMapper(object):
             error_string = 'Valid mapping functions are: "linear" and "exponential".'
             raise Exception(error_string)
 
+    def set_coefficients(self):
+        # storing variables in letters for readability
+        A = self.amounts[0]
+        B = self.amounts[1]
+
+        C = self.prices[0]
+        D = self.prices[1]
+
+        if self.function == 'linear':
+            self.slope = (B - A) / (D - C)
+        elif self.function == 'exponential':
+            self.r = (np.log(A) - np.log(B)) / ( D - C)
+            self.k = A * np.exp(- D * self.r)
 
-    def plot(self):
+    def plot(self, fig):
+        """
+        Draw the buy-condition chart onto "fig" (a matplotlib Figure)
+        """
         # increase upper limit to show in the graph
         upperlimit_price = self.prices[1] + 0.1*self.prices[1]
         upperlimit_amount = self.amounts[1] + 0.1 * self.amounts[1]
         x = np.linspace(0,upperlimit_price, num=self.n_points)
-        y = []
-        for i in x:
-            y.append(self.get_amount(i))
+        y = self.get_amounts(x)
 
-        plt.rcParams.update({'font.size': 12})
+        matplotlib.rcParams.update({'font.size': 12})
 
-        fig, ax = plt.subplots()
+        ax = fig.subplots()
 
         color_text_lines = '#6c6c72'
 
-        plt.axvline(x=self.prices[1], color='#da6517', linestyle='--', linewidth=0.8)
-        plt.plot(x,y, '-', color='#6f7a8f', linewidth=1.1)
+        ax.axvline(x=self.prices[1], color='#da6517', linestyle='--', linewidth=0.8)
+        ax.plot(x,y, '-', color='#6f7a8f', linewidth=1.1)
 
 
-        plt.title(f'{self.coin} | Buy Conditions',
-                  color=color_text_lines)
+        ax.set_title(f'{self.coin} | Buy Conditions',
+                     color=color_text_lines)
         ax.ticklabel_format(useOffset=False, style='plain')
-        plt.ylabel(f"Amount {self.pairing}", color=color_text_lines)
-        plt.xlabel(f"Price {self.coin}", color=color_text_lines)
+        ax.set_ylabel(f"Amount {self.pairing}", color=color_text_lines)
+        ax.set_xlabel(f"Price {self.coin}", color=color_text_lines)
 
 
         ax.grid('on', linestyle='--', linewidth=0.5, alpha = 0.5)
@@ -66,19 +88,14 @@ class PriceMapper(object):
         ax.spines['right'].set_visible(False)
         ax.spines['top'].set_visible(False)
 
-        plt.xlim([0, upperlimit_price])
-        plt.ylim([0, upperlimit_amount])
+        ax.set_xlim([0, upperlimit_price])
+        ax.set_ylim([0, upperlimit_amount])
 
-        leg = plt.legend(['Buy limit', 'Amount'])
+        leg = ax.legend(['Buy limit', 'Amount'])
         leg.get_frame().set_linewidth(0.0)
         for text in leg.get_texts():
             text.set_color(color_text_lines)
 
-        plt.tight_layout()
-
-        plt.savefig(f'trades/graph_{self.coin}_buy_conditions.png')
-        plt.close()
-
 
     def get_amount(self, price):
         if self.function == 'linear':
@@ -92,6 +109,35 @@ class PriceMapper(object):
             logging.error(error_string)
             raise Exception(error_string)
 
+    def get_amounts(self, prices):
+        """
+        Vectorized version of get_amount: map an array of prices onto an array of amounts
+        (same results as the scalar path)
+        """
+        prices = np.asarray(prices, dtype=float)
+
+        B = self.amounts[1]
+
+        C = self.prices[0]
+        D = self.prices[1]
+
+        if self.function == 'linear':
+            below = B
+            inside = lambda p: B + self.slope * (C - p)
+        elif self.function == 'exponential':
+            below = B
+            inside = lambda p: self.k * np.exp(self.r * p)
+        elif self.function == 'constant':
+            below = 0
+            inside = B
+        else:
+            error_string = 'Unrecognized mapping function'
+            logging.error(error_string)
+            raise Exception(error_string)
+
+        # the last function applies where neither condition is met (i.e., inside the price range)
+        return np.piecewise(prices, [prices < C, prices > D], [below, 0, inside])
+
     def linear(self, price):
         # storing variables in letters for readability
         A = self.amounts[0]
@@ -105,7 +151,7 @@ class PriceMapper(object):
         elif price > D:
             amount = 0
         else:
-            amount = B + ( (B - A) / (D - C)) * (C - price)
+            amount = B + self.slope * (C - price)
         return amount
 
     def exponential(self, price):
@@ -116,15 +162,12 @@ class PriceMapper(object):
         C = self.prices[0]
         D = self.prices[1]
 
-        r = (np.log(A) - np.log(B)) / ( D - C)
-        k = A * np.exp(- D * r)
-
         if price < C:
             amount = B
         elif price > D:
             amount = 0
         else:
-            amount = k * np.exp(r * price)
+            amount = self.k * np.exp(self.r * price)
         return amount
 
     def constant(self, price):
@@ -145,3 +188,41 @@ class PriceMapper(object):
 
 
 
+
+
+def get_strategy(coin, coin_cfg):
+    """
+    Get the DCA strategy of a coin from its configuration.
+    Returns (strategy, mapper, strategy_string), where strategy is 'Classic', 'BuyBelow' or 'VariableAmount'
+    and mapper is the PriceMapper of the strategy (None for 'Classic')
+    """
+    if type(coin_cfg['AMOUNT']) is dict:
+
+        if 'RANGE' not in coin_cfg['AMOUNT'] or 'PRICE_RANGE' not in coin_cfg['AMOUNT'] or 'MAPPING' not in coin_cfg['AMOUNT']:
+            raise Exception('If AMOUNT is a dictionary the following keys are required: '
+                            '"AMOUNT", "PRICE_RANGE", "MAPPING".')
+        mapper = PriceMapper(coin_cfg['AMOUNT']['RANGE'],
+                             coin_cfg['AMOUNT']['PRICE_RANGE'],
+                             coin_cfg['AMOUNT']['MAPPING'],
+                             coin,
+                             coin_cfg['PAIRING'])
+        cost = f"{coin_cfg['AMOUNT']['RANGE'][0]}-" \
+               f"{coin_cfg['AMOUNT']['RANGE'][1]}"
+        price_range = f"{coin_cfg['AMOUNT']['PRICE_RANGE'][0]}-" \
+               f"{coin_cfg['AMOUNT']['PRICE_RANGE'][1]}"
+        strategy_string = f"{cost} {coin_cfg['PAIRING']} to {price_range} {coin} {coin_cfg['AMOUNT']['MAPPING'][0:3]}."
+        if 'BUYBELOW' in coin_cfg and coin_cfg['BUYBELOW'] is not None:
+            logging.warning('Option "BUYBELOW" is not compatible with a range of AMOUNT values. '
+                            'Disabling it')
+            coin_cfg['BUYBELOW'] = None
+        return 'VariableAmount', mapper, strategy_string
+    elif 'BUYBELOW' in coin_cfg and coin_cfg['BUYBELOW'] is not None:
+        # in this case the mapper is only used for plotting
+        mapper = PriceMapper([0, coin_cfg['AMOUNT']],
+                             [0, coin_cfg['BUYBELOW']],
+                             'constant',
+                             coin,
+                             coin_cfg['PAIRING'])
+        return 'BuyBelow', mapper, f"BuyBelow {coin_cfg['BUYBELOW']} {coin_cfg['PAIRING']}"
+    else:
+        return 'Classic', None, f"Classic"